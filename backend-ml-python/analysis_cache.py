@@ -0,0 +1,187 @@
+"""
+Cache des analyses d'images pour TwoInOne ML Backend
+Résultats du pipeline indexés par l'empreinte du fichier uploadé (LRU + TTL)
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Set
+
+from config import get_app_settings
+from metrics import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+
+def content_key(contents: bytes) -> bytes:
+    """Empreinte (BLAKE2b 128 bits) des octets d'une image"""
+    return hashlib.blake2b(contents, digest_size=16).digest()
+
+
+class _Entry(NamedTuple):
+    analysis: Any
+    expires_at: float
+    # Utilisateurs liés à l'image (auteur de l'enregistrement, identité reconnue)
+    user_ids: Set[str]
+
+
+class AnalysisCache:
+    """
+    Cache borné des résultats du pipeline (emplacements et encodage)
+
+    Une même photo renvoyée (nouvel essai réseau, double appui sur
+    "vérifier") ne repasse pas par le décodage, la détection et l'encodage.
+    Les entrées expirent après ttl secondes; au-delà de max_size, la moins
+    récemment utilisée est retirée. Les entrées liées à un utilisateur sont
+    supprimées avec ses encodages (invalidate_user).
+
+    Utilisé uniquement depuis la boucle d'événements: aucun verrou.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, _Entry]" = OrderedDict()
+        self._inflight: Dict[bytes, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, key: bytes, user_id: Optional[str] = None) -> Optional[Any]:
+        """
+        Résultat en cache pour cette empreinte (None si absent ou expiré)
+
+        Args:
+            key: Empreinte de l'image (content_key)
+            user_id: Utilisateur à lier à l'entrée en cas de succès
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        if user_id is not None:
+            entry.user_ids.add(user_id)
+        return entry.analysis
+
+    def put(self, key: bytes, analysis: Any, user_id: Optional[str] = None):
+        """Mémoriser un résultat, en retirant les entrées les plus anciennes si besoin"""
+        if not self.enabled:
+            return
+        user_ids = {user_id} if user_id is not None else set()
+        self._entries[key] = _Entry(analysis, time.monotonic() + self.ttl, user_ids)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def tag(self, key: bytes, user_id: str):
+        """Lier une entrée existante à un utilisateur (identité reconnue)"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.user_ids.add(user_id)
+
+    def invalidate_user(self, user_id: str) -> int:
+        """
+        Retirer les entrées liées à un utilisateur
+
+        Returns:
+            Nombre d'entrées retirées
+        """
+        keys = [key for key, entry in self._entries.items() if user_id in entry.user_ids]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get_or_compute(self, contents: bytes, compute, user_id: Optional[str] = None) -> Any:
+        """
+        Résultat en cache, ou calculé une seule fois pour des demandes simultanées
+
+        Args:
+            contents: Octets de l'image
+            compute: Fonction sans argument retournant la coroutine du pipeline
+            user_id: Utilisateur à lier à l'entrée
+
+        Returns:
+            Résultat du pipeline (les exceptions ne sont pas mises en cache)
+        """
+        if not self.enabled:
+            return await compute()
+
+        key = content_key(contents)
+        analysis = self.get(key, user_id)
+        if analysis is not None:
+            record_cache_lookup("hit")
+            return analysis
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            # Même image déjà en cours d'analyse: attendre son résultat
+            record_cache_lookup("coalesced")
+            analysis = await asyncio.shield(pending)
+            if analysis is not None:
+                if user_id is not None:
+                    self.tag(key, user_id)
+                return analysis
+            # L'analyse en cours a échoué: la refaire pour cette requête
+            return await compute()
+
+        record_cache_lookup("miss")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        analysis = None
+        try:
+            analysis = await compute()
+            self.put(key, analysis, user_id)
+            return analysis
+        finally:
+            del self._inflight[key]
+            future.set_result(analysis)
+
+
+# Instance globale (une par worker)
+_analysis_cache: Optional[AnalysisCache] = None
+
+
+def get_analysis_cache() -> AnalysisCache:
+    """Obtenir le cache des analyses (FACE_ANALYSIS_CACHE_SIZE = 0: désactivé)"""
+    global _analysis_cache
+    if _analysis_cache is None:
+        settings = get_app_settings()
+        _analysis_cache = AnalysisCache(
+            max_size=settings.FACE_ANALYSIS_CACHE_SIZE,
+            ttl=settings.FACE_ANALYSIS_CACHE_TTL_SECONDS
+        )
+    return _analysis_cache
+
+
+def remember_user(contents: bytes, user_id: str):
+    """Lier l'analyse d'une image à l'utilisateur reconnu sur cette image"""
+    cache = get_analysis_cache()
+    if cache.enabled:
+        cache.tag(content_key(contents), user_id)
+
+
+def invalidate_user_analyses(user_id: str) -> int:
+    """
+    Oublier les analyses liées à un utilisateur (suppression de ses encodages)
+
+    Returns:
+        Nombre d'entrées retirées
+    """
+    removed = get_analysis_cache().invalidate_user(user_id)
+    if removed:
+        logger.info(f"Cache des analyses: {removed} entrée(s) retirée(s) pour user_id: {user_id}")
+    return removed
@@ -0,0 +1,496 @@
+"""
+Recherche approchée (ANN) des encodages faciaux pour TwoInOne ML Backend
+Index IVF (partitions k-means) en NumPy pur pour les grandes galeries
+"""
+
+import threading
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from gallery import FaceGallery, ENCODING_DIM
+
+logger = logging.getLogger(__name__)
+
+# Nombre d'itérations de k-means à l'entraînement
+_KMEANS_ITERATIONS = 10
+
+# Nombre maximum de points échantillonnés par centroïde pour l'entraînement
+_TRAIN_POINTS_PER_LIST = 64
+
+# Capacité initiale de chaque partition (évite 1024 lignes réservées par partition)
+_LIST_CAPACITY = 16
+
+# Taille des blocs lors de l'affectation aux centroïdes (borne la mémoire)
+_ASSIGN_CHUNK = 16384
+
+
+def _squared_distances(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Distances euclidiennes au carré entre chaque ligne de data et chaque centroïde"""
+    squared = (
+        np.einsum("ij,ij->i", data, data)[:, None]
+        + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+        - 2.0 * (data @ centroids.T)
+    )
+    np.maximum(squared, 0.0, out=squared)
+    return squared
+
+
+def assign_to_centroids(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Indice du centroïde le plus proche pour chaque ligne de data"""
+    labels = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), _ASSIGN_CHUNK):
+        chunk = data[start:start + _ASSIGN_CHUNK]
+        labels[start:start + len(chunk)] = np.argmin(
+            _squared_distances(chunk, centroids), axis=1
+        )
+    return labels
+
+
+def train_kmeans(
+    data: np.ndarray,
+    k: int,
+    iterations: int = _KMEANS_ITERATIONS,
+    seed: int = 0
+) -> np.ndarray:
+    """
+    Entraîner k centroïdes (k-means de Lloyd) sur un échantillon des données
+
+    Args:
+        data: Matrice (N x D) float32
+        k: Nombre de partitions
+        iterations: Nombre d'itérations
+        seed: Graine du générateur aléatoire
+
+    Returns:
+        Matrice (k x D) des centroïdes
+    """
+    rng = np.random.default_rng(seed)
+    k = max(1, min(k, len(data)))
+
+    sample_size = min(len(data), k * _TRAIN_POINTS_PER_LIST)
+    sample = data[rng.choice(len(data), size=sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, size=k, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = assign_to_centroids(sample, centroids)
+        counts = np.bincount(labels, minlength=k)
+        filled = counts > 0
+
+        # Sommes par partition: tri par étiquette puis réduction par segments
+        order = np.argsort(labels, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+        centroids[filled] = sums / counts[filled, None]
+
+        # Réensemencer les partitions vides sur des points aléatoires
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(sample_size, size=len(empty))]
+
+    return centroids.astype(np.float32)
+
+
+class _IndexState(NamedTuple):
+    """Centroïdes et partitions produits par un entraînement"""
+    centroids: np.ndarray
+    lists: List[FaceGallery]
+    user_rows: Dict[str, List[Tuple[int, int]]]
+    size: int
+
+
+class IVFFaceIndex:
+    """
+    Index IVF (inverted file) des encodages faciaux
+
+    Les encodages sont répartis en `nlist` partitions k-means, chacune stockée
+    dans une FaceGallery. Une recherche ne balaie que les `nprobe` partitions
+    les plus proches de l'encodage à vérifier: nprobe est le compromis
+    rappel/latence (nprobe = nlist équivaut à la recherche exacte).
+
+    Les distances retournées sont les distances euclidiennes exactes des
+    candidats examinés, donc directement comparables à
+    FACE_RECOGNITION_THRESHOLD.
+
+    Quand l'index a doublé depuis son dernier entraînement, le
+    repartitionnement est fait dans un thread à partir d'une image de l'index:
+    les recherches et les ajouts continuent sur les anciennes partitions, et
+    les modifications faites pendant l'entraînement sont rejouées sur les
+    nouvelles avant leur mise en service. Un rechargement (load_arrays,
+    appelé hors de la boucle d'événements) procède de même.
+    """
+
+    def __init__(
+        self,
+        nlist: int = 0,
+        nprobe: int = 8,
+        min_train_size: int = 10000,
+        dim: int = ENCODING_DIM
+    ):
+        """
+        Args:
+            nlist: Nombre de partitions (0 = automatique, ~ 4 * sqrt(N))
+            nprobe: Nombre de partitions examinées par recherche
+            min_train_size: Taille de galerie en dessous de laquelle une seule
+                partition est utilisée (recherche exacte)
+            dim: Dimension des encodages
+        """
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = max(1, nprobe)
+        self.min_train_size = min_train_size
+        self._lock = threading.RLock()
+        self._centroids = np.zeros((1, dim), dtype=np.float32)
+        self._lists: List[FaceGallery] = [FaceGallery(dim, _LIST_CAPACITY)]
+        # user_id -> [(row_id, partition)] pour les suppressions et la limite par utilisateur
+        self._user_rows: Dict[str, List[Tuple[int, int]]] = {}
+        self._size = 0
+        self._trained_size = 0
+        self._loaded = False
+        # Modifications faites pendant un repartitionnement (None: aucun en cours)
+        self._journal: Optional[List[tuple]] = None
+        # Incrémenté à chaque load_arrays: un repartitionnement lancé avant est abandonné
+        self._generation = 0
+
+    @property
+    def is_loaded(self) -> bool:
+        """True si l'index a été chargé depuis la base"""
+        return self._loaded
+
+    @property
+    def is_writer(self) -> bool:
+        """True: l'index est propre à ce processus"""
+        return True
+
+    def __len__(self) -> int:
+        return self._size
+
+    def user_count(self) -> int:
+        """Nombre d'utilisateurs distincts présents dans l'index"""
+        return len(self._user_rows)
+
+    def load(self, rows: Iterable[Tuple[int, str, Iterable[float]]]):
+        """
+        Remplacer le contenu de l'index
+
+        Args:
+            rows: Itérable de tuples (id, user_id, encodage)
+        """
+        rows = list(rows)
+        row_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        encodings = np.array(
+            [np.asarray(row[2], dtype=np.float32) for row in rows], dtype=np.float32
+        ).reshape(-1, self.dim)
+        self.load_arrays(row_ids, [row[1] for row in rows], encodings)
+
+    def load_arrays(self, row_ids: Iterable[int], user_ids: Iterable[str], encodings: np.ndarray):
+        """
+        Remplacer le contenu de l'index et réentraîner les partitions
+
+        Args:
+            row_ids: IDs des lignes dans face_encodings
+            user_ids: user_id de chaque ligne
+            encodings: Matrice (N x 128) des encodages
+        """
+        encodings = np.ascontiguousarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        user_ids = np.asarray(list(user_ids), dtype=object)
+
+        # Entraînement hors verrou: l'ancien index sert les recherches et les
+        # modifications faites entre-temps sont rejouées sur le nouveau
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            if self._journal is None:
+                self._journal = []
+
+        state = self._train(row_ids, user_ids, encodings)
+        with self._lock:
+            if generation != self._generation:
+                # Rechargé à nouveau pendant l'entraînement: ce résultat est périmé
+                return
+            journal, self._journal = self._journal, None
+            self._apply(state)
+            self._replay(journal)
+            self._loaded = True
+
+        logger.info(
+            f"Index IVF chargé: {self._size} encodage(s), "
+            f"{len(self._lists)} partition(s), nprobe={self.nprobe}, "
+            f"{len(journal)} modification(s) rejouée(s)"
+        )
+
+    def add(
+        self,
+        row_id: int,
+        user_id: str,
+        encoding: Iterable[float],
+        max_per_user: Optional[int] = None
+    ):
+        """
+        Ajouter un encodage dans sa partition et appliquer la limite par utilisateur
+
+        Args:
+            row_id: ID de la ligne dans face_encodings
+            user_id: ID de l'utilisateur
+            encoding: Encodage facial (128 floats)
+            max_per_user: Nombre maximum d'encodages conservés pour cet utilisateur
+        """
+        vector = np.asarray(encoding, dtype=np.float32).reshape(1, -1)
+
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(("add", row_id, user_id, vector[0], max_per_user))
+            self._add(row_id, user_id, vector[0], max_per_user)
+
+            # La distribution a beaucoup changé depuis l'entraînement: repartitionner
+            if (
+                self._journal is None
+                and self._size >= self.min_train_size
+                and self._size >= 2 * max(self._trained_size, 1)
+            ):
+                self._start_retrain()
+
+    def remove_user(self, user_id: str) -> int:
+        """
+        Retirer tous les encodages d'un utilisateur
+
+        Returns:
+            Nombre d'encodages retirés
+        """
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(("trim", user_id, 0))
+            return self._trim_user(user_id, 0)
+
+    def replace_user(self, user_id: str, row_ids: Iterable[int], encodings: Iterable[Iterable[float]]):
+        """
+        Remplacer tous les encodages d'un utilisateur (resynchronisation depuis la base)
+
+        Args:
+            user_id: ID de l'utilisateur
+            row_ids: IDs des lignes de l'utilisateur dans face_encodings
+            encodings: Encodages correspondants
+        """
+        with self._lock:
+            self.remove_user(user_id)
+            for row_id, encoding in zip(row_ids, encodings):
+                self.add(row_id, user_id, encoding)
+
+    def export_arrays(self) -> Tuple[np.ndarray, List[str], np.ndarray]:
+        """Contenu de l'index sous la forme acceptée par load_arrays (ordre des ids)"""
+        with self._lock:
+            lists = self._lists
+        parts = [gallery.export_arrays() for gallery in lists]
+        row_ids = np.concatenate([part[0] for part in parts])
+        user_ids = [user_id for part in parts for user_id in part[1]]
+        encodings = np.concatenate([part[2] for part in parts]).reshape(-1, self.dim)
+
+        order = np.argsort(row_ids, kind="stable")
+        return row_ids[order], [user_ids[i] for i in order.tolist()], encodings[order]
+
+    def version(self) -> Tuple[int, int, int]:
+        """Signature du contenu: (nombre de lignes, id max, somme des ids)"""
+        with self._lock:
+            lists = self._lists
+        row_ids = np.concatenate([gallery.snapshot()[3] for gallery in lists])
+        row_ids = row_ids[row_ids >= 0]
+        if len(row_ids) == 0:
+            return 0, 0, 0
+        return len(row_ids), int(row_ids.max()), int(row_ids.sum())
+
+    def best_match(self, probe: Iterable[float]) -> Tuple[Optional[str], float]:
+        """
+        Trouver l'encodage le plus proche parmi les nprobe partitions les plus proches
+
+        Args:
+            probe: Encodage facial à comparer
+
+        Returns:
+            Tuple (user_id, distance euclidienne), (None, inf) si l'index est vide
+        """
+        vector = np.asarray(probe, dtype=np.float32).reshape(1, -1)
+
+        with self._lock:
+            centroids = self._centroids
+            lists = self._lists
+
+        nprobe = min(self.nprobe, len(lists))
+        distances = _squared_distances(vector, centroids)[0]
+        if nprobe < len(lists):
+            probed = np.argpartition(distances, nprobe - 1)[:nprobe]
+        else:
+            probed = range(len(lists))
+
+        best_user_id, best_distance = None, float("inf")
+        for partition in probed:
+            user_id, distance = lists[partition].best_match(vector[0])
+            if distance < best_distance:
+                best_user_id, best_distance = user_id, distance
+        return best_user_id, best_distance
+
+    def best_matches(self, probes: np.ndarray) -> List[Tuple[Optional[str], float]]:
+        """
+        Trouver le meilleur candidat pour plusieurs encodages
+
+        Chaque encodage examine ses propres partitions: la recherche reste
+        par encodage, seule l'affectation aux centroïdes est vectorisée.
+
+        Args:
+            probes: Matrice (M x 128) des encodages à comparer
+
+        Returns:
+            Liste de M tuples (user_id, distance euclidienne)
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        return [self.best_match(probe) for probe in probes]
+
+    def user_encodings(self, user_id: str) -> np.ndarray:
+        """Encodages (copie) d'un utilisateur, du plus ancien au plus récent"""
+        with self._lock:
+            partitions = {partition for _, partition in self._user_rows.get(user_id, [])}
+            lists = self._lists
+
+        if not partitions:
+            return np.empty((0, self.dim), dtype=np.float32)
+
+        rows = []
+        for partition in partitions:
+            user_ids, encodings, _, row_ids = lists[partition].snapshot()
+            mask = user_ids == user_id
+            rows.extend(zip(row_ids[mask].tolist(), encodings[mask]))
+        rows.sort(key=lambda item: item[0])
+        return np.array([encoding for _, encoding in rows], dtype=np.float32)
+
+    def _train(self, row_ids: np.ndarray, user_ids: np.ndarray, encodings: np.ndarray) -> _IndexState:
+        """Entraîner les centroïdes et répartir les encodages (sans verrou: n'utilise pas l'état courant)"""
+        count = len(encodings)
+        if count >= self.min_train_size:
+            nlist = self.nlist or int(4 * np.sqrt(count))
+            centroids = train_kmeans(encodings, nlist)
+        else:
+            centroids = np.zeros((1, self.dim), dtype=np.float32)
+
+        labels = assign_to_centroids(encodings, centroids) if count else np.empty(0, dtype=np.int64)
+
+        lists = []
+        for partition in range(len(centroids)):
+            members = np.flatnonzero(labels == partition)
+            gallery = FaceGallery(self.dim, _LIST_CAPACITY)
+            gallery.load_arrays(row_ids[members], user_ids[members], encodings[members])
+            lists.append(gallery)
+
+        user_rows: Dict[str, List[Tuple[int, int]]] = {}
+        for row_id, user_id, partition in zip(row_ids.tolist(), user_ids.tolist(), labels.tolist()):
+            user_rows.setdefault(user_id, []).append((row_id, partition))
+
+        return _IndexState(centroids, lists, user_rows, count)
+
+    def _apply(self, state: _IndexState):
+        """Mettre en service le résultat d'un entraînement (appelé sous verrou)"""
+        self._centroids = state.centroids
+        self._lists = state.lists
+        self._user_rows = state.user_rows
+        self._size = state.size
+        self._trained_size = state.size
+
+    def _insert(self, row_id: int, user_id: str, vector: np.ndarray):
+        """Ranger un encodage dans sa partition (appelé sous verrou)"""
+        partition = int(assign_to_centroids(vector.reshape(1, -1), self._centroids)[0])
+        self._lists[partition].add(row_id, user_id, vector)
+        self._user_rows.setdefault(user_id, []).append((row_id, partition))
+        self._size += 1
+
+    def _add(self, row_id: int, user_id: str, vector: np.ndarray, max_per_user: Optional[int]):
+        """Appliquer la limite par utilisateur puis ranger l'encodage (appelé sous verrou)"""
+        if max_per_user is not None:
+            self._trim_user(user_id, max_per_user - 1)
+        self._insert(row_id, user_id, vector)
+
+    def _replay(self, journal: List[tuple]):
+        """
+        Rejouer sur un nouvel état les modifications faites pendant son
+        entraînement (appelé sous verrou)
+
+        Un ajout dont la ligne est déjà présente (lue dans la table par le
+        rechargement) est ignoré, limite par utilisateur comprise: la table
+        reflète déjà cette limite.
+        """
+        for operation, *args in journal:
+            if operation == "add":
+                row_id, user_id = args[0], args[1]
+                if any(row == row_id for row, _ in self._user_rows.get(user_id, [])):
+                    continue
+                self._add(*args)
+            else:
+                self._trim_user(*args)
+
+    def _start_retrain(self):
+        """Lancer le repartitionnement dans un thread (appelé sous verrou)"""
+        # Copie sous verrou: une suppression marque les lignes en place
+        snapshots = [gallery.export_arrays() for gallery in self._lists]
+        self._journal = []
+        threading.Thread(
+            target=self._retrain,
+            args=(snapshots, self._generation),
+            name="ivf-retrain",
+            daemon=True
+        ).start()
+
+    def _retrain(self, snapshots: List[tuple], generation: int):
+        """Réentraîner l'index à partir d'une image, puis rejouer les modifications faites entre-temps"""
+        try:
+            row_ids = np.concatenate([snapshot[0] for snapshot in snapshots])
+            user_ids = np.array(
+                [user_id for snapshot in snapshots for user_id in snapshot[1]], dtype=object
+            )
+            encodings = np.concatenate([snapshot[2] for snapshot in snapshots]).reshape(-1, self.dim)
+            logger.info(f"Repartitionnement de l'index IVF en arrière-plan ({len(row_ids)} encodages)")
+            state = self._train(row_ids, user_ids, encodings)
+        except Exception as e:
+            logger.error(f"Erreur de repartitionnement de l'index IVF: {e}")
+            with self._lock:
+                if generation == self._generation:
+                    self._journal = None
+            return
+
+        with self._lock:
+            if generation != self._generation:
+                # Index rechargé pendant l'entraînement: ce résultat est périmé
+                return
+            journal, self._journal = self._journal, None
+            self._apply(state)
+            self._replay(journal)
+
+        logger.info(
+            f"Index IVF repartitionné: {len(state.lists)} partition(s), "
+            f"{len(journal)} modification(s) rejouée(s)"
+        )
+
+    def _trim_user(self, user_id: str, keep: int) -> int:
+        """
+        Ne garder que les `keep` encodages les plus récents d'un utilisateur
+        (appelé sous verrou)
+
+        Returns:
+            Nombre d'encodages retirés
+        """
+        entries = sorted(self._user_rows.get(user_id, []))
+        excess = len(entries) - max(keep, 0)
+        if excess <= 0:
+            return 0
+
+        removed, kept = entries[:excess], entries[excess:]
+        by_partition: Dict[int, List[int]] = {}
+        for row_id, partition in removed:
+            by_partition.setdefault(partition, []).append(row_id)
+        for partition, partition_rows in by_partition.items():
+            self._lists[partition].remove_rows(partition_rows)
+
+        if kept:
+            self._user_rows[user_id] = kept
+        else:
+            self._user_rows.pop(user_id, None)
+        self._size -= excess
+        return excess
@@ -0,0 +1,464 @@
+"""
+Benchmarks hors ligne du Backend ML Python de TwoInOne
+Recherche dans la galerie, décodage d'image, détection et désérialisation
+
+Aucun serveur ni base de données n'est nécessaire: les données sont synthétiques
+et générées avec une graine fixe. Les résultats sont écrits en JSON pour
+comparer deux commits:
+
+    python benchmark_ml.py --output bench-avant.json
+    python benchmark_ml.py --output bench-apres.json --sections matching
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+# Les modules du service lisent leur configuration à la demande (get_app_settings)
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/benchmark")
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_ANON_KEY", "benchmark")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+
+ENCODING_DIM = 128
+
+SECTIONS = ("matching", "decode", "detection", "deserialization")
+
+# Résolutions courantes des photos de téléphone (largeur, hauteur)
+PHONE_RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "8MP": (3264, 2448),
+    "12MP": (4032, 3024),
+}
+
+# Plus grand côté utilisé pour la détection (0 = pleine résolution)
+DETECTION_MAX_SIDES = (320, 480, 640, 960, 1600, 0)
+
+# Couleurs pour le terminal
+class Colors:
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    END = '\033[0m'
+
+def print_info(message):
+    print(f"{Colors.BLUE}ℹ {message}{Colors.END}", file=sys.stderr)
+
+def print_result(message):
+    print(f"{Colors.GREEN}✓ {message}{Colors.END}", file=sys.stderr)
+
+def print_warning(message):
+    print(f"{Colors.YELLOW}⚠ {message}{Colors.END}", file=sys.stderr)
+
+
+class BenchmarkSkipped(Exception):
+    """Levée quand une dépendance d'une section est absente"""
+
+
+def measure(func: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    """
+    Chronométrer func
+
+    Args:
+        func: Fonction sans argument à mesurer
+        repeat: Nombre de mesures
+        warmup: Appels non mesurés (caches, allocations)
+
+    Returns:
+        Statistiques en millisecondes (min, median, mean, p95, max) et runs
+    """
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000.0)
+
+    samples.sort()
+    return {
+        "runs": repeat,
+        "min_ms": samples[0],
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.fmean(samples),
+        "p95_ms": samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))],
+        "max_ms": samples[-1],
+    }
+
+
+def synthetic_encodings(rng: np.random.Generator, count: int) -> np.ndarray:
+    """Encodages 128-d dont l'échelle est proche de celle de dlib (composantes ~0.1)"""
+    return rng.normal(0.0, 0.09, size=(count, ENCODING_DIM))
+
+
+def synthetic_photo(width: int, height: int, seed: int) -> bytes:
+    """
+    Photo JPEG synthétique (dégradés + bruit) à la taille demandée
+
+    Le bruit empêche l'encodeur JPEG de produire un fichier anormalement petit.
+    """
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=2)
+    noise = rng.normal(0, 12, size=(height, width, 3)).astype(np.float32)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def _face_distance(known: List[np.ndarray], probe: np.ndarray) -> np.ndarray:
+    """Même calcul que face_recognition.face_distance (sans dépendre de dlib)"""
+    return np.linalg.norm(np.asarray(known) - probe, axis=1)
+
+
+def bench_matching(args, rng: np.random.Generator) -> List[Dict[str, Any]]:
+    """
+    Recherche 1:N: boucle Python d'origine, NumPy direct, FaceGallery
+    (une sonde et lot de sondes), prototypes par utilisateur et index IVF
+    """
+    from gallery import FaceGallery
+    from ann import IVFFaceIndex
+    from prototype import PrototypeFaceGallery
+
+    results = []
+    for size in args.sizes:
+        encodings = synthetic_encodings(rng, size)
+        user_ids = [f"user-{index // args.encodings_per_user}" for index in range(size)]
+        row_ids = np.arange(1, size + 1)
+        probe = encodings[size // 2] + rng.normal(0.0, 0.01, ENCODING_DIM)
+        probes = encodings[rng.integers(0, size, args.batch_probes)]
+        repeat = args.repeat if size < 1_000_000 else max(3, args.repeat // 4)
+        params = {"gallery_size": size, "encodings_per_user": args.encodings_per_user}
+
+        def record(name: str, stats: Dict[str, float], **extra):
+            entry = {"section": "matching", "name": name, "params": {**params, **extra}, **stats}
+            results.append(entry)
+            print_result(f"matching/{name} n={size}: médiane {stats['median_ms']:.3f} ms")
+
+        # Boucle d'origine de /ml/verify-face: un face_distance par encodage stocké
+        if size <= args.loop_max:
+            by_user: Dict[str, List[List[float]]] = {}
+            for user_id, encoding in zip(user_ids, encodings.tolist()):
+                by_user.setdefault(user_id, []).append(encoding)
+
+            def python_loop():
+                best_user, best_distance = None, 1.0
+                for user_id, stored_encodings in by_user.items():
+                    for stored_encoding in stored_encodings:
+                        distance = _face_distance([np.array(stored_encoding)], probe)[0]
+                        if distance < best_distance:
+                            best_user, best_distance = user_id, distance
+                return best_user, best_distance
+
+            record("python_loop", measure(python_loop, max(1, min(repeat, 3)), warmup=0))
+        else:
+            print_warning(f"matching/python_loop n={size}: ignoré (> --loop-max {args.loop_max})")
+
+        # NumPy direct sur float64, sans norme précalculée
+        def numpy_norm():
+            distances = np.linalg.norm(encodings - probe, axis=1)
+            index = int(np.argmin(distances))
+            return user_ids[index], distances[index]
+
+        record("numpy_norm", measure(numpy_norm, repeat))
+
+        gallery = FaceGallery()
+        gallery.load_arrays(row_ids, user_ids, encodings)
+        record("gallery_best_match", measure(lambda: gallery.best_match(probe), repeat))
+
+        batch_stats = measure(lambda: gallery.best_matches(probes), repeat)
+        record("gallery_best_matches", batch_stats, batch_probes=args.batch_probes)
+        results[-1]["per_probe_median_ms"] = batch_stats["median_ms"] / args.batch_probes
+
+        prototypes = PrototypeFaceGallery(candidates=args.prototype_candidates)
+        start = time.perf_counter()
+        prototypes.load_arrays(row_ids, user_ids, encodings)
+        build_ms = (time.perf_counter() - start) * 1000.0
+        record(
+            "prototype_best_match",
+            measure(lambda: prototypes.best_match(probe), repeat),
+            candidates=args.prototype_candidates
+        )
+        results[-1]["build_ms"] = build_ms
+
+        # Rappel: part des sondes dont les deux étapes retrouvent l'utilisateur de la recherche exacte
+        exact = gallery.best_matches(probes)
+        two_stage = prototypes.best_matches(probes)
+        hits = sum(p[0] == e[0] for p, e in zip(two_stage, exact))
+        results[-1]["recall_at_1"] = hits / len(probes)
+        del prototypes
+
+        if args.ivf and size >= args.ivf_min_size:
+            index = IVFFaceIndex(nprobe=args.ivf_nprobe, min_train_size=args.ivf_min_size)
+            start = time.perf_counter()
+            index.load_arrays(row_ids, user_ids, encodings)
+            build_ms = (time.perf_counter() - start) * 1000.0
+            record(
+                "ivf_best_match",
+                measure(lambda: index.best_match(probe), repeat),
+                nprobe=args.ivf_nprobe
+            )
+            results[-1]["build_ms"] = build_ms
+
+            # Rappel: part des sondes dont l'IVF retrouve le même utilisateur que la recherche exacte
+            exact = gallery.best_matches(probes)
+            approximate = index.best_matches(probes)
+            hits = sum(a[0] == e[0] for a, e in zip(approximate, exact))
+            results[-1]["recall_at_1"] = hits / len(probes)
+
+        del gallery, encodings
+
+    return results
+
+
+def bench_decode(args, rng: np.random.Generator) -> List[Dict[str, Any]]:
+    """
+    Décodage JPEG aux résolutions de téléphone: pleine résolution, pleine
+    résolution puis réduction, et décodage réduit (DCT) à FACE_ENCODING_MAX_SIDE
+    """
+    try:
+        from face_pipeline import decode_image, resize_to_max_side
+    except ImportError as e:
+        raise BenchmarkSkipped(f"pipeline indisponible: {e}")
+
+    max_side = args.encoding_max_side
+    cases = (
+        ("decode_full", lambda photo: decode_image(photo), {}),
+        (
+            "decode_then_resize",
+            lambda photo: resize_to_max_side(decode_image(photo), max_side),
+            {"max_side": max_side}
+        ),
+        ("decode_reduced", lambda photo: decode_image(photo, max_side), {"max_side": max_side}),
+    )
+
+    results = []
+    for label, (width, height) in PHONE_RESOLUTIONS.items():
+        photo = synthetic_photo(width, height, args.seed)
+        params = {"resolution": label, "width": width, "height": height, "jpeg_bytes": len(photo)}
+
+        for name, decode, extra in cases:
+            stats = measure(lambda: decode(photo), args.repeat)
+            results.append({"section": "decode", "name": name, "params": {**params, **extra}, **stats})
+            print_result(f"decode/{name} {label}: médiane {stats['median_ms']:.1f} ms")
+
+    return results
+
+
+def bench_detection(args, rng: np.random.Generator) -> List[Dict[str, Any]]:
+    """
+    Détection HOG (face_recognition.face_locations) selon la réduction appliquée
+
+    Le coût du HOG dépend de la taille de l'image et non de son contenu: une
+    photo synthétique suffit, --image permet d'utiliser une vraie photo.
+    """
+    try:
+        import face_recognition
+        from face_pipeline import decode_image, resize_to_max_side
+    except ImportError as e:
+        raise BenchmarkSkipped(f"face_recognition indisponible: {e}")
+
+    if args.image:
+        with open(args.image, "rb") as image_file:
+            image_array = decode_image(image_file.read())
+        source = os.path.basename(args.image)
+    else:
+        width, height = PHONE_RESOLUTIONS["12MP"]
+        image_array = decode_image(synthetic_photo(width, height, args.seed))
+        source = "synthetic-12MP"
+
+    results = []
+    for max_side in DETECTION_MAX_SIDES:
+        small, scale = resize_to_max_side(image_array, max_side)
+        faces: List[Any] = []
+
+        def detect():
+            faces[:] = face_recognition.face_locations(small)
+
+        stats = measure(detect, max(1, args.repeat // 2))
+        results.append({
+            "section": "detection",
+            "name": "face_locations",
+            "params": {
+                "source": source,
+                "max_side": max_side,
+                "scale": scale,
+                "width": small.shape[1],
+                "height": small.shape[0],
+            },
+            "faces": len(faces),
+            **stats
+        })
+        print_result(
+            f"detection/face_locations {small.shape[1]}x{small.shape[0]}: "
+            f"médiane {stats['median_ms']:.1f} ms ({len(faces)} visage(s))"
+        )
+
+    return results
+
+
+def bench_deserialization(args, rng: np.random.Generator) -> List[Dict[str, Any]]:
+    """
+    Chargement de la galerie: JSONB (texte renvoyé par psycopg2, puis json.loads)
+    contre bytea float32 (une ligne à la fois, puis un seul frombuffer)
+    """
+    from database import ENCODING_DTYPE, pack_encoding, unpack_encoding
+
+    results = []
+    encodings = synthetic_encodings(rng, args.deserialize_rows)
+    jsonb_rows = [json.dumps(encoding) for encoding in encodings.tolist()]
+    binary_rows = [pack_encoding(encoding) for encoding in encodings]
+    params = {"rows": args.deserialize_rows}
+
+    def jsonb_loads():
+        return np.array([json.loads(row) for row in jsonb_rows], dtype=np.float32)
+
+    def binary_per_row():
+        return np.stack([unpack_encoding(row) for row in binary_rows])
+
+    def binary_bulk():
+        joined = b"".join(binary_rows)
+        return np.frombuffer(joined, dtype=ENCODING_DTYPE).reshape(-1, ENCODING_DIM).astype(np.float32)
+
+    for name, func in (
+        ("jsonb_loads", jsonb_loads),
+        ("binary_per_row", binary_per_row),
+        ("binary_bulk", binary_bulk),
+    ):
+        stats = measure(func, args.repeat)
+        results.append({
+            "section": "deserialization",
+            "name": name,
+            "params": params,
+            "per_row_us": stats["median_ms"] * 1000.0 / args.deserialize_rows,
+            **stats
+        })
+        print_result(f"deserialization/{name}: médiane {stats['median_ms']:.2f} ms")
+
+    return results
+
+
+BENCHMARKS = {
+    "matching": bench_matching,
+    "decode": bench_decode,
+    "detection": bench_detection,
+    "deserialization": bench_deserialization,
+}
+
+
+def _git_commit() -> Optional[str]:
+    """Commit courant (None hors d'un dépôt git)"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_info() -> Dict[str, Any]:
+    """Contexte d'exécution joint aux résultats"""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks hors ligne du backend ML")
+    parser.add_argument("--output", "-o", help="Fichier JSON de sortie (défaut: stdout)")
+    parser.add_argument(
+        "--sections", nargs="+", choices=SECTIONS, default=list(SECTIONS),
+        help="Sections à exécuter"
+    )
+    parser.add_argument(
+        "--sizes", type=lambda value: [int(size) for size in value.split(",")],
+        default=[1_000, 10_000, 100_000, 1_000_000],
+        help="Tailles de galerie, séparées par des virgules"
+    )
+    parser.add_argument("--repeat", type=int, default=20, help="Mesures par cas")
+    parser.add_argument("--seed", type=int, default=42, help="Graine des données synthétiques")
+    parser.add_argument("--encodings-per-user", type=int, default=3)
+    parser.add_argument("--batch-probes", type=int, default=32, help="Sondes par lot (best_matches)")
+    parser.add_argument(
+        "--loop-max", type=int, default=100_000,
+        help="Taille max pour la boucle Python d'origine (très lente au-delà)"
+    )
+    parser.add_argument(
+        "--prototype-candidates", type=int, default=8,
+        help="Utilisateurs comparés en détail après le tri par prototype"
+    )
+    parser.add_argument("--no-ivf", dest="ivf", action="store_false", help="Ne pas mesurer l'index IVF")
+    parser.add_argument("--ivf-nprobe", type=int, default=8)
+    parser.add_argument("--ivf-min-size", type=int, default=10_000)
+    parser.add_argument("--encoding-max-side", type=int, default=1600)
+    parser.add_argument("--deserialize-rows", type=int, default=10_000)
+    parser.add_argument("--image", help="Photo réelle pour la section detection")
+    parser.add_argument(
+        "--quick", action="store_true",
+        help="Petites tailles et peu de mesures (vérification rapide)"
+    )
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.sizes = [size for size in args.sizes if size <= 10_000] or [1_000]
+        args.repeat = min(args.repeat, 3)
+        args.deserialize_rows = min(args.deserialize_rows, 1_000)
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    rng = np.random.default_rng(args.seed)
+
+    report = {
+        "environment": environment_info(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": [],
+        "skipped": {},
+    }
+
+    for section in args.sections:
+        print_info(f"Section {section}...")
+        try:
+            report["results"].extend(BENCHMARKS[section](args, rng))
+        except BenchmarkSkipped as e:
+            print_warning(f"Section {section} ignorée: {e}")
+            report["skipped"][section] = str(e)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output + "\n")
+        print_info(f"Résultats écrits dans {args.output}")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""
+Import en masse des enrôlements faciaux pour TwoInOne ML Backend
+Lecture en flux d'une archive ZIP, encodage parallèle et écriture par COPY
+"""
+
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+from typing import IO, AsyncIterator, Dict, List, NamedTuple, Optional
+
+from config import get_app_settings
+from database import bulk_save_face_encodings
+from face_pipeline import run_face_pipeline_batch, PipelineBusyError, ImageTooLargeError
+from site_gallery import site_id_error
+
+logger = logging.getLogger(__name__)
+
+# Nom du manifeste optionnel à la racine de l'archive (colonnes: user_id,image[,site_id])
+MANIFEST_NAME = "manifest.csv"
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Attente entre deux tentatives quand le pipeline est saturé (secondes)
+_BUSY_RETRY_DELAY = 0.5
+
+# Durée maximale de saturation du pipeline avant d'interrompre l'import (secondes)
+_BUSY_MAX_WAIT = 120.0
+
+
+class ImportItem(NamedTuple):
+    """Une image de l'archive et l'utilisateur auquel elle appartient"""
+    name: str
+    user_id: str
+    # Site de l'utilisateur (colonne site_id du manifeste)
+    site_id: Optional[str] = None
+    # Raison du rejet de la ligne du manifeste, None si elle est complète
+    error: Optional[str] = None
+
+
+def _invalid_user_id(user_id: str) -> Optional[str]:
+    """Raison du rejet d'un user_id, ou None s'il est utilisable"""
+    if not user_id:
+        return "user_id vide"
+    if len(user_id) > 255:
+        return "user_id trop long (255 caractères max)"
+    if any(char in user_id for char in "\t\n\r\\"):
+        return "user_id contient un caractère interdit"
+    return None
+
+
+def _manifest_item(row: Dict[Optional[str], object], line: int) -> ImportItem:
+    """
+    Lire une ligne du manifeste
+
+    Une ligne trop courte (colonnes manquantes: None) ou trop longue
+    (colonnes en trop sous la clé None) donne un élément en erreur, signalé
+    comme échec de cette ligne sans interrompre l'import.
+    """
+    values = {
+        column: value.strip() if isinstance(value, str) else None
+        for column, value in row.items() if column is not None
+    }
+    image, user_id = values.get("image"), values.get("user_id")
+
+    error = None
+    if image is None or user_id is None:
+        error = f"ligne {line} du manifeste incomplète"
+    elif None in row:
+        error = f"ligne {line} du manifeste: colonnes en trop"
+    elif not image:
+        error = f"ligne {line} du manifeste: image vide"
+
+    return ImportItem(
+        name=image or f"{MANIFEST_NAME}:{line}",
+        user_id=user_id or "",
+        site_id=values.get("site_id") or None,
+        error=error
+    )
+
+
+def list_import_items(archive: zipfile.ZipFile) -> List[ImportItem]:
+    """
+    Lister les images à importer
+
+    Si l'archive contient manifest.csv, il fait foi (colonnes user_id,image et
+    site_id optionnelle).
+    Sinon chaque image doit être rangée dans un dossier portant le user_id:
+    <user_id>/<photo>.jpg
+
+    Args:
+        archive: Archive ZIP ouverte
+
+    Returns:
+        Liste des images, dans l'ordre de l'archive ou du manifeste
+
+    Raises:
+        csv.Error: Si l'en-tête du manifeste n'a pas les colonnes user_id et image
+    """
+    names = archive.namelist()
+
+    if MANIFEST_NAME in names:
+        with archive.open(MANIFEST_NAME) as manifest:
+            reader = csv.DictReader(io.TextIOWrapper(manifest, encoding="utf-8"))
+            columns = [column.strip() for column in reader.fieldnames or []]
+            if "user_id" not in columns or "image" not in columns:
+                raise csv.Error("colonnes user_id et image requises")
+            reader.fieldnames = columns
+            return [_manifest_item(row, reader.line_num) for row in reader]
+
+    items = []
+    for name in names:
+        if name.endswith("/") or not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        user_id = os.path.dirname(name).split("/")[-1]
+        items.append(ImportItem(name=name, user_id=user_id))
+    return items
+
+
+def _read_images(archive: zipfile.ZipFile, items: List[ImportItem]) -> List[Optional[bytes]]:
+    """Lire (décompresser) un lot d'images; None pour les entrées absentes"""
+    contents = []
+    for item in items:
+        try:
+            contents.append(archive.read(item.name))
+        except KeyError:
+            contents.append(None)
+    return contents
+
+
+def _event(event: str, **fields) -> str:
+    """Ligne NDJSON d'un événement de progression"""
+    return json.dumps({"event": event, **fields}, ensure_ascii=False) + "\n"
+
+
+async def spool_archive(upload: IO[bytes]) -> IO[bytes]:
+    """
+    Copier l'archive uploadée dans un fichier temporaire propre à l'import
+
+    Le fichier d'upload est fermé par FastAPI avant la fin d'une réponse en
+    flux: l'import lit donc sa propre copie.
+
+    Args:
+        upload: Fichier uploadé (UploadFile.file)
+
+    Returns:
+        Fichier temporaire positionné au début
+
+    Raises:
+        ValueError: Si le fichier n'est pas une archive ZIP
+    """
+    loop = asyncio.get_running_loop()
+    archive_file = tempfile.TemporaryFile()
+    await loop.run_in_executor(None, shutil.copyfileobj, upload, archive_file)
+
+    if not zipfile.is_zipfile(archive_file):
+        archive_file.close()
+        raise ValueError("Le fichier n'est pas une archive ZIP valide")
+
+    archive_file.seek(0)
+    return archive_file
+
+
+async def _encode_batch(contents: List[bytes]):
+    """
+    Encoder un lot d'images, en attendant si le pipeline est saturé
+
+    Raises:
+        PipelineBusyError: Si le lot n'a pas été admis après _BUSY_MAX_WAIT secondes
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + _BUSY_MAX_WAIT
+    while True:
+        try:
+            return await run_face_pipeline_batch(contents, use_cache=False)
+        except PipelineBusyError:
+            if loop.time() + _BUSY_RETRY_DELAY > deadline:
+                raise
+            await asyncio.sleep(_BUSY_RETRY_DELAY)
+
+
+async def run_bulk_import(
+    archive_file: IO[bytes],
+    site_id: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Importer les enrôlements d'une archive et produire des événements NDJSON
+
+    Événements:
+        start     {"total"}
+        error     {"item", "user_id", "reason"} pour chaque image rejetée
+        progress  {"processed", "total", "enrolled", "failed"} après chaque lot
+        done      {"total", "enrolled", "failed"}
+        aborted   {"reason"} si le manifeste est inutilisable, ou
+                  {"reason", "processed", "total", "enrolled", "failed"} si le
+                  pipeline reste saturé (les lots précédents sont enregistrés)
+
+    Args:
+        archive_file: Fichier ZIP (seekable), fermé à la fin de l'import
+        site_id: Site des utilisateurs importés, sauf colonne site_id du manifeste
+            (None: chacun garde son site actuel)
+
+    Yields:
+        Lignes NDJSON
+    """
+    settings = get_app_settings()
+    loop = asyncio.get_running_loop()
+    enrolled = 0
+    failed = 0
+
+    try:
+        archive = zipfile.ZipFile(archive_file)
+        try:
+            items = await loop.run_in_executor(None, list_import_items, archive)
+        except (KeyError, UnicodeDecodeError, csv.Error) as e:
+            logger.error(f"Manifeste d'import invalide: {e}")
+            yield _event("aborted", reason=f"{MANIFEST_NAME} invalide: {e}")
+            return
+        total = len(items)
+        yield _event("start", total=total)
+
+        batch_size = settings.FACE_BULK_BATCH_SIZE
+        for start in range(0, total, batch_size):
+            batch = items[start:start + batch_size]
+            contents = await loop.run_in_executor(None, _read_images, archive, batch)
+
+            errors: Dict[int, str] = {}
+            readable = []
+            for index, (item, data) in enumerate(zip(batch, contents)):
+                reason = item.error or _invalid_user_id(item.user_id) or site_id_error(item.site_id)
+                if reason is None and data is None:
+                    reason = "image absente de l'archive"
+                if reason is not None:
+                    errors[index] = reason
+                else:
+                    readable.append(index)
+
+            # Détection et encodage en parallèle dans le pool du pipeline
+            try:
+                analyses = await _encode_batch([contents[index] for index in readable])
+            except PipelineBusyError as e:
+                logger.error(f"Import en masse interrompu après {start} image(s): {e}")
+                yield _event(
+                    "aborted",
+                    reason=f"pipeline saturé depuis {_BUSY_MAX_WAIT:g}s",
+                    processed=start,
+                    total=total,
+                    enrolled=enrolled,
+                    failed=failed
+                )
+                return
+
+            entries = []
+            for index, analysis in zip(readable, analyses):
+                if isinstance(analysis, ImageTooLargeError):
+                    errors[index] = "image trop grande"
+                elif isinstance(analysis, Exception):
+                    errors[index] = "image illisible"
+                elif analysis.quality_issue is not None:
+                    errors[index] = f"qualité insuffisante ({analysis.quality_issue})"
+                elif analysis.face_count == 0:
+                    errors[index] = "aucun visage détecté"
+                elif analysis.face_count > 1:
+                    errors[index] = "plusieurs visages détectés"
+                elif analysis.encoding is None:
+                    errors[index] = "encodage impossible"
+                else:
+                    item = batch[index]
+                    entries.append((item.user_id, analysis.encoding, item.site_id or site_id))
+
+            # Écriture du lot en une transaction (COPY + limite par utilisateur)
+            try:
+                enrolled += await bulk_save_face_encodings(entries)
+            except Exception as e:
+                for index, item in enumerate(batch):
+                    errors.setdefault(index, f"erreur d'écriture: {e}")
+
+            for index in sorted(errors):
+                failed += 1
+                yield _event(
+                    "error",
+                    item=batch[index].name,
+                    user_id=batch[index].user_id,
+                    reason=errors[index]
+                )
+
+            yield _event(
+                "progress",
+                processed=min(start + batch_size, total),
+                total=total,
+                enrolled=enrolled,
+                failed=failed
+            )
+
+        logger.info(f"Import en masse terminé: {enrolled} enrôlé(s), {failed} échec(s)")
+        yield _event("done", total=total, enrolled=enrolled, failed=failed)
+
+    finally:
+        archive_file.close()
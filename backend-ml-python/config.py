@@ -19,6 +19,46 @@ class Settings(BaseSettings):
         description="URL de connexion PostgreSQL"
     )
     
+    DB_POOL_MIN_SIZE: int = Field(
+        default=1,
+        ge=0,
+        description="Nombre minimum de connexions ouvertes dans le pool"
+    )
+    DB_POOL_MAX_SIZE: int = Field(
+        default=10,
+        ge=1,
+        le=200,
+        description="Nombre maximum de connexions (et de threads de requêtes)"
+    )
+    DB_POOL_ACQUIRE_TIMEOUT: float = Field(
+        default=5.0,
+        gt=0,
+        description="Attente maximale (secondes) pour obtenir une connexion du pool"
+    )
+    DB_STATEMENT_TIMEOUT_MS: int = Field(
+        default=10000,
+        ge=0,
+        description="statement_timeout PostgreSQL en millisecondes (0 = désactivé)"
+    )
+    DB_AUTO_MIGRATE: bool = Field(
+        default=True,
+        description="Appliquer au démarrage les migrations en attente (sinon le worker reste non prêt)"
+    )
+    
+    # Démarrage
+    STARTUP_RETRY_ATTEMPTS: int = Field(
+        default=5,
+        ge=1,
+        le=100,
+        description="Tentatives de chaque étape du démarrage (base, pipeline) avant d'abandonner"
+    )
+    STARTUP_RETRY_DELAY: float = Field(
+        default=2.0,
+        gt=0,
+        le=60,
+        description="Attente avant la deuxième tentative (secondes), doublée ensuite jusqu'à 60 s"
+    )
+    
     # Supabase
     SUPABASE_URL: str = Field(
         ...,
@@ -87,6 +127,213 @@ class Settings(BaseSettings):
         description="Nombre maximum d'encodages par utilisateur"
     )
     
+    # Pipeline de traitement d'image (décodage, détection, encodage)
+    FACE_PIPELINE_WORKERS: int = Field(
+        default=2,
+        ge=0,
+        le=64,
+        description="Nombre de processus du pipeline facial (0 = thread dans le processus courant)"
+    )
+    FACE_PIPELINE_MAX_QUEUE: int = Field(
+        default=64,
+        ge=1,
+        description="Nombre maximum d'images en cours de traitement avant de répondre 503"
+    )
+    FACE_PIPELINE_QUEUE_TIMEOUT: float = Field(
+        default=5.0,
+        ge=0,
+        le=60,
+        description="Attente maximale d'une place dans la file du pipeline avant de répondre 503 (secondes, 0 = refus immédiat)"
+    )
+    
+    FACE_BATCH_MAX_IMAGES: int = Field(
+        default=50,
+        ge=1,
+        le=500,
+        description="Nombre maximum d'images par requête de vérification par lot"
+    )
+    FACE_MATCH_BATCH_WINDOW_MS: float = Field(
+        default=2.0,
+        ge=0,
+        le=100,
+        description="Fenêtre de regroupement des recherches 1:N simultanées (ms, 0 = désactivé)"
+    )
+    FACE_MATCH_BATCH_MAX_SIZE: int = Field(
+        default=64,
+        ge=1,
+        le=1024,
+        description="Recherches 1:N par lot au-delà desquelles le lot part sans attendre la fenêtre"
+    )
+    FACE_BULK_BATCH_SIZE: int = Field(
+        default=32,
+        ge=1,
+        le=1000,
+        description="Images encodées puis écrites (COPY) par lot lors d'un import en masse"
+    )
+    FACE_DETECTION_MAX_SIDE: int = Field(
+        default=640,
+        ge=0,
+        description="Plus grand côté de l'image utilisée pour la détection (0 = pleine résolution)"
+    )
+    FACE_DETECTOR_CASCADE: str = Field(
+        default="hog",
+        description="Détecteurs essayés dans l'ordre (séparés par des virgules): hog, cnn, opencv_haar, opencv_dnn"
+    )
+    FACE_DETECTOR_DNN_PROTOTXT: str = Field(
+        default="models/deploy.prototxt",
+        description="Architecture du détecteur OpenCV DNN (SSD res10, Caffe)"
+    )
+    FACE_DETECTOR_DNN_MODEL: str = Field(
+        default="models/res10_300x300_ssd_iter_140000.caffemodel",
+        description="Poids du détecteur OpenCV DNN (SSD res10, Caffe)"
+    )
+    FACE_DETECTOR_DNN_CONFIDENCE: float = Field(
+        default=0.6,
+        gt=0,
+        lt=1,
+        description="Score minimum d'une détection OpenCV DNN"
+    )
+    FACE_DETECTOR_HAAR_MIN_NEIGHBORS: int = Field(
+        default=5,
+        ge=1,
+        description="Voisins requis par le détecteur Haar (plus haut = moins de fausses détections)"
+    )
+    FACE_DETECTION_RETRY_MAX_SIDE: int = Field(
+        default=0,
+        ge=0,
+        description="Résolution de la seconde détection si aucun visage n'est trouvé (0 = pleine résolution)"
+    )
+    FACE_ENCODING_MAX_SIDE: int = Field(
+        default=1600,
+        ge=0,
+        description="Plus grand côté de l'image utilisée pour les points de repère et l'encodage (0 = pleine résolution)"
+    )
+    FACE_MAX_IMAGE_PIXELS: int = Field(
+        default=50_000_000,
+        ge=0,
+        description="Nombre de pixels maximum d'une image uploadée, vérifié avant décodage (0 = pas de limite)"
+    )
+    
+    # Contrôle de qualité avant l'encodage (0 désactive un critère)
+    FACE_QUALITY_ENABLED: bool = Field(
+        default=True,
+        description="Refuser les images sombres, surexposées, floues, à visage trop petit ou de biais"
+    )
+    FACE_QUALITY_MIN_BRIGHTNESS: float = Field(
+        default=40.0,
+        ge=0,
+        le=255,
+        description="Luminosité médiane minimale (niveaux de gris 0-255)"
+    )
+    FACE_QUALITY_MAX_BRIGHTNESS: float = Field(
+        default=220.0,
+        ge=0,
+        le=255,
+        description="Luminosité médiane maximale (niveaux de gris 0-255)"
+    )
+    FACE_QUALITY_MIN_SHARPNESS: float = Field(
+        default=20.0,
+        ge=0,
+        description="Variance du laplacien minimale sur le visage ramené à 128x128"
+    )
+    FACE_QUALITY_MIN_FACE_SIZE: int = Field(
+        default=60,
+        ge=0,
+        description="Côté minimal du visage détecté (pixels, résolution d'encodage)"
+    )
+    FACE_QUALITY_MAX_ROLL_DEGREES: float = Field(
+        default=30.0,
+        ge=0,
+        description="Inclinaison maximale de l'axe des yeux (degrés)"
+    )
+    FACE_QUALITY_MAX_YAW_RATIO: float = Field(
+        default=0.6,
+        ge=0,
+        description="Décalage maximal du nez par rapport au milieu des yeux (relatif à l'écart des yeux)"
+    )
+    
+    # Cache des analyses d'images (même photo renvoyée)
+    FACE_ANALYSIS_CACHE_SIZE: int = Field(
+        default=1024,
+        ge=0,
+        description="Analyses d'images gardées en cache par worker (0 = désactivé)"
+    )
+    FACE_ANALYSIS_CACHE_TTL_SECONDS: float = Field(
+        default=300.0,
+        gt=0,
+        description="Durée de validité d'une analyse en cache (secondes)"
+    )
+    
+    # Métriques Prometheus
+    METRICS_ENABLED: bool = Field(
+        default=True,
+        description="Exposer GET /ml/metrics et mesurer la durée des requêtes"
+    )
+    
+    # Synchronisation de la galerie entre workers (LISTEN/NOTIFY)
+    FACE_GALLERY_SYNC_ENABLED: bool = Field(
+        default=True,
+        description="Appliquer à la galerie locale les modifications des autres workers"
+    )
+    FACE_GALLERY_RECONCILE_SECONDS: float = Field(
+        default=60.0,
+        gt=0,
+        description="Intervalle de vérification de la cohérence galerie/base (secondes)"
+    )
+    FACE_GALLERY_SHARED_DIR: str = Field(
+        default="",
+        description="Répertoire de la galerie partagée entre workers (ex. /dev/shm/twoinone-gallery, vide = une galerie par worker)"
+    )
+    FACE_GALLERY_SNAPSHOT_PATH: str = Field(
+        default="",
+        description="Instantané de la galerie pour un démarrage incrémental (vide = chargement complet)"
+    )
+    FACE_GALLERY_SNAPSHOT_SECONDS: float = Field(
+        default=600.0,
+        gt=0,
+        description="Intervalle minimal entre deux écritures de l'instantané (secondes)"
+    )
+    
+    # Index de recherche des visages
+    FACE_INDEX_ENGINE: str = Field(
+        default="exact",
+        description="Moteur de recherche 1:N: exact (balayage complet), prototype (deux étapes) ou ivf (approché)"
+    )
+    FACE_PROTOTYPE_CANDIDATES: int = Field(
+        default=8,
+        ge=1,
+        description="Utilisateurs les plus proches (par prototype) dont les encodages sont comparés"
+    )
+    FACE_INDEX_IVF_NLIST: int = Field(
+        default=0,
+        ge=0,
+        description="Nombre de partitions IVF (0 = automatique, ~ 4 * sqrt(N))"
+    )
+    FACE_INDEX_IVF_NPROBE: int = Field(
+        default=8,
+        ge=1,
+        description="Partitions IVF examinées par recherche (plus haut = meilleur rappel, plus lent)"
+    )
+    FACE_INDEX_IVF_MIN_TRAIN_SIZE: int = Field(
+        default=10000,
+        ge=1,
+        description="Taille de galerie minimale pour partitionner l'index IVF"
+    )
+    
+    # Partition de la galerie par site (colonne site_id de face_encodings)
+    FACE_SITE_PARTITIONS: bool = Field(
+        default=False,
+        description="Une galerie par site: la vérification avec site_id ne cherche que dans ce site"
+    )
+    FACE_SITE_FALLBACK_GLOBAL: bool = Field(
+        default=True,
+        description="Chercher dans tous les sites chargés si le site demandé ne reconnaît pas le visage"
+    )
+    FACE_GALLERY_SITES: str = Field(
+        default="",
+        description="Sites chargés par cette réplique, séparés par des virgules (vide = tous)"
+    )
+    
     # Logging
     LOG_LEVEL: str = Field(
         default="INFO",
@@ -105,6 +352,34 @@ class Settings(BaseSettings):
             raise ValueError(f"ENVIRONMENT doit être l'un de: {allowed}")
         return v
     
+    @validator("FACE_INDEX_ENGINE")
+    def validate_face_index_engine(cls, v):
+        """Valider que le moteur de recherche est connu"""
+        allowed = ["exact", "prototype", "ivf"]
+        if v not in allowed:
+            raise ValueError(f"FACE_INDEX_ENGINE doit être l'un de: {allowed}")
+        return v
+    
+    @validator("FACE_DETECTOR_CASCADE")
+    def validate_face_detector_cascade(cls, v):
+        """Valider que la cascade ne contient que des détecteurs connus"""
+        allowed = ["hog", "cnn", "opencv_haar", "opencv_dnn"]
+        names = [name.strip() for name in v.split(",") if name.strip()]
+        if not names or any(name not in allowed for name in names):
+            raise ValueError(f"FACE_DETECTOR_CASCADE doit lister des détecteurs parmi: {allowed}")
+        return ",".join(names)
+    
+    @validator("FACE_BATCH_MAX_IMAGES", "FACE_BULK_BATCH_SIZE")
+    def validate_fits_pipeline_queue(cls, v, values):
+        """Valider qu'un lot d'images peut être admis dans la file du pipeline"""
+        max_queue = values.get("FACE_PIPELINE_MAX_QUEUE")
+        if max_queue is not None and v > max_queue:
+            raise ValueError(
+                f"un lot de {v} images ne doit pas dépasser FACE_PIPELINE_MAX_QUEUE "
+                f"({max_queue}): il serait toujours refusé"
+            )
+        return v
+    
     @validator("LOG_LEVEL")
     def validate_log_level(cls, v):
         """Valider que le niveau de log est valide"""
@@ -132,6 +407,14 @@ class Settings(BaseSettings):
         """Retourner la liste des origines autorisées"""
         return [origin.strip() for origin in self.ALLOWED_ORIGINS.split(",")]
     
+    def get_detector_cascade(self) -> List[str]:
+        """Retourner les détecteurs de la cascade, du premier essayé au dernier"""
+        return self.FACE_DETECTOR_CASCADE.split(",")
+    
+    def get_gallery_sites(self) -> List[str]:
+        """Retourner les sites chargés dans la galerie (liste vide = tous)"""
+        return [site.strip() for site in self.FACE_GALLERY_SITES.split(",") if site.strip()]
+    
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
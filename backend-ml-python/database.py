@@ -4,19 +4,112 @@ Gestion de la persistance des encodages faciaux dans PostgreSQL
 """
 
 import psycopg2
-from psycopg2.extras import RealDictCursor, Json
-from psycopg2.pool import SimpleConnectionPool
-from typing import List, Dict, Optional, Any
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from typing import List, Dict, Optional, Any, Iterable, Callable, Tuple, TypeVar
+import asyncio
+import functools
+import io
 import json
 import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
+import numpy as np
+
+from analysis_cache import invalidate_user_analyses
 from config import get_app_settings
+from gallery import get_face_gallery, ENCODING_DIM
+from gallery_file import load_snapshot, save_snapshot
+from site_gallery import SiteFaceGallery
 
 logger = logging.getLogger(__name__)
 
-# Pool de connexions global
-_connection_pool: Optional[SimpleConnectionPool] = None
+# Pool de connexions global (thread-safe) et threads dédiés aux requêtes
+_connection_pool: Optional[ThreadedConnectionPool] = None
+_db_executor: Optional[ThreadPoolExecutor] = None
+
+# Limite le nombre de connexions empruntées pour pouvoir attendre avec un timeout
+# (ThreadedConnectionPool lève PoolError immédiatement quand il est épuisé)
+_pool_slots: Optional[threading.BoundedSemaphore] = None
+
+# Connexions empruntées et threads en attente d'une connexion (métriques)
+_pool_in_use = 0
+_pool_waiting = 0
+_pool_stats_lock = threading.Lock()
+
+T = TypeVar("T")
+
+# Canal NOTIFY des modifications de face_encodings (voir gallery_sync.py)
+GALLERY_CHANNEL = "face_encodings_changes"
+
+# Identifiant de ce processus: ses propres notifications sont ignorées à la réception
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Intervalle d'attente de la publication de la galerie partagée (secondes)
+_SHARED_GALLERY_POLL_SECONDS = 0.1
+
+# Marge retirée de la limite haute updated_at de l'instantané (secondes)
+_HIGH_WATER_MARGIN_SECONDS = 60
+
+# Limites hautes de face_encodings enregistrées avec l'instantané de la galerie:
+# id max et updated_at max (µs depuis l'époque, horodatage sans fuseau).
+# updated_at vaut l'heure de début de la transaction (CURRENT_TIMESTAMP): une
+# transaction commencée avant cette lecture mais validée après écrit un
+# updated_at plus petit que le max lu. La limite est donc ramenée au début de
+# la plus ancienne transaction en cours, moins une marge (sessions invisibles
+# sans le droit pg_read_all_stats): ces lignes seront relues au chargement suivant.
+_HIGH_WATER_SQL = f"""
+    SELECT COALESCE(MAX(id), 0),
+           COALESCE((EXTRACT(EPOCH FROM LEAST(
+               MAX(updated_at),
+               (SELECT MIN(xact_start)::timestamp FROM pg_stat_activity
+                WHERE datname = current_database() AND pid <> pg_backend_pid())
+           ) - INTERVAL '{_HIGH_WATER_MARGIN_SECONDS} seconds') * 1000000)::bigint, 0)
+    FROM face_encodings
+"""
+
+# Version de la galerie (voir FaceGallery.version) du dernier instantané écrit
+_snapshot_version: Optional[Tuple[int, int, int]] = None
+
+# Chargement de la galerie en cours, partagé par les appels simultanés
+_gallery_load_task: Optional[asyncio.Future] = None
+
+# Format binaire de face_encodings.encoding_bin: float32 big-endian
+# (identique à float4send() côté PostgreSQL, utilisé par la migration 002)
+ENCODING_DTYPE = np.dtype(">f4")
+
+
+def pack_encoding(encoding: Iterable[float]) -> bytes:
+    """
+    Sérialiser un encodage facial au format binaire compact
+    
+    Args:
+        encoding: Encodage facial (128 floats)
+        
+    Returns:
+        512 octets (128 float32 big-endian)
+    """
+    return np.asarray(encoding, dtype=ENCODING_DTYPE).reshape(-1).tobytes()
+
+
+def unpack_encoding(data: Any, legacy: Optional[List[float]] = None) -> np.ndarray:
+    """
+    Désérialiser un encodage binaire en array NumPy float32 (sans parsing)
+    
+    Args:
+        data: Contenu de encoding_bin (bytes/memoryview) ou None
+        legacy: Encodage JSONB des lignes pas encore migrées
+        
+    Returns:
+        Array float32 de 128 valeurs
+    """
+    if data is None:
+        return np.asarray(legacy, dtype=np.float32)
+    return np.frombuffer(data, dtype=ENCODING_DTYPE).astype(np.float32)
 
 
 def init_db_pool():
@@ -26,7 +119,7 @@ def init_db_pool():
     Raises:
         Exception: Si la connexion échoue
     """
-    global _connection_pool
+    global _connection_pool, _db_executor, _pool_slots
     
     if _connection_pool is not None:
         logger.info("Pool de connexions déjà initialisé")
@@ -34,13 +127,26 @@ def init_db_pool():
     
     settings = get_app_settings()
     
+    connect_kwargs = {}
+    if settings.DB_STATEMENT_TIMEOUT_MS > 0:
+        connect_kwargs["options"] = f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+    
     try:
-        _connection_pool = SimpleConnectionPool(
-            minconn=1,
-            maxconn=10,
-            dsn=settings.DATABASE_URL
+        _connection_pool = ThreadedConnectionPool(
+            minconn=settings.DB_POOL_MIN_SIZE,
+            maxconn=settings.DB_POOL_MAX_SIZE,
+            dsn=settings.DATABASE_URL,
+            **connect_kwargs
+        )
+        _pool_slots = threading.BoundedSemaphore(settings.DB_POOL_MAX_SIZE)
+        _db_executor = ThreadPoolExecutor(
+            max_workers=settings.DB_POOL_MAX_SIZE,
+            thread_name_prefix="db"
+        )
+        logger.info(
+            f"✅ Pool de connexions PostgreSQL initialisé "
+            f"({settings.DB_POOL_MIN_SIZE}-{settings.DB_POOL_MAX_SIZE} connexions)"
         )
-        logger.info("✅ Pool de connexions PostgreSQL initialisé")
     except Exception as e:
         logger.error(f"❌ Erreur d'initialisation du pool de connexions: {e}")
         raise
@@ -48,11 +154,16 @@ def init_db_pool():
 
 def close_db_pool():
     """Fermer le pool de connexions"""
-    global _connection_pool
+    global _connection_pool, _db_executor, _pool_slots
+    
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=True)
+        _db_executor = None
     
     if _connection_pool is not None:
         _connection_pool.closeall()
         _connection_pool = None
+        _pool_slots = None
         logger.info("Pool de connexions fermé")
 
 
@@ -61,132 +172,388 @@ def get_db_connection():
     """
     Context manager pour obtenir une connexion depuis le pool
     
+    Bloquant: à utiliser uniquement depuis run_in_db_thread (ou hors boucle asyncio).
+    
     Usage:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM users")
+    
+    Raises:
+        PoolError: Si aucune connexion n'est libérée avant DB_POOL_ACQUIRE_TIMEOUT
     """
     if _connection_pool is None:
         init_db_pool()
     
-    conn = _connection_pool.getconn()
+    global _pool_in_use, _pool_waiting
+    
+    pool, slots = _connection_pool, _pool_slots
+    timeout = get_app_settings().DB_POOL_ACQUIRE_TIMEOUT
+    
+    with _pool_stats_lock:
+        _pool_waiting += 1
     try:
-        yield conn
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Erreur de transaction: {e}")
-        raise
+        acquired = slots.acquire(timeout=timeout)
     finally:
-        _connection_pool.putconn(conn)
+        with _pool_stats_lock:
+            _pool_waiting -= 1
+    if not acquired:
+        raise PoolError(f"Aucune connexion disponible après {timeout}s")
+    
+    with _pool_stats_lock:
+        _pool_in_use += 1
+    try:
+        conn = pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Erreur de transaction: {e}")
+            raise
+        finally:
+            pool.putconn(conn)
+    finally:
+        with _pool_stats_lock:
+            _pool_in_use -= 1
+        slots.release()
 
 
-async def create_tables():
+def get_pool_stats() -> Dict[str, int]:
     """
-    Créer les tables nécessaires si elles n'existent pas
+    État du pool de connexions
     
-    Raises:
-        Exception: Si la création échoue
+    Returns:
+        Dict avec in_use (connexions empruntées), waiting (threads en attente)
+        et max (DB_POOL_MAX_SIZE, 0 si le pool n'est pas initialisé)
     """
-    create_table_sql = """
-    CREATE TABLE IF NOT EXISTS face_encodings (
-        id SERIAL PRIMARY KEY,
-        user_id VARCHAR(255) NOT NULL,
-        encoding JSONB NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    
-    CREATE INDEX IF NOT EXISTS idx_face_encodings_user_id 
-    ON face_encodings(user_id);
+    with _pool_stats_lock:
+        in_use, waiting = _pool_in_use, _pool_waiting
+    max_size = _connection_pool.maxconn if _connection_pool is not None else 0
+    return {"in_use": in_use, "waiting": waiting, "max": max_size}
+
+
+def notify_gallery_change(cursor, user_id: str, operation: str):
+    """
+    Publier une modification sur GALLERY_CHANNEL (livrée au COMMIT)
     
-    -- Trigger pour mettre à jour updated_at automatiquement
-    CREATE OR REPLACE FUNCTION update_updated_at_column()
-    RETURNS TRIGGER AS $$
-    BEGIN
-        NEW.updated_at = CURRENT_TIMESTAMP;
-        RETURN NEW;
-    END;
-    $$ language 'plpgsql';
+    Args:
+        cursor: Curseur de la transaction qui effectue l'écriture
+        user_id: ID de l'utilisateur modifié
+        operation: "upsert" ou "delete"
+    """
+    payload = json.dumps({"user_id": user_id, "op": operation, "origin": WORKER_ID})
+    cursor.execute("SELECT pg_notify(%s, %s)", (GALLERY_CHANNEL, payload))
+
+
+async def run_in_db_thread(func: Callable[..., T], *args: Any) -> T:
+    """
+    Exécuter une fonction bloquante (psycopg2) dans les threads dédiés à la base
     
-    DROP TRIGGER IF EXISTS update_face_encodings_updated_at ON face_encodings;
+    La boucle d'événements reste libre pendant l'aller-retour PostgreSQL.
     
-    CREATE TRIGGER update_face_encodings_updated_at
-    BEFORE UPDATE ON face_encodings
-    FOR EACH ROW
-    EXECUTE FUNCTION update_updated_at_column();
+    Args:
+        func: Fonction synchrone utilisant get_db_connection()
+        *args: Arguments de la fonction
+        
+    Returns:
+        Valeur retournée par func
     """
+    if _db_executor is None:
+        init_db_pool()
     
-    try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(create_table_sql)
-            logger.info("✅ Tables créées/vérifiées avec succès")
-    except Exception as e:
-        logger.error(f"❌ Erreur de création des tables: {e}")
-        raise
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args))
+
 
+def _gallery_site_clause() -> Tuple[str, tuple]:
+    """Condition SQL (et paramètres) limitant face_encodings aux sites chargés (FACE_GALLERY_SITES)"""
+    sites = get_app_settings().get_gallery_sites()
+    if not sites:
+        return "TRUE", ()
+    return "site_id = ANY(%s::varchar[])", (sites,)
 
-async def save_face_encoding(user_id: str, encoding: List[float]) -> bool:
+
+def _gallery_serves_site(site_id: Optional[str]) -> bool:
+    """True si les utilisateurs du site sont chargés dans la galerie de ce worker"""
+    sites = get_app_settings().get_gallery_sites()
+    return not sites or site_id in sites
+
+
+def _gallery_add(gallery, row_id: int, user_id: str, encoding, site_id: Optional[str]):
+    """Ajouter un encodage à la galerie, dans la galerie de son site si elle est partitionnée"""
+    settings = get_app_settings()
+    if isinstance(gallery, SiteFaceGallery):
+        gallery.add(row_id, user_id, encoding, settings.MAX_ENCODINGS_PER_USER, site_id=site_id)
+    else:
+        gallery.add(row_id, user_id, encoding, max_per_user=settings.MAX_ENCODINGS_PER_USER)
+
+
+async def save_face_encoding(
+    user_id: str,
+    encoding: List[float],
+    site_id: Optional[str] = None
+) -> int:
     """
     Sauvegarder un encodage facial pour un utilisateur
     
+    Limite à MAX_ENCODINGS_PER_USER, insertion et comptage en une seule
+    requête (CTE avec RETURNING), donc un seul aller-retour et une seule
+    transaction.
+    
+    Toutes les lignes d'un utilisateur portent le même site: un site_id
+    différent de celui des encodages existants les déplace dans ce site, et
+    sans site_id le nouvel encodage reprend le site actuel de l'utilisateur.
+    
     Args:
         user_id: ID de l'utilisateur
         encoding: Encodage facial (liste de floats)
+        site_id: Site de l'utilisateur (None: inchangé)
         
     Returns:
-        True si la sauvegarde a réussi
+        Nombre d'encodages de l'utilisateur après la sauvegarde
         
     Raises:
         Exception: Si la sauvegarde échoue
     """
     settings = get_app_settings()
     
-    try:
+    def _save() -> Tuple[int, int, Optional[str], bool]:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # Vérifier le nombre d'encodages existants
+            # Le verrou consultatif sérialise les enrôlements d'un même utilisateur;
+            # la CTE s'exécute ensuite sur un instantané pris après le verrou.
+            # Toutes les sous-requêtes voient l'état d'avant l'INSERT: on garde
+            # donc MAX - 1 encodages existants, plus le nouveau. Le changement de
+            # site exclut les lignes supprimées (une ligne n'est modifiée qu'une fois).
             cursor.execute(
-                "SELECT COUNT(*) FROM face_encodings WHERE user_id = %s",
-                (user_id,)
-            )
-            count = cursor.fetchone()[0]
-            
-            # Si on dépasse la limite, supprimer les plus anciens
-            if count >= settings.MAX_ENCODINGS_PER_USER:
-                cursor.execute(
-                    """
-                    DELETE FROM face_encodings 
+                """
+                SELECT pg_advisory_xact_lock(hashtext(%(user_id)s));
+                
+                SELECT pg_notify(%(channel)s, %(payload)s);
+                
+                WITH site AS (
+                    SELECT COALESCE(%(site_id)s::varchar, (
+                        SELECT site_id FROM face_encodings
+                        WHERE user_id = %(user_id)s
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT 1
+                    )) AS site_id
+                ),
+                inserted AS (
+                    INSERT INTO face_encodings (user_id, encoding_bin, site_id)
+                    VALUES (%(user_id)s, %(encoding)s, (SELECT site_id FROM site))
+                    RETURNING id, site_id
+                ),
+                trimmed AS (
+                    DELETE FROM face_encodings
                     WHERE id IN (
-                        SELECT id FROM face_encodings 
-                        WHERE user_id = %s 
-                        ORDER BY created_at ASC 
-                        LIMIT %s
+                        SELECT id FROM face_encodings
+                        WHERE user_id = %(user_id)s
+                        ORDER BY created_at DESC, id DESC
+                        OFFSET %(keep)s
                     )
-                    """,
-                    (user_id, count - settings.MAX_ENCODINGS_PER_USER + 1)
+                    RETURNING id
+                ),
+                moved AS (
+                    UPDATE face_encodings SET site_id = (SELECT site_id FROM site)
+                    WHERE user_id = %(user_id)s
+                      AND site_id IS DISTINCT FROM (SELECT site_id FROM site)
+                      AND id NOT IN (SELECT id FROM trimmed)
+                    RETURNING id
                 )
+                SELECT
+                    (SELECT id FROM inserted),
+                    (SELECT COUNT(*) FROM face_encodings WHERE user_id = %(user_id)s)
+                        - (SELECT COUNT(*) FROM trimmed) + 1,
+                    (SELECT site_id FROM inserted),
+                    EXISTS (SELECT 1 FROM moved)
+                """,
+                {
+                    "user_id": user_id,
+                    "site_id": site_id,
+                    "encoding": psycopg2.Binary(pack_encoding(encoding)),
+                    "keep": settings.MAX_ENCODINGS_PER_USER - 1,
+                    "channel": GALLERY_CHANNEL,
+                    "payload": json.dumps(
+                        {"user_id": user_id, "op": "upsert", "origin": WORKER_ID}
+                    ),
+                }
+            )
+            return cursor.fetchone()
+    
+    try:
+        row_id, count, site_id, moved = await run_in_db_thread(_save)
+        
+        # Mettre à jour la galerie en mémoire une fois la transaction validée
+        if moved:
+            # Changement de site: les encodages existants sont relus avec le nouveau site
+            await refresh_gallery_user(user_id)
+        elif _gallery_serves_site(site_id):
+            _gallery_add(get_face_gallery(), row_id, user_id, encoding, site_id)
+        
+        logger.info(f"Encodage sauvegardé pour user_id: {user_id}")
+        return count
             
-            # Insérer le nouvel encodage
+    except Exception as e:
+        logger.error(f"Erreur de sauvegarde de l'encodage: {e}")
+        raise
+
+
+async def bulk_save_face_encodings(
+    entries: List[Tuple[str, np.ndarray, Optional[str]]]
+) -> int:
+    """
+    Sauvegarder un lot d'encodages avec COPY (import en masse)
+    
+    Le lot est copié dans une table temporaire puis inséré, et chaque utilisateur
+    concerné est ramené à MAX_ENCODINGS_PER_USER (les plus récents), le tout
+    dans une seule transaction. Comme pour save_face_encoding, un encodage sans
+    site reprend le site actuel de l'utilisateur et toutes ses lignes suivent
+    son encodage le plus récent.
+    
+    Les verrous consultatifs de save_face_encoding sont pris pour chaque
+    utilisateur du lot, dans l'ordre des user_id: un enrôlement simultané du
+    même utilisateur attend la fin du lot, et deux imports ne peuvent pas
+    s'interbloquer.
+    
+    Args:
+        entries: Liste de tuples (user_id, encodage, site_id ou None)
+        
+    Returns:
+        Nombre d'encodages du lot conservés (un encodage du lot supprimé
+        aussitôt par la limite par utilisateur n'est pas compté)
+        
+    Raises:
+        Exception: Si l'écriture échoue
+    """
+    settings = get_app_settings()
+    
+    if not entries:
+        return 0
+    
+    # Format texte de COPY: bytea en hexadécimal, backslash échappé
+    buffer = io.StringIO()
+    for user_id, encoding, site_id in entries:
+        site = "\\N" if site_id is None else site_id
+        buffer.write(f"{user_id}\t\\\\x{pack_encoding(encoding).hex()}\t{site}\n")
+    buffer.seek(0)
+    user_ids = sorted({entry[0] for entry in entries})
+    
+    def _copy() -> Tuple[List[tuple], set, set]:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            # unnest parcourt le tableau dans l'ordre: verrous pris par user_id croissant
             cursor.execute(
                 """
-                INSERT INTO face_encodings (user_id, encoding)
-                VALUES (%s, %s)
+                SELECT pg_advisory_xact_lock(hashtext(user_id))
+                FROM unnest(%s::varchar[]) AS user_id
                 """,
-                (user_id, Json(encoding))
+                (user_ids,)
             )
+            cursor.execute(
+                """
+                CREATE TEMP TABLE face_encodings_import (
+                    seq SERIAL,
+                    user_id VARCHAR(255) NOT NULL,
+                    encoding_bin BYTEA NOT NULL,
+                    site_id VARCHAR(255)
+                ) ON COMMIT DROP
+                """
+            )
+            cursor.copy_expert(
+                "COPY face_encodings_import (user_id, encoding_bin, site_id) FROM STDIN",
+                buffer
+            )
+            cursor.execute(
+                """
+                INSERT INTO face_encodings (user_id, encoding_bin, site_id)
+                SELECT i.user_id, i.encoding_bin, COALESCE(i.site_id, (
+                    SELECT f.site_id FROM face_encodings f
+                    WHERE f.user_id = i.user_id
+                    ORDER BY f.created_at DESC, f.id DESC
+                    LIMIT 1
+                ))
+                FROM face_encodings_import i
+                ORDER BY i.seq
+                RETURNING id, user_id, encoding_bin, site_id
+                """
+            )
+            inserted = cursor.fetchall()
+            
+            # Aligner toutes les lignes de chaque utilisateur sur le site de la plus récente
+            cursor.execute(
+                """
+                UPDATE face_encodings f
+                SET site_id = latest.site_id
+                FROM (
+                    SELECT DISTINCT ON (user_id) user_id, site_id
+                    FROM face_encodings
+                    WHERE user_id IN (SELECT user_id FROM face_encodings_import)
+                    ORDER BY user_id, created_at DESC, id DESC
+                ) latest
+                WHERE f.user_id = latest.user_id
+                  AND f.site_id IS DISTINCT FROM latest.site_id
+                RETURNING f.user_id
+                """
+            )
+            moved = {row[0] for row in cursor.fetchall()}
             
-            logger.info(f"Encodage sauvegardé pour user_id: {user_id}")
-            return True
+            # Appliquer la limite par utilisateur (garder les plus récents)
+            cursor.execute(
+                """
+                DELETE FROM face_encodings
+                WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, row_number() OVER (
+                            PARTITION BY user_id
+                            ORDER BY created_at DESC, id DESC
+                        ) AS rank
+                        FROM face_encodings
+                        WHERE user_id IN (SELECT DISTINCT user_id FROM face_encodings_import)
+                    ) ranked
+                    WHERE rank > %s
+                )
+                RETURNING id
+                """,
+                (settings.MAX_ENCODINGS_PER_USER,)
+            )
+            trimmed = {row[0] for row in cursor.fetchall()}
             
+            for user_id in sorted({row[1] for row in inserted}):
+                notify_gallery_change(cursor, user_id, "upsert")
+            return inserted, moved, trimmed
+    
+    try:
+        inserted, moved, trimmed = await run_in_db_thread(_copy)
+        # Plus de MAX_ENCODINGS_PER_USER images d'un utilisateur dans le lot:
+        # les plus anciennes sont supprimées dans la même transaction
+        kept = sorted(row for row in inserted if row[0] not in trimmed)
+        
+        # Mettre à jour la galerie en mémoire une fois la transaction validée
+        gallery = get_face_gallery()
+        latest_sites = {row[1]: row[3] for row in kept}
+        for row_id, user_id, encoding_bin, _ in kept:
+            # Le site retourné par l'INSERT peut avoir été réaligné ensuite
+            site_id = latest_sites[user_id]
+            if user_id not in moved and _gallery_serves_site(site_id):
+                _gallery_add(gallery, row_id, user_id, unpack_encoding(encoding_bin), site_id)
+        for user_id in sorted(moved):
+            await refresh_gallery_user(user_id)
+        
+        logger.info(
+            f"Import en masse: {len(kept)} encodage(s) sauvegardé(s), "
+            f"{len(trimmed)} supprimé(s) par la limite par utilisateur"
+        )
+        return len(kept)
+        
     except Exception as e:
-        logger.error(f"Erreur de sauvegarde de l'encodage: {e}")
+        logger.error(f"Erreur d'import en masse des encodages: {e}")
         raise
 
 
-async def get_face_encodings(user_id: str) -> List[List[float]]:
+async def get_face_encodings(user_id: str) -> List[np.ndarray]:
     """
     Récupérer tous les encodages faciaux d'un utilisateur
     
@@ -194,14 +561,21 @@ async def get_face_encodings(user_id: str) -> List[List[float]]:
         user_id: ID de l'utilisateur
         
     Returns:
-        Liste des encodages faciaux
+        Liste des encodages faciaux (arrays float32), vide si l'utilisateur
+        n'a aucun visage enregistré
+        
+    Raises:
+        Exception: Si la lecture échoue (une base indisponible ne doit pas
+            passer pour un utilisateur non enregistré)
     """
-    try:
+    def _fetch() -> List[np.ndarray]:
         with get_db_connection() as conn:
             cursor = conn.cursor(cursor_factory=RealDictCursor)
             cursor.execute(
                 """
-                SELECT encoding FROM face_encodings 
+                SELECT encoding_bin,
+                       CASE WHEN encoding_bin IS NULL THEN encoding END AS encoding
+                FROM face_encodings 
                 WHERE user_id = %s 
                 ORDER BY created_at DESC
                 """,
@@ -209,28 +583,34 @@ async def get_face_encodings(user_id: str) -> List[List[float]]:
             )
             
             rows = cursor.fetchall()
-            encodings = [row['encoding'] for row in rows]
-            
-            return encodings
+            return [
+                unpack_encoding(row['encoding_bin'], row['encoding'])
+                for row in rows
+            ]
+    
+    try:
+        return await run_in_db_thread(_fetch)
             
     except Exception as e:
         logger.error(f"Erreur de récupération des encodages: {e}")
-        return []
+        raise
 
 
-async def get_all_face_encodings() -> Dict[str, List[List[float]]]:
+async def get_all_face_encodings() -> Dict[str, List[np.ndarray]]:
     """
     Récupérer tous les encodages faciaux de tous les utilisateurs
     
     Returns:
-        Dictionnaire {user_id: [encodages]}
+        Dictionnaire {user_id: [encodages float32]}
     """
-    try:
+    def _fetch() -> Dict[str, List[np.ndarray]]:
         with get_db_connection() as conn:
             cursor = conn.cursor(cursor_factory=RealDictCursor)
             cursor.execute(
                 """
-                SELECT user_id, encoding FROM face_encodings 
+                SELECT user_id, encoding_bin,
+                       CASE WHEN encoding_bin IS NULL THEN encoding END AS encoding
+                FROM face_encodings 
                 ORDER BY user_id, created_at DESC
                 """
             )
@@ -243,15 +623,358 @@ async def get_all_face_encodings() -> Dict[str, List[List[float]]]:
                 user_id = row['user_id']
                 if user_id not in encodings_by_user:
                     encodings_by_user[user_id] = []
-                encodings_by_user[user_id].append(row['encoding'])
+                encodings_by_user[user_id].append(
+                    unpack_encoding(row['encoding_bin'], row['encoding'])
+                )
             
             return encodings_by_user
+    
+    try:
+        return await run_in_db_thread(_fetch)
             
     except Exception as e:
         logger.error(f"Erreur de récupération de tous les encodages: {e}")
         return {}
 
 
+def _decode_gallery_rows(rows: List[tuple]) -> Tuple[np.ndarray, List[str], np.ndarray]:
+    """Lignes (id, user_id, encoding_bin, encoding, ...) -> tableaux de la galerie"""
+    row_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    user_ids = [row[1] for row in rows]
+    
+    if all(row[2] is not None for row in rows):
+        # Cas nominal: un seul frombuffer sur la concaténation des blobs
+        encodings = np.frombuffer(
+            b"".join(row[2] for row in rows), dtype=ENCODING_DTYPE
+        ).reshape(-1, ENCODING_DIM)
+    else:
+        encodings = np.array(
+            [unpack_encoding(row[2], row[3]) for row in rows], dtype=np.float32
+        ).reshape(-1, ENCODING_DIM)
+    return row_ids, user_ids, encodings
+
+
+def _merge_snapshot_rows(
+    snapshot_rows: Tuple[np.ndarray, List[str], np.ndarray, Optional[List[Optional[str]]]],
+    table_ids: np.ndarray,
+    rows: Tuple[np.ndarray, List[str], np.ndarray, List[Optional[str]]]
+) -> Tuple[Tuple[np.ndarray, List[str], np.ndarray, Optional[List[Optional[str]]]], int, int]:
+    """
+    Fusionner l'instantané de la galerie et les lignes relues dans la table
+    
+    Les lignes de l'instantané absentes de la table (supprimées) ou relues
+    (modifiées depuis) sont écartées; les autres sont complétées par les
+    lignes relues, le tout par id croissant.
+    
+    Args:
+        snapshot_rows: (ids, user_ids, encodages, sites ou None) de l'instantané
+        table_ids: IDs de toutes les lignes de la table
+        rows: (ids, user_ids, encodages, sites) des lignes relues
+    
+    Returns:
+        Tuple ((ids, user_ids, encodages, sites), lignes de l'instantané
+        conservées, lignes supprimées); sites vaut None si l'instantané n'en
+        a pas
+    """
+    kept_ids, kept_users, kept_encodings, kept_sites = snapshot_rows
+    row_ids, user_ids, encodings, site_ids = rows
+    
+    # Lignes de l'instantané toujours présentes et non relues
+    present = np.isin(kept_ids, table_ids)
+    kept = np.flatnonzero(present & ~np.isin(kept_ids, row_ids))
+    deleted = len(kept_ids) - int(present.sum())
+    
+    if len(kept) < len(kept_ids):
+        kept_ids = kept_ids[kept]
+        kept_users = [kept_users[i] for i in kept.tolist()]
+        kept_encodings = kept_encodings[kept]
+        if kept_sites is not None:
+            kept_sites = [kept_sites[i] for i in kept.tolist()]
+    
+    if not len(row_ids):
+        return (kept_ids, kept_users, kept_encodings, kept_sites), len(kept), deleted
+    
+    merged_ids = np.concatenate([kept_ids, row_ids])
+    order = np.argsort(merged_ids, kind="stable")
+    merged_users = kept_users + list(user_ids)
+    merged_encodings = np.concatenate([kept_encodings, encodings])
+    merged_sites = None
+    if kept_sites is not None:
+        merged_sites = kept_sites + list(site_ids)
+        merged_sites = [merged_sites[i] for i in order.tolist()]
+    return (
+        (
+            merged_ids[order],
+            [merged_users[i] for i in order.tolist()],
+            merged_encodings[order],
+            merged_sites,
+        ),
+        len(kept),
+        deleted,
+    )
+
+
+async def load_face_gallery() -> int:
+    """
+    Charger tous les encodages dans la galerie en mémoire
+    
+    Les appels simultanés (démarrage, réconciliation, vérifications arrivées
+    avant la fin du démarrage) partagent le même chargement au lieu de relire
+    chacun toute la table. Un appelant annulé n'interrompt pas le chargement.
+    
+    Avec FACE_GALLERY_SNAPSHOT_PATH, la galerie part de l'instantané écrit lors
+    d'un chargement précédent (fichier mappé): seules les lignes absentes de
+    l'instantané ou modifiées depuis (updated_at) sont lues dans la table, et
+    les lignes supprimées sont retirées d'après la liste des ids.
+    
+    Avec FACE_GALLERY_SITES, seules les lignes de ces sites sont chargées (les
+    lignes d'autres sites présentes dans l'instantané sont traitées comme
+    supprimées).
+    
+    Returns:
+        Nombre d'encodages chargés
+        
+    Raises:
+        Exception: Si la lecture échoue
+    """
+    global _gallery_load_task
+    
+    if _gallery_load_task is None or _gallery_load_task.done():
+        _gallery_load_task = asyncio.ensure_future(_load_face_gallery())
+    return await asyncio.shield(_gallery_load_task)
+
+
+async def _load_face_gallery() -> int:
+    """Chargement effectif de la galerie (voir load_face_gallery)"""
+    global _snapshot_version
+    
+    settings = get_app_settings()
+    gallery = get_face_gallery()
+    partitioned = isinstance(gallery, SiteFaceGallery)
+    site_clause, site_params = _gallery_site_clause()
+    if not gallery.is_writer:
+        # Galerie partagée: seul l'écrivain lit la table, les autres attendent sa publication
+        while not gallery.try_become_writer():
+            if gallery.is_loaded:
+                return len(gallery)
+            await asyncio.sleep(_SHARED_GALLERY_POLL_SECONDS)
+    
+    snapshot = None
+    if settings.FACE_GALLERY_SNAPSHOT_PATH:
+        snapshot = load_snapshot(settings.FACE_GALLERY_SNAPSHOT_PATH, ENCODING_DIM)
+    if snapshot is not None and partitioned and not snapshot.has_sites:
+        logger.warning("Instantané de galerie ignoré: écrit sans les sites (FACE_SITE_PARTITIONS)")
+        snapshot = None
+    if snapshot is not None:
+        snapshot_ids, snapshot_users, snapshot_encodings = snapshot.live_rows()
+        snapshot_sites = snapshot.live_sites() if partitioned else None
+    
+    def _fetch() -> Tuple[List[tuple], Optional[np.ndarray], Tuple[int, int]]:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            # Une seule image de la table pour les limites hautes, les ids et les lignes
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cursor.execute(_HIGH_WATER_SQL)
+            high_water = tuple(int(value) for value in cursor.fetchone())
+            
+            if snapshot is None:
+                cursor.execute(
+                    f"""
+                    SELECT id, user_id, encoding_bin,
+                           CASE WHEN encoding_bin IS NULL THEN encoding END,
+                           site_id
+                    FROM face_encodings 
+                    WHERE {site_clause}
+                    ORDER BY id
+                    """,
+                    site_params
+                )
+                return cursor.fetchall(), None, high_water
+            
+            cursor.execute(f"SELECT id FROM face_encodings WHERE {site_clause}", site_params)
+            table_ids = np.fromiter((row[0] for row in cursor), dtype=np.int64)
+            
+            # Lignes absentes de l'instantané (nouvelles, ou validées après son
+            # écriture avec un id plus petit) et lignes modifiées depuis par UPDATE
+            missing = np.setdiff1d(table_ids, snapshot_ids, assume_unique=True)
+            cursor.execute(
+                f"""
+                SELECT id, user_id, encoding_bin,
+                       CASE WHEN encoding_bin IS NULL THEN encoding END,
+                       site_id
+                FROM face_encodings 
+                WHERE (id = ANY(%s::integer[])
+                       OR updated_at > TIMESTAMP 'epoch' + %s * INTERVAL '1 microsecond')
+                  AND {site_clause}
+                ORDER BY id
+                """,
+                (missing.tolist(), snapshot.high_water[1]) + site_params
+            )
+            return cursor.fetchall(), table_ids, high_water
+    
+    try:
+        rows, table_ids, high_water = await run_in_db_thread(_fetch)
+        
+        def _build() -> int:
+            """Décoder, fusionner avec l'instantané et charger (hors de la boucle d'événements)"""
+            row_ids, user_ids, encodings = _decode_gallery_rows(rows)
+            site_ids = [row[4] for row in rows]
+            changed = len(rows)
+        
+            if snapshot is not None:
+                (row_ids, user_ids, encodings, site_ids), kept, deleted = _merge_snapshot_rows(
+                    (snapshot_ids, snapshot_users, snapshot_encodings, snapshot_sites),
+                    table_ids,
+                    (row_ids, user_ids, encodings, site_ids)
+                )
+                changed += deleted
+                logger.info(
+                    f"Galerie depuis l'instantané (id <= {snapshot.high_water[0]}): "
+                    f"{kept} encodage(s) conservé(s), "
+                    f"{len(rows)} lu(s) dans la table, {deleted} supprimé(s)"
+                )
+        
+            if partitioned:
+                gallery.load_arrays(row_ids, user_ids, encodings, site_ids)
+            else:
+                gallery.load_arrays(row_ids, user_ids, encodings)
+            return changed
+        
+        # Décodage et chargement (entraînement de l'index IVF compris) dans un
+        # thread: la boucle continue de servir les requêtes sur l'ancienne galerie
+        changed = await asyncio.get_running_loop().run_in_executor(None, _build)
+        
+        if snapshot is not None and not changed:
+            _snapshot_version = gallery.version()
+        elif settings.FACE_GALLERY_SNAPSHOT_PATH:
+            await save_gallery_snapshot(high_water)
+        return len(gallery)
+        
+    except Exception as e:
+        logger.error(f"Erreur de chargement de la galerie: {e}")
+        raise
+
+
+async def save_gallery_snapshot(high_water: Optional[Tuple[int, int]] = None) -> bool:
+    """
+    Écrire l'instantané de la galerie (FACE_GALLERY_SNAPSHOT_PATH)
+    
+    Sans effet si la galerie n'a pas changé depuis le dernier instantané ou
+    si ce worker ne l'alimente pas (lecteur d'une galerie partagée).
+    
+    Args:
+        high_water: Limites hautes (id, updated_at) lues avec les lignes chargées;
+            à défaut elles sont lues avant l'export de la galerie (une ligne
+            écrite entre-temps est relue au prochain démarrage)
+        
+    Returns:
+        True si un instantané a été écrit
+    """
+    global _snapshot_version
+    
+    path = get_app_settings().FACE_GALLERY_SNAPSHOT_PATH
+    gallery = get_face_gallery()
+    if not path or not gallery.is_writer or not gallery.is_loaded:
+        return False
+    
+    version = gallery.version()
+    if version == _snapshot_version:
+        return False
+    
+    def _fetch_high_water() -> Tuple[int, int]:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_HIGH_WATER_SQL)
+            return tuple(int(value) for value in cursor.fetchone())
+    
+    try:
+        if high_water is None:
+            high_water = await run_in_db_thread(_fetch_high_water)
+        if isinstance(gallery, SiteFaceGallery):
+            row_ids, user_ids, encodings, site_ids = gallery.export_site_arrays()
+        else:
+            row_ids, user_ids, encodings = gallery.export_arrays()
+            site_ids = None
+        
+        await asyncio.get_running_loop().run_in_executor(
+            None, save_snapshot, path, row_ids, user_ids, encodings, high_water, site_ids
+        )
+        _snapshot_version = version
+        logger.info(f"Instantané de la galerie écrit: {len(row_ids)} encodage(s) ({path})")
+        return True
+        
+    except Exception as e:
+        # L'instantané n'accélère que le démarrage suivant: jamais bloquant
+        logger.warning(f"Erreur d'écriture de l'instantané de la galerie: {e}")
+        return False
+
+
+async def refresh_gallery_user(user_id: str) -> int:
+    """
+    Recharger depuis la base les encodages d'un utilisateur dans la galerie
+    
+    Appelé à la réception d'une notification d'un autre worker, et après un
+    changement de site de l'utilisateur (il quitte la galerie de ce worker si
+    son nouveau site n'est pas dans FACE_GALLERY_SITES).
+    
+    Args:
+        user_id: ID de l'utilisateur
+        
+    Returns:
+        Nombre d'encodages de l'utilisateur désormais en mémoire
+    """
+    site_clause, site_params = _gallery_site_clause()
+    
+    def _fetch() -> List[tuple]:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT id, encoding_bin,
+                       CASE WHEN encoding_bin IS NULL THEN encoding END,
+                       site_id
+                FROM face_encodings 
+                WHERE user_id = %s AND {site_clause}
+                ORDER BY id
+                """,
+                (user_id,) + site_params
+            )
+            return cursor.fetchall()
+    
+    rows = await run_in_db_thread(_fetch)
+    gallery = get_face_gallery()
+    row_ids = [row[0] for row in rows]
+    encodings = [unpack_encoding(row[1], row[2]) for row in rows]
+    if isinstance(gallery, SiteFaceGallery):
+        gallery.replace_user(user_id, row_ids, encodings, site_id=rows[-1][3] if rows else None)
+    else:
+        gallery.replace_user(user_id, row_ids, encodings)
+    return len(rows)
+
+
+async def get_gallery_version() -> Tuple[int, int, int]:
+    """
+    Signature de face_encodings: (nombre de lignes, id max, somme des ids)
+    
+    Même calcul que FaceGallery.version(), pour la réconciliation périodique
+    (limité aux sites de FACE_GALLERY_SITES).
+    """
+    site_clause, site_params = _gallery_site_clause()
+    
+    def _fetch() -> Tuple[int, int, int]:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(*), COALESCE(MAX(id), 0), COALESCE(SUM(id), 0) "
+                f"FROM face_encodings WHERE {site_clause}",
+                site_params
+            )
+            count, max_id, sum_id = cursor.fetchone()
+            return int(count), int(max_id), int(sum_id)
+    
+    return await run_in_db_thread(_fetch)
+
+
 async def delete_face_encodings(user_id: str) -> bool:
     """
     Supprimer tous les encodages faciaux d'un utilisateur
@@ -262,24 +985,79 @@ async def delete_face_encodings(user_id: str) -> bool:
     Returns:
         True si la suppression a réussi
     """
-    try:
+    def _delete() -> int:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "DELETE FROM face_encodings WHERE user_id = %s",
                 (user_id,)
             )
-            
             deleted_count = cursor.rowcount
-            logger.info(f"Supprimé {deleted_count} encodage(s) pour user_id: {user_id}")
-            
-            return deleted_count > 0
+            if deleted_count:
+                notify_gallery_change(cursor, user_id, "delete")
+            return deleted_count
+    
+    try:
+        deleted_count = await run_in_db_thread(_delete)
+        
+        get_face_gallery().remove_user(user_id)
+        invalidate_user_analyses(user_id)
+        
+        logger.info(f"Supprimé {deleted_count} encodage(s) pour user_id: {user_id}")
+        return deleted_count > 0
             
     except Exception as e:
         logger.error(f"Erreur de suppression des encodages: {e}")
         raise
 
 
+async def set_user_site(user_id: str, site_id: Optional[str]) -> int:
+    """
+    Affecter tous les encodages d'un utilisateur à un site
+    
+    Args:
+        user_id: ID de l'utilisateur
+        site_id: Nouveau site (None: aucun site)
+        
+    Returns:
+        Nombre d'encodages de l'utilisateur (0 s'il n'est pas enregistré)
+        
+    Raises:
+        Exception: Si la mise à jour échoue
+    """
+    def _update() -> Tuple[int, int]:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            # Même verrou que l'enrôlement: pas de ligne ajoutée dans l'ancien site entre-temps
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (user_id,))
+            cursor.execute(
+                """
+                UPDATE face_encodings SET site_id = %s
+                WHERE user_id = %s AND site_id IS DISTINCT FROM %s
+                """,
+                (site_id, user_id, site_id)
+            )
+            moved = cursor.rowcount
+            if moved:
+                notify_gallery_change(cursor, user_id, "upsert")
+            cursor.execute(
+                "SELECT COUNT(*) FROM face_encodings WHERE user_id = %s",
+                (user_id,)
+            )
+            return moved, cursor.fetchone()[0]
+    
+    try:
+        moved, count = await run_in_db_thread(_update)
+        if moved:
+            await refresh_gallery_user(user_id)
+            logger.info(f"user_id {user_id} affecté au site {site_id}: {moved} encodage(s)")
+        return count
+        
+    except Exception as e:
+        logger.error(f"Erreur d'affectation du site: {e}")
+        raise
+
+
 async def get_enrolled_users() -> List[str]:
     """
     Récupérer la liste des user_ids ayant des encodages faciaux
@@ -287,7 +1065,7 @@ async def get_enrolled_users() -> List[str]:
     Returns:
         Liste des user_ids
     """
-    try:
+    def _fetch() -> List[str]:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
@@ -295,9 +1073,10 @@ async def get_enrolled_users() -> List[str]:
             )
             
             rows = cursor.fetchall()
-            user_ids = [row[0] for row in rows]
-            
-            return user_ids
+            return [row[0] for row in rows]
+    
+    try:
+        return await run_in_db_thread(_fetch)
             
     except Exception as e:
         logger.error(f"Erreur de récupération des utilisateurs: {e}")
@@ -314,16 +1093,17 @@ async def get_user_encoding_count(user_id: str) -> int:
     Returns:
         Nombre d'encodages
     """
-    try:
+    def _count() -> int:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT COUNT(*) FROM face_encodings WHERE user_id = %s",
                 (user_id,)
             )
-            
-            count = cursor.fetchone()[0]
-            return count
+            return cursor.fetchone()[0]
+    
+    try:
+        return await run_in_db_thread(_count)
             
     except Exception as e:
         logger.error(f"Erreur de comptage des encodages: {e}")
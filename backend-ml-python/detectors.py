@@ -0,0 +1,178 @@
+"""
+Détecteurs de visages pour TwoInOne ML Backend
+Backends interchangeables (dlib HOG/CNN, OpenCV Haar/DNN) et cascade du moins
+coûteux au plus précis
+
+Exécuté dans les processus du pool: chaque détecteur est chargé à la première
+utilisation puis gardé pour la durée du processus.
+"""
+
+import os
+import time
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+# Boîte (top, right, bottom, left), convention de face_recognition
+Box = Tuple[int, int, int, int]
+
+DETECTOR_HOG = "hog"
+DETECTOR_CNN = "cnn"
+DETECTOR_OPENCV_HAAR = "opencv_haar"
+DETECTOR_OPENCV_DNN = "opencv_dnn"
+
+# Entrée du réseau SSD res10 (deploy.prototxt) et moyennes BGR d'entraînement
+DNN_INPUT_SIZE = (300, 300)
+DNN_MEAN = (104.0, 177.0, 123.0)
+
+
+class DetectorOptions(NamedTuple):
+    """Paramètres des détecteurs transmis aux processus du pool"""
+    dnn_prototxt: str = "models/deploy.prototxt"
+    dnn_model: str = "models/res10_300x300_ssd_iter_140000.caffemodel"
+    dnn_confidence: float = 0.6
+    haar_min_neighbors: int = 5
+
+
+class DetectorRun(NamedTuple):
+    """Passage d'un détecteur sur une image (métriques du processus principal)"""
+    detector: str
+    seconds: float
+    face_count: int
+
+
+# Modèles OpenCV chargés dans ce processus
+_models: Dict[str, object] = {}
+
+
+def _detect_hog(image: np.ndarray, options: DetectorOptions) -> List[Box]:
+    import face_recognition
+
+    return face_recognition.face_locations(image, model="hog")
+
+
+def _detect_cnn(image: np.ndarray, options: DetectorOptions) -> List[Box]:
+    import face_recognition
+
+    return face_recognition.face_locations(image, model="cnn")
+
+
+def _detect_opencv_haar(image: np.ndarray, options: DetectorOptions) -> List[Box]:
+    import cv2
+
+    classifier = _models.get(DETECTOR_OPENCV_HAAR)
+    if classifier is None:
+        path = os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+        classifier = cv2.CascadeClassifier(path)
+        if classifier.empty():
+            raise RuntimeError(f"Cascade Haar introuvable: {path}")
+        _models[DETECTOR_OPENCV_HAAR] = classifier
+
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    faces = classifier.detectMultiScale(
+        gray,
+        scaleFactor=1.1,
+        minNeighbors=options.haar_min_neighbors,
+        minSize=(40, 40)
+    )
+    return [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in faces]
+
+
+def _detect_opencv_dnn(image: np.ndarray, options: DetectorOptions) -> List[Box]:
+    import cv2
+
+    net = _models.get(DETECTOR_OPENCV_DNN)
+    if net is None:
+        for path in (options.dnn_prototxt, options.dnn_model):
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"Modèle du détecteur OpenCV DNN introuvable: {path}")
+        net = cv2.dnn.readNetFromCaffe(options.dnn_prototxt, options.dnn_model)
+        _models[DETECTOR_OPENCV_DNN] = net
+
+    height, width = image.shape[:2]
+    # Le réseau attend du BGR: swapRB convertit l'image RGB
+    blob = cv2.dnn.blobFromImage(
+        cv2.resize(image, DNN_INPUT_SIZE), 1.0, DNN_INPUT_SIZE, DNN_MEAN, swapRB=True
+    )
+    net.setInput(blob)
+    detections = net.forward()[0, 0]
+
+    boxes = []
+    for confidence, left, top, right, bottom in detections[:, 2:7]:
+        if confidence < options.dnn_confidence:
+            continue
+        box = (
+            max(0, int(top * height)),
+            min(width, int(right * width)),
+            min(height, int(bottom * height)),
+            max(0, int(left * width)),
+        )
+        if box[2] > box[0] and box[1] > box[3]:
+            boxes.append(box)
+    return boxes
+
+
+DETECTORS: Dict[str, Callable[[np.ndarray, DetectorOptions], List[Box]]] = {
+    DETECTOR_HOG: _detect_hog,
+    DETECTOR_CNN: _detect_cnn,
+    DETECTOR_OPENCV_HAAR: _detect_opencv_haar,
+    DETECTOR_OPENCV_DNN: _detect_opencv_dnn,
+}
+
+
+def run_detector(
+    name: str,
+    image: np.ndarray,
+    options: DetectorOptions,
+    runs: List[DetectorRun]
+) -> List[Box]:
+    """
+    Détecter les visages avec un backend et noter sa durée dans runs
+
+    Args:
+        name: Nom du détecteur (clé de DETECTORS)
+        image: Image RGB uint8
+        options: Paramètres des détecteurs
+        runs: Liste complétée avec ce passage
+
+    Returns:
+        Boîtes (top, right, bottom, left) dans la résolution de image
+    """
+    start = time.perf_counter()
+    boxes = DETECTORS[name](image, options)
+    runs.append(DetectorRun(name, time.perf_counter() - start, len(boxes)))
+    return boxes
+
+
+def run_cascade(
+    image: np.ndarray,
+    cascade: Sequence[str],
+    options: DetectorOptions,
+    runs: List[DetectorRun]
+) -> List[Box]:
+    """
+    Enchaîner les détecteurs jusqu'à trouver exactement un visage
+
+    Le détecteur suivant (plus coûteux) n'est lancé que si le précédent ne
+    trouve aucun visage ou en trouve plusieurs (fausse détection possible).
+    Si aucun ne trouve un visage unique, le résultat non vide du détecteur le
+    plus précis est retenu (refus "plusieurs visages").
+
+    Returns:
+        Boîtes retenues (liste vide si aucun détecteur n'a trouvé de visage)
+    """
+    retained: List[Box] = []
+    for name in cascade:
+        boxes = run_detector(name, image, options, runs)
+        if len(boxes) == 1:
+            return boxes
+        if boxes:
+            retained = boxes
+    return retained
+
+
+def warm_up_detectors(cascade: Sequence[str], options: DetectorOptions):
+    """Charger les modèles de chaque détecteur de la cascade sur une image vide"""
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    for name in cascade:
+        DETECTORS[name](blank, options)
@@ -0,0 +1,651 @@
+"""
+Pipeline de traitement d'image pour TwoInOne ML Backend
+Décodage, détection et encodage des visages dans un pool de processus
+
+face_recognition (dlib et ses modèles), OpenCV et Pillow sont importés à la
+première utilisation: le processus uvicorn ne les charge pas quand le
+pipeline tourne dans un pool de processus.
+"""
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from analysis_cache import content_key, get_analysis_cache
+from config import get_app_settings
+from detectors import DetectorOptions, DetectorRun, run_cascade, warm_up_detectors
+from metrics import (
+    STAGE_DECODE,
+    STAGE_FACE_LOCATIONS,
+    STAGE_FACE_ENCODINGS,
+    STAGE_QUALITY,
+    observe_detector_runs,
+    observe_stages,
+    record_cache_lookup
+)
+from quality import QualityOptions, exposure_issue, face_issue
+
+logger = logging.getLogger(__name__)
+
+
+class FaceAnalysis(NamedTuple):
+    """Résultat du pipeline pour une image (sérialisable entre processus)"""
+    face_locations: List[Tuple[int, int, int, int]]
+    encoding: Optional[np.ndarray]
+    # Durée de chaque étape (secondes), mesurée dans le processus du pool
+    timings: Optional[Dict[str, float]] = None
+    # Passages des détecteurs de la cascade, dans l'ordre
+    detector_runs: Optional[List[DetectorRun]] = None
+    # Code de refus du contrôle de qualité (quality.QUALITY_*) et scores mesurés
+    quality_issue: Optional[str] = None
+    quality: Optional[Dict[str, float]] = None
+
+    @property
+    def face_count(self) -> int:
+        return len(self.face_locations)
+
+
+class PipelineOptions(NamedTuple):
+    """Paramètres du pipeline transmis aux processus du pool"""
+    detection_max_side: int = 640
+    detection_retry_max_side: int = 0
+    encoding_max_side: int = 1600
+    max_image_pixels: int = 50_000_000
+    detectors: Tuple[str, ...] = ("hog",)
+    detector_options: DetectorOptions = DetectorOptions()
+    quality: QualityOptions = QualityOptions()
+
+
+# Tag EXIF de l'orientation de la prise de vue
+ORIENTATION_TAG = 0x0112
+
+
+class PipelineBusyError(Exception):
+    """Levée quand la file d'attente du pipeline est pleine"""
+
+
+class ImageTooLargeError(ValueError):
+    """Levée quand l'image dépasse FACE_MAX_IMAGE_PIXELS (avant décodage)"""
+
+
+def decode_image(contents: bytes, max_side: int = 0, max_pixels: int = 0) -> np.ndarray:
+    """
+    Décoder une image uploadée en array RGB uint8, réduite et redressée
+
+    Les JPEG sont décodés directement à l'échelle 1/2, 1/4 ou 1/8 la plus
+    proche au-dessus de max_side (réduction dans le domaine DCT par libjpeg):
+    le coût et la mémoire dépendent de la taille de sortie, pas de l'upload.
+    L'orientation EXIF est appliquée et la conversion RGB se fait en une passe.
+
+    Args:
+        contents: Octets de l'image (JPEG, PNG)
+        max_side: Plus grand côté de l'image retournée (0 = pas de réduction)
+        max_pixels: Nombre de pixels maximum de l'upload (0 = pas de limite)
+
+    Returns:
+        Array numpy (H x W x 3)
+
+    Raises:
+        ImageTooLargeError: Si l'image dépasse max_pixels
+    """
+    import cv2
+    from PIL import Image, ImageOps
+
+    # Image.open ne lit que l'en-tête: les dimensions sont connues sans décoder
+    image = Image.open(io.BytesIO(contents))
+    width, height = image.size
+    if max_pixels > 0 and width * height > max_pixels:
+        raise ImageTooLargeError(
+            f"Image trop grande: {width}x{height} (maximum {max_pixels} pixels)"
+        )
+
+    longest = max(width, height)
+    if 0 < max_side < longest:
+        scale = max_side / longest
+        # JPEG uniquement (sans effet pour les autres formats)
+        image.draft("RGB", (max(1, round(width * scale)), max(1, round(height * scale))))
+
+    # Redresser selon l'orientation EXIF (photos de téléphone prises en portrait)
+    if _has_orientation(image):
+        image = ImageOps.exif_transpose(image)
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    image_array = np.array(image)
+
+    # Ajustement final après la réduction DCT (facteurs de 2 uniquement): il
+    # reste moins d'un facteur 2 pour un JPEG, l'interpolation linéaire suffit
+    height, width = image_array.shape[:2]
+    longest = max(width, height)
+    if 0 < max_side < longest:
+        scale = max_side / longest
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        interpolation = cv2.INTER_LINEAR if scale > 0.5 else cv2.INTER_AREA
+        image_array = cv2.resize(image_array, size, interpolation=interpolation)
+
+    return image_array
+
+
+def _has_orientation(image: "Image.Image") -> bool:
+    """L'image porte-t-elle une orientation EXIF autre que la normale?"""
+    try:
+        return image.getexif().get(ORIENTATION_TAG, 1) != 1
+    except Exception:
+        return False
+
+
+def resize_to_max_side(image_array: np.ndarray, max_side: int) -> Tuple[np.ndarray, float]:
+    """
+    Réduire une image pour que son plus grand côté ne dépasse pas max_side
+
+    Args:
+        image_array: Image RGB
+        max_side: Plus grand côté autorisé (0 = pas de réduction)
+
+    Returns:
+        Tuple (image éventuellement réduite, facteur d'échelle appliqué)
+    """
+    height, width = image_array.shape[:2]
+    longest = max(height, width)
+    if max_side <= 0 or longest <= max_side:
+        return image_array, 1.0
+
+    import cv2
+
+    scale = max_side / longest
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image_array, size, interpolation=cv2.INTER_AREA), scale
+
+
+def scale_locations(
+    face_locations: List[Tuple[int, int, int, int]],
+    factor: float,
+    shape: Tuple[int, ...]
+) -> List[Tuple[int, int, int, int]]:
+    """
+    Convertir des boîtes (top, right, bottom, left) d'une résolution à une autre
+
+    Args:
+        face_locations: Boîtes détectées
+        factor: Rapport résolution cible / résolution de détection
+        shape: Dimensions de l'image cible (pour borner les boîtes)
+
+    Returns:
+        Boîtes dans la résolution cible
+    """
+    height, width = shape[:2]
+    return [
+        (
+            max(0, int(round(top * factor))),
+            min(width, int(round(right * factor))),
+            min(height, int(round(bottom * factor))),
+            max(0, int(round(left * factor))),
+        )
+        for top, right, bottom, left in face_locations
+    ]
+
+
+def detect_faces(
+    image_array: np.ndarray,
+    options: PipelineOptions,
+    runs: Optional[List[DetectorRun]] = None
+) -> List[Tuple[int, int, int, int]]:
+    """
+    Détecter les visages sur une copie réduite de l'image
+
+    La cascade de détecteurs (FACE_DETECTOR_CASCADE) tourne sur une image
+    plafonnée à detection_max_side; si aucun visage n'est trouvé, une seconde
+    passe du premier détecteur (le moins coûteux) est faite à
+    detection_retry_max_side (0 = pleine résolution) pour les visages petits
+    ou lointains.
+
+    Args:
+        image_array: Image RGB
+        options: Résolutions et détecteurs
+        runs: Liste complétée avec chaque passage de détecteur
+
+    Returns:
+        Boîtes (top, right, bottom, left) dans la résolution de image_array
+    """
+    if runs is None:
+        runs = []
+
+    attempts = [(options.detection_max_side, options.detectors)]
+    if options.detection_max_side > 0:
+        attempts.append((options.detection_retry_max_side, options.detectors[:1]))
+
+    tried = set()
+    for max_side, cascade in attempts:
+        small, scale = resize_to_max_side(image_array, max_side)
+        if small.shape in tried:
+            continue
+        tried.add(small.shape)
+
+        face_locations = run_cascade(small, cascade, options.detector_options, runs)
+        if face_locations:
+            return scale_locations(face_locations, 1.0 / scale, image_array.shape)
+
+    return []
+
+
+def analyze_image(contents: bytes, options: PipelineOptions = PipelineOptions()) -> FaceAnalysis:
+    """
+    Décoder l'image, détecter les visages et encoder le visage s'il est unique
+
+    Le contrôle de qualité encadre la détection: une image trop sombre ou
+    surexposée n'est pas passée au détecteur, un visage trop petit, flou ou
+    de biais n'est pas encodé (quality_issue donne la raison).
+
+    Exécuté dans un processus du pool: ne doit dépendre que de ses arguments.
+
+    Args:
+        contents: Octets de l'image
+        options: Résolutions de détection et d'encodage, seuils de qualité
+
+    Returns:
+        FaceAnalysis (encoding est None si 0 ou plusieurs visages ou si la
+        qualité est insuffisante), boîtes exprimées dans la résolution d'encodage
+    """
+    import face_recognition
+
+    timings = {}
+    scores = {}
+    start = time.perf_counter()
+
+    # Décodage directement à la résolution d'encodage (points de repère et encodage)
+    encoding_image = decode_image(
+        contents,
+        max_side=options.encoding_max_side,
+        max_pixels=options.max_image_pixels
+    )
+    timings[STAGE_DECODE] = time.perf_counter() - start
+
+    if options.quality.enabled:
+        start = time.perf_counter()
+        issue = exposure_issue(encoding_image, options.quality, scores)
+        timings[STAGE_QUALITY] = time.perf_counter() - start
+        if issue is not None:
+            return FaceAnalysis(
+                face_locations=[],
+                encoding=None,
+                timings=timings,
+                quality_issue=issue,
+                quality=scores
+            )
+
+    # Détecter les visages sur une copie réduite
+    start = time.perf_counter()
+    detector_runs = []
+    face_locations = detect_faces(encoding_image, options, detector_runs)
+    timings[STAGE_FACE_LOCATIONS] = time.perf_counter() - start
+
+    issue = None
+    if len(face_locations) == 1 and options.quality.enabled:
+        start = time.perf_counter()
+        issue = face_issue(encoding_image, face_locations[0], options.quality, scores)
+        timings[STAGE_QUALITY] += time.perf_counter() - start
+
+    encoding = None
+    if len(face_locations) == 1 and issue is None:
+        start = time.perf_counter()
+        face_encodings = face_recognition.face_encodings(encoding_image, face_locations)
+        timings[STAGE_FACE_ENCODINGS] = time.perf_counter() - start
+        if len(face_encodings) > 0:
+            encoding = face_encodings[0]
+
+    return FaceAnalysis(
+        face_locations=face_locations,
+        encoding=encoding,
+        timings=timings,
+        detector_runs=detector_runs,
+        quality_issue=issue,
+        quality=scores or None
+    )
+
+
+def _warm_up_worker(options: PipelineOptions = PipelineOptions()):
+    """
+    Initialiseur des processus du pool: charger les modèles (détecteurs de la
+    cascade, prédicteur de points, réseau d'encodage dlib) avant la première requête
+    """
+    import face_recognition
+
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    warm_up_detectors(options.detectors, options.detector_options)
+    face_recognition.face_encodings(blank, known_face_locations=[(0, 64, 64, 0)])
+
+
+def warmup_image() -> bytes:
+    """
+    Image de chauffe embarquée: JPEG synthétique 640x480 (dégradé, sans visage)
+
+    Exerce décodage, réduction et détection comme une photo de borne.
+    """
+    from PIL import Image
+
+    x = np.linspace(0, 255, 640, dtype=np.uint8)[None, :]
+    y = np.linspace(0, 255, 480, dtype=np.uint8)[:, None]
+    pixels = np.stack(np.broadcast_arrays(x, y, (x // 2 + y // 2)), axis=2)
+
+    buffer = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(pixels)).save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _warm_up_run(contents: bytes, options: PipelineOptions) -> float:
+    """Charger les modèles et traiter l'image de chauffe (dans un processus du pool)"""
+    start = time.perf_counter()
+    _warm_up_worker(options)
+    analyze_image(contents, options)
+    return time.perf_counter() - start
+
+
+# Pool global et nombre de requêtes en cours (soumises ou en attente)
+_executor: Optional[Executor] = None
+_pending = 0
+_warm = False
+
+# Demandes d'admission en attente de place dans la file, servies dans l'ordre
+# d'arrivée: (nombre d'images, future résolue à l'admission)
+_waiters: Deque[Tuple[int, "asyncio.Future[None]"]] = deque()
+
+
+def init_face_pipeline():
+    """
+    Initialiser le pool de processus du pipeline
+
+    FACE_PIPELINE_WORKERS = 0 exécute le pipeline dans un thread du processus
+    courant (pratique en développement).
+    """
+    global _executor
+
+    if _executor is not None:
+        logger.info("Pool du pipeline déjà initialisé")
+        return
+
+    settings = get_app_settings()
+    workers = settings.FACE_PIPELINE_WORKERS
+
+    if workers == 0:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="face-pipeline")
+        logger.info("✅ Pipeline facial en mode thread (FACE_PIPELINE_WORKERS=0)")
+        return
+
+    # spawn: pas d'héritage de l'état (threads, connexions) du processus uvicorn
+    _executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_warm_up_worker,
+        initargs=(_pipeline_options(),)
+    )
+    logger.info(f"✅ Pool du pipeline facial initialisé ({workers} processus)")
+
+
+def close_face_pipeline():
+    """Arrêter le pool de processus du pipeline"""
+    global _executor, _warm
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        _warm = False
+        logger.info("Pool du pipeline facial arrêté")
+
+
+async def warm_up_face_pipeline() -> float:
+    """
+    Démarrer tous les processus du pool et y traiter l'image de chauffe
+
+    Le pool ne crée ses processus qu'à la demande: une tâche de chauffe par
+    processus, soumises ensemble, force leur création et le chargement des
+    modèles dlib avant la première requête.
+
+    Returns:
+        Durée de la chauffe (secondes)
+    """
+    global _warm
+
+    if _executor is None:
+        init_face_pipeline()
+
+    start = time.perf_counter()
+    workers = max(1, get_app_settings().FACE_PIPELINE_WORKERS)
+    contents = warmup_image()
+    options = _pipeline_options()
+
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(
+        loop.run_in_executor(_executor, _warm_up_run, contents, options)
+        for _ in range(workers)
+    ))
+
+    _warm = True
+    elapsed = time.perf_counter() - start
+    logger.info(f"✅ Pipeline facial chauffé en {elapsed:.2f}s ({workers} processus)")
+    return elapsed
+
+
+def is_warm() -> bool:
+    """Les modèles sont-ils chargés dans le pool (warm_up_face_pipeline terminé)?"""
+    return _warm
+
+
+def pending_count() -> int:
+    """Nombre d'images soumises au pipeline et pas encore traitées"""
+    return _pending
+
+
+def _pipeline_options() -> PipelineOptions:
+    """Construire les options du pipeline depuis la configuration"""
+    settings = get_app_settings()
+    return PipelineOptions(
+        detection_max_side=settings.FACE_DETECTION_MAX_SIDE,
+        detection_retry_max_side=settings.FACE_DETECTION_RETRY_MAX_SIDE,
+        encoding_max_side=settings.FACE_ENCODING_MAX_SIDE,
+        max_image_pixels=settings.FACE_MAX_IMAGE_PIXELS,
+        detectors=tuple(settings.get_detector_cascade()),
+        detector_options=DetectorOptions(
+            dnn_prototxt=settings.FACE_DETECTOR_DNN_PROTOTXT,
+            dnn_model=settings.FACE_DETECTOR_DNN_MODEL,
+            dnn_confidence=settings.FACE_DETECTOR_DNN_CONFIDENCE,
+            haar_min_neighbors=settings.FACE_DETECTOR_HAAR_MIN_NEIGHBORS
+        ),
+        quality=QualityOptions(
+            enabled=settings.FACE_QUALITY_ENABLED,
+            min_brightness=settings.FACE_QUALITY_MIN_BRIGHTNESS,
+            max_brightness=settings.FACE_QUALITY_MAX_BRIGHTNESS,
+            min_sharpness=settings.FACE_QUALITY_MIN_SHARPNESS,
+            min_face_size=settings.FACE_QUALITY_MIN_FACE_SIZE,
+            max_roll_degrees=settings.FACE_QUALITY_MAX_ROLL_DEGREES,
+            max_yaw_ratio=settings.FACE_QUALITY_MAX_YAW_RATIO
+        )
+    )
+
+
+def _observe(analysis: FaceAnalysis):
+    """Enregistrer les métriques mesurées dans le processus du pool"""
+    observe_stages(analysis.timings)
+    observe_detector_runs(analysis.detector_runs)
+
+
+async def _acquire(count: int = 1):
+    """
+    Admettre `count` images dans le pool
+
+    Les demandes qui ne tiennent pas dans la file attendent qu'elle se vide,
+    au plus FACE_PIPELINE_QUEUE_TIMEOUT secondes, et sont admises dans leur
+    ordre d'arrivée: un lot en attente n'est pas doublé par les images
+    isolées arrivées après lui.
+
+    Raises:
+        PipelineBusyError: Si ces images ne tiennent pas dans la file
+            (FACE_PIPELINE_MAX_QUEUE) avant l'expiration du délai
+    """
+    global _pending
+
+    settings = get_app_settings()
+    if not _waiters and _pending + count <= settings.FACE_PIPELINE_MAX_QUEUE:
+        _pending += count
+        return
+
+    timeout = settings.FACE_PIPELINE_QUEUE_TIMEOUT
+    if timeout <= 0 or count > settings.FACE_PIPELINE_MAX_QUEUE:
+        raise PipelineBusyError(
+            f"File du pipeline pleine ({_pending} images en cours, {count} demandée(s))"
+        )
+
+    waiter = asyncio.get_running_loop().create_future()
+    entry = (count, waiter)
+    _waiters.append(entry)
+    try:
+        await asyncio.wait({waiter}, timeout=timeout)
+    except BaseException:
+        # Appelant annulé: rendre les places s'il venait d'être admis
+        if waiter.done():
+            _release(count)
+        else:
+            _abandon(entry)
+        raise
+
+    if not waiter.done():
+        _abandon(entry)
+        raise PipelineBusyError(
+            f"File du pipeline pleine depuis {timeout:g}s "
+            f"({_pending} images en cours, {count} demandée(s))"
+        )
+
+
+def _release(count: int = 1):
+    """Rendre les places de `count` images traitées et admettre les suivantes"""
+    global _pending
+
+    _pending -= count
+    _wake_waiters()
+
+
+def _abandon(entry: Tuple[int, "asyncio.Future[None]"]):
+    """Retirer une demande non admise; celles qu'elle bloquait passent"""
+    entry[1].cancel()
+    _waiters.remove(entry)
+    _wake_waiters()
+
+
+def _wake_waiters():
+    """Admettre, dans l'ordre d'arrivée, les demandes qui tiennent dans la file"""
+    global _pending
+
+    max_queue = get_app_settings().FACE_PIPELINE_MAX_QUEUE
+    while _waiters and _pending + _waiters[0][0] <= max_queue:
+        count, waiter = _waiters.popleft()
+        _pending += count
+        waiter.set_result(None)
+
+
+async def run_face_pipeline(contents: bytes, user_id: Optional[str] = None) -> FaceAnalysis:
+    """
+    Exécuter le pipeline hors de la boucle d'événements
+
+    Une image déjà analysée (même contenu) est servie par le cache des
+    analyses sans repasser par le pool.
+
+    Args:
+        contents: Octets de l'image
+        user_id: Utilisateur auquel l'image appartient (invalidation du cache)
+
+    Returns:
+        FaceAnalysis
+
+    Raises:
+        PipelineBusyError: Si FACE_PIPELINE_MAX_QUEUE requêtes sont toujours en
+            cours après FACE_PIPELINE_QUEUE_TIMEOUT secondes
+    """
+    return await get_analysis_cache().get_or_compute(
+        contents, lambda: _run_in_pool(contents), user_id
+    )
+
+
+async def _run_in_pool(contents: bytes) -> FaceAnalysis:
+    global _pending
+
+    if _executor is None:
+        init_face_pipeline()
+
+    await _acquire()
+    options = _pipeline_options()
+
+    try:
+        loop = asyncio.get_running_loop()
+        analysis = await loop.run_in_executor(_executor, analyze_image, contents, options)
+        _observe(analysis)
+        return analysis
+    finally:
+        _release()
+
+
+async def run_face_pipeline_batch(
+    contents_list: List[bytes],
+    use_cache: bool = True
+) -> List[Union[FaceAnalysis, Exception]]:
+    """
+    Exécuter le pipeline sur plusieurs images en parallèle dans le pool
+
+    Le lot est admis en bloc, quitte à attendre que la file se vide (voir
+    _acquire): une requête de lot ne peut donc pas être refusée à moitié.
+    Les images déjà en cache ne passent pas par le pool et ne comptent pas
+    dans la file.
+
+    Args:
+        contents_list: Octets de chaque image
+        use_cache: Consulter et alimenter le cache des analyses (désactivé
+            pour l'import en masse, qui en chasserait les entrées utiles)
+
+    Returns:
+        Un FaceAnalysis par image, ou l'exception levée pour cette image
+
+    Raises:
+        PipelineBusyError: Si les images à analyser ne tiennent pas dans la
+            file (FACE_PIPELINE_MAX_QUEUE) avant FACE_PIPELINE_QUEUE_TIMEOUT
+    """
+    cache = get_analysis_cache()
+    use_cache = use_cache and cache.enabled
+    keys = [content_key(contents) for contents in contents_list] if use_cache else []
+    analyses: List[Union[FaceAnalysis, Exception, None]] = (
+        [cache.get(key) for key in keys] if use_cache else [None] * len(contents_list)
+    )
+    misses = [index for index, analysis in enumerate(analyses) if analysis is None]
+    if use_cache:
+        for analysis in analyses:
+            record_cache_lookup("miss" if analysis is None else "hit")
+    if not misses:
+        return analyses
+
+    if _executor is None:
+        init_face_pipeline()
+
+    await _acquire(len(misses))
+    options = _pipeline_options()
+
+    try:
+        loop = asyncio.get_running_loop()
+        futures = [
+            loop.run_in_executor(_executor, analyze_image, contents_list[index], options)
+            for index in misses
+        ]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        for index, analysis in zip(misses, results):
+            analyses[index] = analysis
+            if isinstance(analysis, FaceAnalysis):
+                _observe(analysis)
+                if use_cache:
+                    cache.put(keys[index], analysis)
+        return analyses
+    finally:
+        _release(len(misses))
@@ -0,0 +1,492 @@
+"""
+Galerie d'encodages faciaux en mémoire pour TwoInOne ML Backend
+Index vectorisé résident en mémoire pour la vérification 1:N
+"""
+
+import threading
+import logging
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Dimension des encodages produits par face_recognition (dlib)
+ENCODING_DIM = 128
+
+# Capacité initiale de la matrice (agrandie par doublement)
+_INITIAL_CAPACITY = 1024
+
+# Lignes de galerie traitées par bloc dans les recherches par lot (borne la mémoire)
+_MATCH_CHUNK = 65536
+
+# Lignes supprimées tolérées avant compactage (au moins ce nombre, ou un quart)
+_MIN_DROPPED_ROWS = 64
+
+
+class FaceGallery:
+    """
+    Index en mémoire de tous les encodages faciaux
+
+    Les encodages sont stockés dans une matrice float32 contiguë (N x 128),
+    accompagnée de tableaux parallèles pour les user_ids et les ids PostgreSQL.
+    La recherche du meilleur candidat se fait en un seul calcul vectorisé.
+
+    Les ajouts écrivent au-delà de la taille courante (les lecteurs ne voient
+    jamais une ligne partiellement écrite). Une suppression marque la ligne
+    (norme infinie, jamais retenue par la recherche, id -1 et user_id None),
+    comme dans la galerie partagée; quand les lignes marquées dépassent un
+    quart, les tableaux sont reconstruits (copy-on-write). Les lectures se
+    font donc sans verrou long et une suppression ne recopie pas la matrice.
+    """
+
+    def __init__(self, dim: int = ENCODING_DIM, initial_capacity: int = _INITIAL_CAPACITY):
+        self.dim = dim
+        self._initial_capacity = initial_capacity
+        self._lock = threading.RLock()
+        self._encodings = np.empty((0, dim), dtype=np.float32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._user_ids = np.empty(0, dtype=object)
+        self._row_ids = np.empty(0, dtype=np.int64)
+        self._size = 0
+        # Lignes marquées supprimées dans [0, _size)
+        self._dropped = 0
+        # Nombre de lignes vivantes de chaque utilisateur
+        self._user_row_counts: Dict[str, int] = {}
+        self._loaded = False
+
+    @property
+    def is_loaded(self) -> bool:
+        """True si la galerie a été chargée depuis la base"""
+        return self._loaded
+
+    @property
+    def is_writer(self) -> bool:
+        """True si ce processus alimente lui-même la galerie (toujours, hors galerie partagée)"""
+        return True
+
+    def __len__(self) -> int:
+        return self._size - self._dropped
+
+    def user_count(self) -> int:
+        """Nombre d'utilisateurs distincts présents dans la galerie"""
+        return len(self._user_row_counts)
+
+    def load(self, rows: Iterable[Tuple[int, str, Iterable[float]]]):
+        """
+        Remplacer le contenu de la galerie
+
+        Args:
+            rows: Itérable de tuples (id, user_id, encodage)
+        """
+        rows = list(rows)
+        row_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        user_ids = [row[1] for row in rows]
+        encodings = np.array(
+            [self._as_vector(row[2]) for row in rows], dtype=np.float32
+        ).reshape(-1, self.dim)
+        self.load_arrays(row_ids, user_ids, encodings)
+
+    def load_arrays(self, row_ids: Iterable[int], user_ids: Iterable[str], encodings: np.ndarray):
+        """
+        Remplacer le contenu de la galerie à partir de tableaux déjà décodés
+
+        Args:
+            row_ids: IDs des lignes dans face_encodings
+            user_ids: user_id de chaque ligne
+            encodings: Matrice (N x 128) des encodages
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        count = len(encodings)
+        capacity = max(self._initial_capacity, count)
+
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        matrix[:count] = encodings
+        ids = np.empty(capacity, dtype=object)
+        ids[:count] = list(user_ids)
+        rows = np.empty(capacity, dtype=np.int64)
+        rows[:count] = np.asarray(row_ids, dtype=np.int64)
+
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        sq_norms[:count] = np.einsum("ij,ij->i", matrix[:count], matrix[:count])
+
+        user_rows = dict(Counter(ids[:count].tolist()))
+
+        with self._lock:
+            self._encodings = matrix
+            self._sq_norms = sq_norms
+            self._user_ids = ids
+            self._row_ids = rows
+            self._size = count
+            self._dropped = 0
+            self._user_row_counts = user_rows
+            self._loaded = True
+
+        logger.info(f"Galerie chargée: {count} encodage(s)")
+
+    def add(
+        self,
+        row_id: int,
+        user_id: str,
+        encoding: Iterable[float],
+        max_per_user: Optional[int] = None
+    ):
+        """
+        Ajouter un encodage et, si demandé, ne garder que les plus récents
+
+        Args:
+            row_id: ID de la ligne dans face_encodings
+            user_id: ID de l'utilisateur
+            encoding: Encodage facial (128 floats)
+            max_per_user: Nombre maximum d'encodages conservés pour cet utilisateur
+        """
+        vector = self._as_vector(encoding)
+
+        with self._lock:
+            if max_per_user is not None:
+                self._trim_user(user_id, max_per_user - 1)
+
+            if self._size == len(self._encodings):
+                self._grow()
+
+            index = self._size
+            self._encodings[index] = vector
+            self._sq_norms[index] = float(np.dot(vector, vector))
+            self._user_ids[index] = user_id
+            self._row_ids[index] = row_id
+            self._size = index + 1
+            self._user_row_counts[user_id] = self._user_row_counts.get(user_id, 0) + 1
+
+    def remove_user(self, user_id: str) -> int:
+        """
+        Retirer tous les encodages d'un utilisateur
+
+        Returns:
+            Nombre d'encodages retirés
+        """
+        with self._lock:
+            return self._trim_user(user_id, 0)
+
+    def replace_user(self, user_id: str, row_ids: Iterable[int], encodings: Iterable[Iterable[float]]):
+        """
+        Remplacer tous les encodages d'un utilisateur (resynchronisation depuis la base)
+
+        Args:
+            user_id: ID de l'utilisateur
+            row_ids: IDs des lignes de l'utilisateur dans face_encodings
+            encodings: Encodages correspondants
+        """
+        with self._lock:
+            self._trim_user(user_id, 0)
+            for row_id, encoding in zip(row_ids, encodings):
+                self.add(row_id, user_id, encoding)
+
+    def export_arrays(self) -> Tuple[np.ndarray, List[str], np.ndarray]:
+        """
+        Contenu de la galerie sous la forme acceptée par load_arrays
+
+        Returns:
+            Tuple (ids, user_ids, encodages), copiés (sans les lignes supprimées)
+        """
+        user_ids, encodings, _, row_ids = self.snapshot()
+        live = row_ids >= 0
+        return row_ids[live], user_ids[live].tolist(), encodings[live]
+
+    def version(self) -> Tuple[int, int, int]:
+        """
+        Signature du contenu: (nombre de lignes, id max, somme des ids)
+
+        Comparée à la même signature calculée par PostgreSQL pour détecter
+        une galerie désynchronisée.
+        """
+        _, _, _, row_ids = self.snapshot()
+        row_ids = row_ids[row_ids >= 0]
+        if len(row_ids) == 0:
+            return 0, 0, 0
+        return len(row_ids), int(row_ids.max()), int(row_ids.sum())
+
+    def remove_rows(self, row_ids: Iterable[int]) -> int:
+        """
+        Retirer des encodages par ID de ligne
+
+        Returns:
+            Nombre d'encodages retirés
+        """
+        with self._lock:
+            size = self._size
+            indices = np.flatnonzero(
+                np.isin(self._row_ids[:size], np.fromiter(row_ids, dtype=np.int64))
+            )
+            if len(indices):
+                self._drop(indices)
+            return len(indices)
+
+    def best_match(self, probe: Iterable[float]) -> Tuple[Optional[str], float]:
+        """
+        Trouver l'encodage le plus proche de l'encodage à vérifier
+
+        Args:
+            probe: Encodage facial à comparer
+
+        Returns:
+            Tuple (user_id, distance euclidienne), (None, inf) si la galerie est vide
+        """
+        user_ids, encodings, sq_norms, _ = self.snapshot()
+        if len(user_ids) == 0:
+            return None, float("inf")
+
+        distances = self._distances(self._as_vector(probe), encodings, sq_norms)
+        best = int(np.argmin(distances))
+        user_id, distance = user_ids[best], float(distances[best])
+        if user_id is None and distance != float("inf"):
+            # Ligne retirée (marquée en place) pendant le calcul: recommencer
+            return self.best_match(probe)
+        return user_id, distance
+
+    def best_matches(self, probes: np.ndarray) -> List[Tuple[Optional[str], float]]:
+        """
+        Trouver le meilleur candidat pour plusieurs encodages en un calcul matrice-matrice
+
+        Args:
+            probes: Matrice (M x 128) des encodages à comparer
+
+        Returns:
+            Liste de M tuples (user_id, distance euclidienne)
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        user_ids, encodings, sq_norms, _ = self.snapshot()
+        if len(user_ids) == 0 or len(probes) == 0:
+            return [(None, float("inf"))] * len(probes)
+
+        probe_norms = np.einsum("ij,ij->i", probes, probes)
+        best_rows = np.zeros(len(probes), dtype=np.int64)
+        best_squared = np.full(len(probes), np.inf, dtype=np.float32)
+
+        # Parcours par blocs: ne jamais matérialiser une matrice M x N complète
+        for start in range(0, len(encodings), _MATCH_CHUNK):
+            block = encodings[start:start + _MATCH_CHUNK]
+            squared = (
+                probe_norms[:, None]
+                + sq_norms[None, start:start + len(block)]
+                - 2.0 * (probes @ block.T)
+            )
+            rows = np.argmin(squared, axis=1)
+            values = squared[np.arange(len(probes)), rows]
+            better = values < best_squared
+            best_squared[better] = values[better]
+            best_rows[better] = rows[better] + start
+
+        distances = np.sqrt(np.maximum(best_squared, 0.0))
+        return self._rematch_dropped(probes, [
+            (user_ids[row], float(distance))
+            for row, distance in zip(best_rows.tolist(), distances.tolist())
+        ])
+
+    def _rematch_dropped(
+        self,
+        probes: np.ndarray,
+        results: List[Tuple[Optional[str], float]]
+    ) -> List[Tuple[Optional[str], float]]:
+        """
+        Refaire les recherches dont la ligne retenue a été retirée pendant le calcul
+
+        Une suppression marque la ligne en place dans les tableaux que la
+        recherche est en train de lire: la distance a pu être calculée avant la
+        marque et le user_id lu après (None). La ligne ayant désormais une norme
+        infinie, la nouvelle recherche ne la retient plus.
+        """
+        stale = [
+            index for index, (user_id, distance) in enumerate(results)
+            if user_id is None and distance != float("inf")
+        ]
+        if stale:
+            for index, match in zip(stale, self.best_matches(probes[stale])):
+                results[index] = match
+        return results
+
+    def user_encodings(self, user_id: str) -> np.ndarray:
+        """Encodages (copie) d'un utilisateur, du plus ancien au plus récent"""
+        user_ids, encodings, _, row_ids = self.snapshot()
+        mask = user_ids == user_id
+        order = np.argsort(row_ids[mask], kind="stable")
+        return encodings[mask][order]
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Vues cohérentes (user_ids, encodages, normes², ids) de la galerie
+
+        Les lignes supprimées y restent jusqu'au compactage suivant, avec une
+        norme infinie, un id -1 et un user_id None.
+        """
+        with self._lock:
+            size = self._size
+            return (
+                self._user_ids[:size],
+                self._encodings[:size],
+                self._sq_norms[:size],
+                self._row_ids[:size],
+            )
+
+    @staticmethod
+    def _distances(probe: np.ndarray, encodings: np.ndarray, sq_norms: np.ndarray) -> np.ndarray:
+        """
+        Distances euclidiennes entre un encodage et une matrice d'encodages
+
+        Équivalent à face_recognition.face_distance, calculé via
+        ||a - b||² = ||a||² + ||b||² - 2 a·b (un seul produit matrice-vecteur).
+        """
+        squared = sq_norms + np.dot(probe, probe) - 2.0 * (encodings @ probe)
+        np.maximum(squared, 0.0, out=squared)
+        return np.sqrt(squared)
+
+    def _as_vector(self, encoding: Iterable[float]) -> np.ndarray:
+        vector = np.asarray(encoding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(
+                f"Encodage de dimension {vector.shape[0]} invalide (attendu: {self.dim})"
+            )
+        return vector
+
+    def _grow(self):
+        """Doubler la capacité des tableaux (appelé sous verrou)"""
+        capacity = max(self._initial_capacity, 2 * len(self._encodings))
+        size = self._size
+
+        encodings = np.empty((capacity, self.dim), dtype=np.float32)
+        encodings[:size] = self._encodings[:size]
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        sq_norms[:size] = self._sq_norms[:size]
+        user_ids = np.empty(capacity, dtype=object)
+        user_ids[:size] = self._user_ids[:size]
+        row_ids = np.empty(capacity, dtype=np.int64)
+        row_ids[:size] = self._row_ids[:size]
+
+        self._encodings = encodings
+        self._sq_norms = sq_norms
+        self._user_ids = user_ids
+        self._row_ids = row_ids
+
+    def _trim_user(self, user_id: str, keep: int) -> int:
+        """
+        Ne garder que les `keep` encodages les plus récents d'un utilisateur
+        (appelé sous verrou)
+
+        Returns:
+            Nombre d'encodages retirés
+        """
+        # Le cas courant (utilisateur sous la limite) ne balaie pas la galerie
+        if self._user_row_counts.get(user_id, 0) <= max(keep, 0):
+            return 0
+
+        size = self._size
+        user_rows = np.flatnonzero(self._user_ids[:size] == user_id)
+        excess = len(user_rows) - max(keep, 0)
+        if excess <= 0:
+            return 0
+
+        # Les ids SERIAL croissent avec created_at: les plus petits sont les plus anciens
+        oldest = user_rows[np.argsort(self._row_ids[user_rows], kind="stable")[:excess]]
+        self._drop(oldest)
+        return excess
+
+    def _drop(self, indices: np.ndarray):
+        """Marquer des lignes comme supprimées, compacter si nécessaire (appelé sous verrou)"""
+        for user_id in self._user_ids[indices].tolist():
+            remaining = self._user_row_counts[user_id] - 1
+            if remaining:
+                self._user_row_counts[user_id] = remaining
+            else:
+                del self._user_row_counts[user_id]
+
+        # Norme infinie d'abord: la ligne n'est plus jamais retenue
+        self._sq_norms[indices] = np.inf
+        self._user_ids[indices] = None
+        self._row_ids[indices] = -1
+        self._dropped += len(indices)
+
+        if self._dropped > max(_MIN_DROPPED_ROWS, self._size // 4):
+            self._compact()
+
+    def _compact(self):
+        """Retirer les lignes marquées (appelé sous verrou)"""
+        size = self._size
+        keep_mask = self._row_ids[:size] >= 0
+        new_size = int(keep_mask.sum())
+
+        # Copy-on-write: les lecteurs en cours gardent les anciens tableaux
+        capacity = len(self._encodings)
+        encodings = np.empty((capacity, self.dim), dtype=np.float32)
+        encodings[:new_size] = self._encodings[:size][keep_mask]
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        sq_norms[:new_size] = self._sq_norms[:size][keep_mask]
+        user_ids = np.empty(capacity, dtype=object)
+        user_ids[:new_size] = self._user_ids[:size][keep_mask]
+        row_ids = np.empty(capacity, dtype=np.int64)
+        row_ids[:new_size] = self._row_ids[:size][keep_mask]
+
+        self._encodings = encodings
+        self._sq_norms = sq_norms
+        self._user_ids = user_ids
+        self._row_ids = row_ids
+        self._size = new_size
+        self._dropped = 0
+
+
+# Instance globale de la galerie (une par processus)
+_gallery: Optional[FaceGallery] = None
+
+
+def _new_engine(settings, initial_capacity: int = _INITIAL_CAPACITY):
+    """Galerie vide du moteur FACE_INDEX_ENGINE (locale au processus)"""
+    if settings.FACE_INDEX_ENGINE == "prototype":
+        from prototype import PrototypeFaceGallery
+        return PrototypeFaceGallery(
+            candidates=settings.FACE_PROTOTYPE_CANDIDATES,
+            initial_capacity=initial_capacity
+        )
+    if settings.FACE_INDEX_ENGINE == "ivf":
+        from ann import IVFFaceIndex
+        return IVFFaceIndex(
+            nlist=settings.FACE_INDEX_IVF_NLIST,
+            nprobe=settings.FACE_INDEX_IVF_NPROBE,
+            min_train_size=settings.FACE_INDEX_IVF_MIN_TRAIN_SIZE
+        )
+    return FaceGallery(initial_capacity=initial_capacity)
+
+
+def get_face_gallery() -> FaceGallery:
+    """
+    Obtenir l'instance globale de la galerie
+
+    Le moteur de recherche est choisi par FACE_INDEX_ENGINE:
+    "exact" (balayage vectorisé complet), "prototype" (tri par encodage moyen
+    de chaque utilisateur puis comparaison exacte) ou "ivf" (recherche approchée).
+    Avec FACE_SITE_PARTITIONS, chaque site a sa propre galerie de ce moteur
+    (voir site_gallery). Avec FACE_GALLERY_SHARED_DIR, la galerie exacte est
+    partagée entre les workers de la machine (voir shared_gallery).
+    """
+    global _gallery
+    if _gallery is None:
+        from config import get_app_settings
+        settings = get_app_settings()
+
+        if settings.FACE_SITE_PARTITIONS:
+            from site_gallery import SiteFaceGallery, SITE_INITIAL_CAPACITY
+            _gallery = SiteFaceGallery(lambda: _new_engine(settings, SITE_INITIAL_CAPACITY))
+            if settings.FACE_GALLERY_SHARED_DIR:
+                logger.warning("FACE_GALLERY_SHARED_DIR ignoré: les galeries par site restent propres à chaque worker")
+        elif settings.FACE_INDEX_ENGINE in ("prototype", "ivf"):
+            _gallery = _new_engine(settings)
+            if settings.FACE_GALLERY_SHARED_DIR:
+                logger.warning(
+                    f"FACE_GALLERY_SHARED_DIR ignoré: le moteur {settings.FACE_INDEX_ENGINE} "
+                    f"reste propre à chaque worker"
+                )
+        elif settings.FACE_GALLERY_SHARED_DIR:
+            from shared_gallery import SharedFaceGallery
+            _gallery = SharedFaceGallery(settings.FACE_GALLERY_SHARED_DIR)
+        else:
+            _gallery = FaceGallery()
+        logger.info(f"Moteur de galerie: {settings.FACE_INDEX_ENGINE}")
+    return _gallery
@@ -0,0 +1,304 @@
+"""
+Format de fichier de la galerie pour TwoInOne ML Backend
+Générations de la galerie partagée et instantanés de démarrage, mappés sans copie
+"""
+
+import logging
+import mmap
+import os
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# "TIOGAL02" en petit-boutiste: identifie un fichier de galerie (et sa version de format)
+MAGIC = 0x32304C4147494F54
+HEADER_BYTES = 4096
+_ALIGN = 64
+
+# Champs int64 de l'en-tête
+H_MAGIC = 0
+H_DIM = 1
+H_CAPACITY = 2
+H_USER_CAPACITY = 3
+H_BLOB_CAPACITY = 4
+H_COUNT = 5
+H_LIVE = 6
+H_USERS = 7
+H_LIVE_USERS = 8
+H_BLOB_USED = 9
+H_HIGH_WATER_ID = 10
+H_HIGH_WATER_UPDATED = 11
+H_HAS_SITES = 12
+
+# Capacités minimales avec réserve (lignes / utilisateurs, octets de noms)
+MIN_CAPACITY = 1024
+MIN_BLOB_CAPACITY = 64 * 1024
+
+
+def _layout(dim: int, capacity: int, user_capacity: int, blob_capacity: int):
+    """
+    Position des tableaux dans un fichier de galerie
+
+    Returns:
+        Tuple (dict nom -> (offset, dtype, forme), taille totale en octets)
+    """
+    sections = (
+        ("encodings", np.float32, (capacity, dim)),
+        ("sq_norms", np.float32, (capacity,)),
+        ("row_ids", np.int64, (capacity,)),
+        ("user_index", np.int32, (capacity,)),
+        ("site_index", np.int32, (capacity,)),
+        ("user_offsets", np.int64, (user_capacity + 1,)),
+        ("user_blob", np.uint8, (blob_capacity,)),
+    )
+    offset = HEADER_BYTES
+    layout = {}
+    for name, dtype, shape in sections:
+        layout[name] = (offset, dtype, shape)
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        offset += -(-nbytes // _ALIGN) * _ALIGN
+    return layout, offset
+
+
+class GalleryFile:
+    """
+    Vues NumPy sans copie sur un fichier de galerie mappé
+
+    Contenu: en-tête, matrice des encodages, normes², ids PostgreSQL, index
+    de l'utilisateur et du site de chaque ligne et table des noms (offsets +
+    UTF-8): les user_ids, suivis des sites dans un instantané partitionné.
+    Une ligne supprimée garde sa place avec une norme infinie et un id -1.
+    """
+
+    def __init__(self, path: str, mm: mmap.mmap):
+        self.path = path
+        self.mm = mm
+        self.header = np.frombuffer(mm, dtype=np.int64, count=HEADER_BYTES // 8)
+        if int(self.header[H_MAGIC]) != MAGIC:
+            raise ValueError(f"Fichier de galerie invalide: {path}")
+
+        self.dim = int(self.header[H_DIM])
+        layout, size = _layout(
+            self.dim,
+            int(self.header[H_CAPACITY]),
+            int(self.header[H_USER_CAPACITY]),
+            int(self.header[H_BLOB_CAPACITY])
+        )
+        if len(mm) < size:
+            raise ValueError(f"Fichier de galerie tronqué: {path}")
+
+        for name, (offset, dtype, shape) in layout.items():
+            array = np.frombuffer(mm, dtype=dtype, count=int(np.prod(shape)), offset=offset)
+            setattr(self, name, array.reshape(shape))
+
+    @classmethod
+    def open(cls, path: str) -> "GalleryFile":
+        """Mapper un fichier existant en lecture seule"""
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(path, mm)
+
+    @classmethod
+    def create(
+        cls,
+        path: str,
+        dim: int,
+        capacity: int,
+        user_capacity: int,
+        blob_capacity: int
+    ) -> "GalleryFile":
+        """Créer et mapper en écriture un fichier vide"""
+        _, size = _layout(dim, capacity, user_capacity, blob_capacity)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            mm = mmap.mmap(fd, size, access=mmap.ACCESS_WRITE)
+        finally:
+            os.close(fd)
+
+        header = np.frombuffer(mm, dtype=np.int64, count=HEADER_BYTES // 8)
+        header[H_MAGIC] = MAGIC
+        header[H_DIM] = dim
+        header[H_CAPACITY] = capacity
+        header[H_USER_CAPACITY] = user_capacity
+        header[H_BLOB_CAPACITY] = blob_capacity
+        gallery_file = cls(path, mm)
+        gallery_file.site_index[:] = -1
+        return gallery_file
+
+    @property
+    def capacity(self) -> int:
+        return len(self.row_ids)
+
+    @property
+    def high_water(self) -> Tuple[int, int]:
+        """(id max, limite haute updated_at en µs depuis l'époque) de la table au moment de l'écriture"""
+        return int(self.header[H_HIGH_WATER_ID]), int(self.header[H_HIGH_WATER_UPDATED])
+
+    @property
+    def has_sites(self) -> bool:
+        """True si le site de chaque ligne a été enregistré (galerie partitionnée par site)"""
+        return bool(self.header[H_HAS_SITES])
+
+    def user_name(self, slot: int) -> Optional[str]:
+        """user_id d'une entrée de la table des utilisateurs (None si ligne supprimée)"""
+        if slot < 0:
+            return None
+        start, end = self.user_offsets[slot], self.user_offsets[slot + 1]
+        return self.user_blob[start:end].tobytes().decode("utf-8")
+
+    def live_rows(self) -> Tuple[np.ndarray, List[str], np.ndarray]:
+        """
+        Lignes non supprimées
+
+        Returns:
+            Tuple (ids, user_ids, encodages); les encodages sont une copie
+        """
+        count = int(self.header[H_COUNT])
+        live = self.row_ids[:count] >= 0
+        names = [self.user_name(slot) for slot in range(int(self.header[H_USERS]))]
+        user_ids = [names[slot] for slot in self.user_index[:count][live].tolist()]
+        return self.row_ids[:count][live].copy(), user_ids, self.encodings[:count][live]
+
+    def live_sites(self) -> List[Optional[str]]:
+        """Site des lignes non supprimées, dans l'ordre de live_rows (None: sans site)"""
+        count = int(self.header[H_COUNT])
+        live = self.row_ids[:count] >= 0
+        slots = self.site_index[:count][live].tolist()
+        names = {slot: self.user_name(slot) for slot in set(slots)}
+        return [names[slot] for slot in slots]
+
+
+def write_gallery_file(
+    path: str,
+    row_ids: np.ndarray,
+    user_ids: List[str],
+    encodings: np.ndarray,
+    spare: bool = True,
+    high_water: Tuple[int, int] = (0, 0),
+    site_ids: Optional[List[Optional[str]]] = None
+) -> GalleryFile:
+    """
+    Écrire des lignes dans un nouveau fichier de galerie
+
+    Args:
+        path: Chemin du fichier (temporaire: renommé par l'appelant)
+        row_ids: IDs des lignes dans face_encodings
+        user_ids: user_id de chaque ligne
+        encodings: Matrice (N x 128) des encodages
+        spare: Réserver de la place pour des ajouts (galerie partagée)
+        high_water: (id max, updated_at max en µs) couverts par ces lignes
+        site_ids: Site de chaque ligne (galerie partitionnée par site)
+
+    Returns:
+        Fichier mappé en écriture
+    """
+    count = len(encodings)
+    slots = {}
+    user_index = np.fromiter(
+        (slots.setdefault(user_id, len(slots)) for user_id in user_ids),
+        dtype=np.int32,
+        count=count
+    )
+    user_count = len(slots)
+    names = list(slots)
+    if site_ids is not None:
+        # Les sites suivent les user_ids dans la table des noms (sans site: -1)
+        site_slots = {None: -1}
+        site_index = np.fromiter(
+            (
+                site_slots.setdefault(site_id, user_count + len(site_slots) - 1)
+                for site_id in site_ids
+            ),
+            dtype=np.int32,
+            count=count
+        )
+        names += [site_id for site_id in site_slots if site_id is not None]
+    names = [name.encode("utf-8") for name in names]
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(name) for name in names])
+    blob = b"".join(names)
+
+    if spare:
+        capacity = max(MIN_CAPACITY, 2 * count)
+        user_capacity = max(MIN_CAPACITY, 2 * len(names))
+        blob_capacity = max(MIN_BLOB_CAPACITY, 2 * len(blob))
+    else:
+        capacity, user_capacity, blob_capacity = count, len(names), len(blob)
+
+    gallery_file = GalleryFile.create(
+        path, encodings.shape[1], capacity, user_capacity, blob_capacity
+    )
+    gallery_file.encodings[:count] = encodings
+    gallery_file.sq_norms[:count] = np.einsum("ij,ij->i", encodings, encodings)
+    gallery_file.row_ids[:count] = row_ids
+    gallery_file.user_index[:count] = user_index
+    if site_ids is not None:
+        gallery_file.site_index[:count] = site_index
+    gallery_file.user_offsets[:len(offsets)] = offsets
+    gallery_file.user_blob[:len(blob)] = np.frombuffer(blob, dtype=np.uint8)
+
+    header = gallery_file.header
+    header[H_USERS] = len(names)
+    header[H_LIVE_USERS] = user_count
+    header[H_HAS_SITES] = int(site_ids is not None)
+    header[H_BLOB_USED] = len(blob)
+    header[H_HIGH_WATER_ID], header[H_HIGH_WATER_UPDATED] = high_water
+    header[H_LIVE] = count
+    header[H_COUNT] = count
+    gallery_file.mm.flush()
+    return gallery_file
+
+
+def save_snapshot(
+    path: str,
+    row_ids: Iterable[int],
+    user_ids: List[str],
+    encodings: np.ndarray,
+    high_water: Tuple[int, int],
+    site_ids: Optional[List[Optional[str]]] = None
+):
+    """
+    Écrire l'instantané de démarrage (remplacement atomique du fichier)
+
+    Plusieurs workers peuvent écrire le même instantané: chacun passe par son
+    propre fichier temporaire, le dernier renommage l'emporte.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    write_gallery_file(
+        tmp_path,
+        np.asarray(row_ids, dtype=np.int64),
+        list(user_ids),
+        np.asarray(encodings, dtype=np.float32),
+        spare=False,
+        high_water=high_water,
+        site_ids=site_ids
+    )
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: str, dim: int) -> Optional[GalleryFile]:
+    """
+    Mapper l'instantané de démarrage
+
+    Returns:
+        Fichier mappé en lecture seule, None s'il est absent ou inutilisable
+    """
+    try:
+        gallery_file = GalleryFile.open(path)
+    except FileNotFoundError:
+        return None
+    except (ValueError, OSError) as e:
+        logger.warning(f"Instantané de galerie ignoré ({path}): {e}")
+        return None
+
+    if gallery_file.dim != dim:
+        logger.warning(f"Instantané de galerie ignoré ({path}): dimension {gallery_file.dim}")
+        return None
+    return gallery_file
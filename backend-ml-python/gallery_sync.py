@@ -0,0 +1,215 @@
+"""
+Synchronisation de la galerie entre workers pour TwoInOne ML Backend
+Écoute LISTEN/NOTIFY des modifications et réconciliation périodique
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Optional, Set
+
+import psycopg2
+import psycopg2.extensions
+
+from analysis_cache import invalidate_user_analyses
+from config import get_app_settings
+from database import (
+    GALLERY_CHANNEL,
+    WORKER_ID,
+    refresh_gallery_user,
+    get_gallery_version,
+    load_face_gallery,
+    save_gallery_snapshot
+)
+from gallery import get_face_gallery
+
+logger = logging.getLogger(__name__)
+
+
+class GallerySync:
+    """
+    Applique à la galerie locale les modifications faites par les autres workers
+
+    Une connexion dédiée (hors pool) écoute GALLERY_CHANNEL; chaque notification
+    recharge les encodages de l'utilisateur concerné. Une réconciliation
+    périodique compare la signature de la galerie à celle de la table et
+    recharge tout en cas d'écart (notification perdue, coupure de connexion).
+    L'instantané de démarrage est réécrit au plus toutes les snapshot_interval
+    secondes, si la galerie a changé.
+    """
+
+    def __init__(self, dsn: str, reconcile_interval: float, snapshot_interval: float):
+        self.dsn = dsn
+        self.reconcile_interval = reconcile_interval
+        self.snapshot_interval = snapshot_interval
+        self._snapshot_at = time.monotonic()
+        self._conn: Optional[psycopg2.extensions.connection] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self._pending_users: Set[str] = set()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Ouvrir la connexion d'écoute et lancer la réconciliation périodique"""
+        self._loop = asyncio.get_running_loop()
+        if not get_face_gallery().is_writer:
+            # Galerie partagée: l'écrivain applique les notifications pour tous les workers
+            self._reconcile_task = asyncio.create_task(self._standby_loop())
+            logger.info("Galerie partagée en lecture: synchronisation assurée par l'écrivain")
+            return
+
+        await self._connect()
+        self._reconcile_task = asyncio.create_task(self._reconcile_loop())
+        logger.info(f"✅ Synchronisation de la galerie active (canal {GALLERY_CHANNEL})")
+
+    async def stop(self):
+        """Arrêter l'écoute et la réconciliation"""
+        if self._reconcile_task is not None:
+            self._reconcile_task.cancel()
+            self._reconcile_task = None
+        self._disconnect()
+
+    async def reconcile(self) -> bool:
+        """
+        Comparer la galerie à la table et la recharger si elles diffèrent
+
+        Returns:
+            True si un rechargement complet a été effectué
+        """
+        expected = await get_gallery_version()
+        current = get_face_gallery().version()
+        if current == expected:
+            return False
+
+        logger.warning(
+            f"Galerie désynchronisée (locale {current}, base {expected}): rechargement"
+        )
+        await load_face_gallery()
+        return True
+
+    async def _connect(self):
+        def _open() -> psycopg2.extensions.connection:
+            conn = psycopg2.connect(self.dsn)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute(f"LISTEN {GALLERY_CHANNEL}")
+            return conn
+
+        self._conn = await self._loop.run_in_executor(None, _open)
+        self._loop.add_reader(self._conn.fileno(), self._on_readable)
+
+    def _disconnect(self):
+        if self._conn is None:
+            return
+        try:
+            self._loop.remove_reader(self._conn.fileno())
+        except (ValueError, OSError):
+            pass
+        self._conn.close()
+        self._conn = None
+
+    def _on_readable(self):
+        """Lire les notifications disponibles (appelé par la boucle d'événements)"""
+        try:
+            self._conn.poll()
+        except psycopg2.Error as e:
+            logger.error(f"Connexion LISTEN perdue: {e}")
+            self._disconnect()
+            return
+
+        while self._conn.notifies:
+            notification = self._conn.notifies.pop(0)
+            try:
+                payload = json.loads(notification.payload)
+            except ValueError:
+                logger.warning(f"Notification illisible: {notification.payload!r}")
+                continue
+
+            # Ce worker a déjà appliqué ses propres écritures
+            if payload.get("origin") == WORKER_ID:
+                continue
+            if payload.get("op") == "delete":
+                invalidate_user_analyses(payload["user_id"])
+            self._pending_users.add(payload["user_id"])
+
+        if self._pending_users and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.create_task(self._refresh_pending())
+
+    async def _refresh_pending(self):
+        """Recharger les utilisateurs notifiés (les rafales sont regroupées)"""
+        while self._pending_users:
+            user_id = self._pending_users.pop()
+            try:
+                count = await refresh_gallery_user(user_id)
+                logger.info(f"Galerie mise à jour pour user_id: {user_id} ({count} encodage(s))")
+            except Exception as e:
+                logger.error(f"Erreur de mise à jour de la galerie pour {user_id}: {e}")
+
+    async def _standby_loop(self):
+        """Reprendre le rôle d'écrivain de la galerie partagée s'il se libère"""
+        gallery = get_face_gallery()
+        while not gallery.try_become_writer():
+            await asyncio.sleep(self.reconcile_interval)
+
+        logger.warning("Écrivain de la galerie partagée arrêté: reprise par ce worker")
+        try:
+            await load_face_gallery()
+            await self._connect()
+        except Exception as e:
+            # Nouvel essai à la prochaine réconciliation
+            logger.error(f"Erreur de reprise de la galerie partagée: {e}")
+        await self._reconcile_loop()
+
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                if self._conn is None:
+                    # Des notifications ont pu être perdues pendant la coupure
+                    await self._connect()
+                    logger.info("Connexion LISTEN rétablie")
+                await self.reconcile()
+                if time.monotonic() - self._snapshot_at >= self.snapshot_interval:
+                    self._snapshot_at = time.monotonic()
+                    await save_gallery_snapshot()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Erreur de réconciliation de la galerie: {e}")
+
+
+# Instance globale (une par worker)
+_gallery_sync: Optional[GallerySync] = None
+
+
+async def start_gallery_sync():
+    """Démarrer la synchronisation si FACE_GALLERY_SYNC_ENABLED"""
+    global _gallery_sync
+
+    settings = get_app_settings()
+    if not settings.FACE_GALLERY_SYNC_ENABLED or _gallery_sync is not None:
+        if settings.FACE_GALLERY_SHARED_DIR and not settings.FACE_GALLERY_SYNC_ENABLED:
+            logger.warning(
+                "Galerie partagée sans synchronisation: les écritures des workers lecteurs "
+                "n'y apparaîtront qu'au prochain rechargement"
+            )
+        return
+
+    gallery_sync = GallerySync(
+        dsn=settings.DATABASE_URL,
+        reconcile_interval=settings.FACE_GALLERY_RECONCILE_SECONDS,
+        snapshot_interval=settings.FACE_GALLERY_SNAPSHOT_SECONDS
+    )
+    await gallery_sync.start()
+    # Retenue seulement une fois démarrée: un échec peut être retenté
+    _gallery_sync = gallery_sync
+
+
+async def stop_gallery_sync():
+    """Arrêter la synchronisation"""
+    global _gallery_sync
+
+    if _gallery_sync is not None:
+        await _gallery_sync.stop()
+        _gallery_sync = None
+        logger.info("Synchronisation de la galerie arrêtée")
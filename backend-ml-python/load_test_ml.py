@@ -0,0 +1,507 @@
+"""
+Test de charge asynchrone pour le Backend ML Python de TwoInOne
+Rejoue un mélange de requêtes (enroll, verify, health, users-enrolled)
+à débit ou concurrence cible, contre main.py ou main_simple.py
+
+Exemples:
+
+    # Pic de début de poste: débit croissant jusqu'à saturation
+    python load_test_ml.py --rate 5,10,20,40,80 --stage-duration 30 \\
+        --mix verify=8,enroll=1,health=1 --jwt-secret "$JWT_SECRET_KEY"
+
+    # Mode simulation, 50 clients en parallèle
+    python load_test_ml.py --target simple --concurrency 50 --duration 60
+
+    # Photos réelles (un sous-dossier par utilisateur ou photos en vrac)
+    python load_test_ml.py --images ./photos --rate 20 --output charge.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+# Configuration
+API_URL = os.getenv("ML_API_URL", "http://localhost:8000")
+
+ENDPOINTS = ("enroll", "verify", "health", "users")
+
+DEFAULT_MIX = "verify=8,enroll=1,health=1,users=0.5"
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Seuils de saturation d'une étape
+SATURATION_THROUGHPUT_RATIO = 0.9
+SATURATION_ERROR_RATE = 0.05
+SATURATION_P95_FACTOR = 3.0
+
+# Couleurs pour le terminal
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    END = '\033[0m'
+
+def print_success(message):
+    print(f"{Colors.GREEN}✓ {message}{Colors.END}")
+
+def print_error(message):
+    print(f"{Colors.RED}✗ {message}{Colors.END}")
+
+def print_info(message):
+    print(f"{Colors.BLUE}ℹ {message}{Colors.END}")
+
+def print_warning(message):
+    print(f"{Colors.YELLOW}⚠ {message}{Colors.END}")
+
+
+@dataclass
+class EndpointStats:
+    """Mesures d'un endpoint pendant une étape"""
+    latencies_ms: List[float] = field(default_factory=list)
+    statuses: Dict[str, int] = field(default_factory=dict)
+    errors: int = 0
+
+    def record(self, status: str, latency_ms: float, ok: bool):
+        self.latencies_ms.append(latency_ms)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if not ok:
+            self.errors += 1
+
+    def summary(self, elapsed: float) -> Dict:
+        count = len(self.latencies_ms)
+        latencies = np.asarray(self.latencies_ms) if count else np.zeros(1)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        return {
+            "requests": count,
+            "throughput_rps": count / elapsed if elapsed > 0 else 0.0,
+            "error_rate": self.errors / count if count else 0.0,
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "max_ms": float(latencies.max()),
+            "statuses": dict(sorted(self.statuses.items())),
+        }
+
+
+@dataclass
+class StageResult:
+    """Résultat d'une étape (un débit ou une concurrence cible)"""
+    mode: str
+    target: float
+    elapsed: float
+    endpoints: Dict[str, EndpointStats]
+    dropped: int = 0
+
+    def summary(self) -> Dict:
+        total = EndpointStats()
+        for stats in self.endpoints.values():
+            total.latencies_ms.extend(stats.latencies_ms)
+            total.errors += stats.errors
+            for status, count in stats.statuses.items():
+                total.statuses[status] = total.statuses.get(status, 0) + count
+
+        return {
+            "mode": self.mode,
+            "target": self.target,
+            "duration_s": self.elapsed,
+            "dropped": self.dropped,
+            "total": total.summary(self.elapsed),
+            "endpoints": {
+                name: stats.summary(self.elapsed)
+                for name, stats in sorted(self.endpoints.items())
+            },
+        }
+
+
+class ImageSource:
+    """
+    Images envoyées aux endpoints enroll et verify
+
+    Avec --images, chaque sous-dossier est un utilisateur (les photos à la racine
+    sont attribuées à des utilisateurs fictifs). Sans --images, des JPEG
+    synthétiques sont générés: ils ne contiennent pas de visage mais exercent
+    le décodage et la détection comme une vraie photo de même taille.
+    """
+
+    def __init__(self, directory: Optional[str], width: int, height: int, count: int, seed: int):
+        self.by_user: Dict[str, List[bytes]] = {}
+        if directory:
+            self._load_directory(directory)
+        if not self.by_user:
+            self._generate(width, height, count, seed)
+        self.users = sorted(self.by_user)
+        self.all_images = [image for images in self.by_user.values() for image in images]
+
+    def _load_directory(self, directory: str):
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                user = os.path.relpath(root, directory)
+                user = f"loadtest-{len(self.by_user)}" if user == "." else user.replace(os.sep, "-")
+                with open(os.path.join(root, name), "rb") as image_file:
+                    self.by_user.setdefault(user, []).append(image_file.read())
+
+    def _generate(self, width: int, height: int, count: int, seed: int):
+        from PIL import Image
+
+        rng = np.random.default_rng(seed)
+        for index in range(count):
+            pixels = rng.integers(0, 256, size=(height // 8, width // 8, 3), dtype=np.uint8)
+            image = Image.fromarray(pixels).resize((width, height), Image.BILINEAR)
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=90)
+            self.by_user[f"loadtest-{index}"] = [buffer.getvalue()]
+
+    def pick(self, rng: random.Random) -> Tuple[str, bytes]:
+        user = rng.choice(self.users)
+        return user, rng.choice(self.by_user[user])
+
+
+class Credentials:
+    """En-têtes d'authentification selon la cible"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.target = args.target
+        self.token = args.token
+        self.jwt_secret = args.jwt_secret
+        self.jwt_algorithm = args.jwt_algorithm
+        self._tokens: Dict[str, str] = {}
+
+    def _token_for(self, user_id: str) -> Optional[str]:
+        if self.token:
+            return self.token
+        if not self.jwt_secret:
+            return None
+        if user_id not in self._tokens:
+            from jose import jwt
+
+            expire = datetime.now(timezone.utc) + timedelta(hours=12)
+            self._tokens[user_id] = jwt.encode(
+                {"sub": user_id, "exp": expire},
+                self.jwt_secret,
+                algorithm=self.jwt_algorithm
+            )
+        return self._tokens[user_id]
+
+    def headers(self, user_id: str, authenticated: bool = True) -> Dict[str, str]:
+        # main_simple.py: en-têtes user_id (lu comme "user-id" par FastAPI)
+        # et authorization obligatoires, non vérifiés
+        if self.target == "simple":
+            return {"user-id": user_id, "authorization": "Bearer load-test"}
+
+        token = self._token_for(user_id) if authenticated else None
+        return {"authorization": f"Bearer {token}"} if token else {}
+
+
+async def send_request(
+    client: httpx.AsyncClient,
+    endpoint: str,
+    images: ImageSource,
+    credentials: Credentials,
+    rng: random.Random,
+    identify: bool
+) -> Tuple[str, bool]:
+    """
+    Envoyer une requête
+
+    Returns:
+        Tuple (code HTTP ou type d'erreur, succès)
+    """
+    try:
+        if endpoint == "enroll":
+            user_id, image = images.pick(rng)
+            response = await client.post(
+                "/ml/enroll-face",
+                files={"file": ("face.jpg", image, "image/jpeg")},
+                headers=credentials.headers(user_id)
+            )
+        elif endpoint == "verify":
+            user_id, image = images.pick(rng)
+            # Identification 1:N (sans jeton) ou vérification 1:1 (jeton de l'utilisateur)
+            response = await client.post(
+                "/ml/verify-face",
+                files={"file": ("face.jpg", image, "image/jpeg")},
+                headers=credentials.headers(user_id, authenticated=not identify)
+            )
+        elif endpoint == "health":
+            response = await client.get("/ml/health")
+        else:
+            user_id = rng.choice(images.users)
+            response = await client.get("/ml/users-enrolled", headers=credentials.headers(user_id))
+    except httpx.TimeoutException:
+        return "timeout", False
+    except httpx.HTTPError as e:
+        return type(e).__name__, False
+
+    # Un 400 métier (aucun visage détecté, etc.) reste une réponse normale du service
+    ok = response.status_code < 500 and response.status_code not in (401, 403, 422, 429)
+    return str(response.status_code), ok
+
+
+class LoadGenerator:
+    """Génère le trafic d'une étape, en boucle ouverte (débit) ou fermée (concurrence)"""
+
+    def __init__(self, args: argparse.Namespace, images: ImageSource, credentials: Credentials):
+        self.args = args
+        self.images = images
+        self.credentials = credentials
+        self.rng = random.Random(args.seed)
+        self.endpoints, self.weights = zip(*args.mix.items())
+
+    def _pick_endpoint(self) -> str:
+        return self.rng.choices(self.endpoints, weights=self.weights)[0]
+
+    async def _one(self, client, stats: Dict[str, EndpointStats], endpoint: str, scheduled: float):
+        status, ok = await send_request(
+            client, endpoint, self.images, self.credentials, self.rng, self.args.identify
+        )
+        # Latence depuis l'instant d'envoi prévu: un serveur saturé qui retarde
+        # les envois du client n'est pas masqué (omission coordonnée)
+        latency_ms = (time.perf_counter() - scheduled) * 1000.0
+        stats.setdefault(endpoint, EndpointStats()).record(status, latency_ms, ok)
+
+    async def run_rate(self, client: httpx.AsyncClient, rate: float, duration: float) -> StageResult:
+        """Boucle ouverte: arrivées de Poisson au débit cible"""
+        stats: Dict[str, EndpointStats] = {}
+        in_flight = set()
+        dropped = 0
+
+        start = time.perf_counter()
+        scheduled = start
+        while True:
+            scheduled += self.rng.expovariate(rate)
+            if scheduled - start >= duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if len(in_flight) >= self.args.max_in_flight:
+                dropped += 1
+                continue
+
+            task = asyncio.create_task(self._one(client, stats, self._pick_endpoint(), scheduled))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        if in_flight:
+            await asyncio.wait(in_flight)
+        return StageResult("rate", rate, time.perf_counter() - start, stats, dropped)
+
+    async def run_concurrency(
+        self,
+        client: httpx.AsyncClient,
+        concurrency: int,
+        duration: float
+    ) -> StageResult:
+        """Boucle fermée: chaque client virtuel renvoie une requête dès la réponse reçue"""
+        stats: Dict[str, EndpointStats] = {}
+        start = time.perf_counter()
+        deadline = start + duration
+
+        async def virtual_user():
+            while time.perf_counter() < deadline:
+                await self._one(client, stats, self._pick_endpoint(), time.perf_counter())
+
+        await asyncio.gather(*(virtual_user() for _ in range(concurrency)))
+        return StageResult("concurrency", concurrency, time.perf_counter() - start, stats)
+
+
+def find_saturation(stages: List[Dict]) -> Dict[str, Optional[float]]:
+    """
+    Première cible à laquelle chaque endpoint (et le total) sature
+
+    Une étape sature si son débit obtenu reste sous 90% de la cible (mode
+    débit), si le taux d'erreur dépasse 5%, ou si le p95 triple par rapport
+    à la première étape.
+    """
+    names = ["total"] + sorted({name for stage in stages for name in stage["endpoints"]})
+    saturation: Dict[str, Optional[float]] = {}
+
+    for name in names:
+        baseline_p95 = None
+        saturation[name] = None
+        for stage in stages:
+            summary = stage["total"] if name == "total" else stage["endpoints"].get(name)
+            if not summary or not summary["requests"]:
+                continue
+            if baseline_p95 is None:
+                baseline_p95 = summary["p95_ms"]
+
+            saturated = (
+                summary["error_rate"] > SATURATION_ERROR_RATE
+                or summary["p95_ms"] > SATURATION_P95_FACTOR * baseline_p95
+            )
+            if name == "total" and stage["mode"] == "rate":
+                saturated = saturated or (
+                    summary["throughput_rps"] < SATURATION_THROUGHPUT_RATIO * stage["target"]
+                    or stage["dropped"] > 0
+                )
+            if saturated:
+                saturation[name] = stage["target"]
+                break
+
+    return saturation
+
+
+def print_stage(stage: Dict):
+    total = stage["total"]
+    unit = "req/s" if stage["mode"] == "rate" else "clients"
+    print_info(
+        f"Étape {stage['target']:g} {unit}: {total['throughput_rps']:.1f} req/s, "
+        f"p50 {total['p50_ms']:.0f} ms, p95 {total['p95_ms']:.0f} ms, "
+        f"p99 {total['p99_ms']:.0f} ms, erreurs {total['error_rate']:.1%}"
+        + (f", {stage['dropped']} non envoyées" if stage["dropped"] else "")
+    )
+    print(f"  {'endpoint':<10} {'req':>6} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>7}  statuts")
+    for name, summary in stage["endpoints"].items():
+        print(
+            f"  {name:<10} {summary['requests']:>6} {summary['throughput_rps']:>8.1f} "
+            f"{summary['p50_ms']:>8.0f} {summary['p95_ms']:>8.0f} {summary['p99_ms']:>8.0f} "
+            f"{summary['error_rate']:>7.1%}  {summary['statuses']}"
+        )
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Endpoint inconnu: {name} (choix: {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("Le mélange doit contenir au moins un poids positif")
+    return mix
+
+
+def parse_levels(value: str) -> List[float]:
+    return [float(level) for level in value.split(",")]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Test de charge du backend ML")
+    parser.add_argument("--url", default=API_URL, help="URL du service (défaut: $ML_API_URL)")
+    parser.add_argument(
+        "--target", choices=("main", "simple"), default="main",
+        help="main.py (JWT) ou main_simple.py (en-têtes user_id/authorization)"
+    )
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--rate", type=parse_levels, help="Débit(s) cible(s) en req/s, ex: 5,10,20")
+    load.add_argument("--concurrency", type=parse_levels, help="Nombre(s) de clients, ex: 10,50")
+    parser.add_argument("--duration", "--stage-duration", type=float, default=30.0,
+                        help="Durée de chaque étape (s)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Poids par endpoint (défaut: {DEFAULT_MIX})")
+    parser.add_argument("--identify", action="store_true",
+                        help="Vérifier sans jeton (identification 1:N) au lieu de 1:1")
+    parser.add_argument("--images", help="Dossier de photos (sous-dossier = utilisateur)")
+    parser.add_argument("--image-size", default="1280x960",
+                        help="Taille des images synthétiques (LxH)")
+    parser.add_argument("--synthetic-users", type=int, default=50)
+    parser.add_argument("--token", help="Jeton JWT fixe pour toutes les requêtes")
+    parser.add_argument("--jwt-secret", default=os.getenv("JWT_SECRET_KEY"),
+                        help="Secret pour générer un jeton par utilisateur (défaut: $JWT_SECRET_KEY)")
+    parser.add_argument("--jwt-algorithm", default="HS256")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Timeout par requête (s)")
+    parser.add_argument("--max-in-flight", type=int, default=1000,
+                        help="Requêtes simultanées max du client en mode débit")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Échauffement non mesuré (s)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", "-o", help="Fichier JSON des résultats")
+    args = parser.parse_args(argv)
+
+    if not args.rate and not args.concurrency:
+        args.concurrency = [10.0]
+    width, _, height = args.image_size.partition("x")
+    args.image_width, args.image_height = int(width), int(height)
+    return args
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    images = ImageSource(
+        args.images, args.image_width, args.image_height, args.synthetic_users, args.seed
+    )
+    credentials = Credentials(args)
+    generator = LoadGenerator(args, images, credentials)
+
+    if args.target == "main" and not (args.token or args.jwt_secret):
+        print_warning("Ni --token ni --jwt-secret: enroll et users-enrolled seront refusés (401/403)")
+
+    print_info(
+        f"Cible {args.url} ({args.target}), {len(images.all_images)} image(s), "
+        f"{len(images.users)} utilisateur(s), mélange {args.mix}"
+    )
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        try:
+            response = await client.get("/ml/health")
+            print_success(f"Service joignable: {response.status_code}")
+        except httpx.HTTPError as e:
+            print_error(f"Service injoignable: {e}")
+            raise SystemExit(1)
+
+        if args.warmup > 0:
+            first = args.rate[0] if args.rate else args.concurrency[0]
+            print_info(f"Échauffement {args.warmup:g}s...")
+            if args.rate:
+                await generator.run_rate(client, first, args.warmup)
+            else:
+                await generator.run_concurrency(client, int(first), args.warmup)
+
+        stages = []
+        for level in (args.rate or args.concurrency):
+            if args.rate:
+                result = await generator.run_rate(client, level, args.duration)
+            else:
+                result = await generator.run_concurrency(client, int(level), args.duration)
+            stage = result.summary()
+            stages.append(stage)
+            print_stage(stage)
+
+    saturation = find_saturation(stages)
+    for name, level in saturation.items():
+        if level is None:
+            print_success(f"{name}: pas de saturation jusqu'à {stages[-1]['target']:g}")
+        else:
+            print_warning(f"{name}: saturation à {level:g}")
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "url": args.url,
+        "target": args.target,
+        "mix": args.mix,
+        "identify": args.identify,
+        "images": args.images or f"synthetic {args.image_size}",
+        "stages": stages,
+        "saturation": saturation,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2, ensure_ascii=False)
+        print_info(f"Résultats écrits dans {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,41 +4,73 @@ Microservice pour la reconnaissance faciale et l'IA
 FastAPI + TensorFlow + OpenCV
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Depends
+import asyncio
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response, JSONResponse
 from pydantic import BaseModel
-import face_recognition
 import numpy as np
-import cv2
-import io
-from PIL import Image
 import os
 from typing import Optional, List
 import json
-import psycopg2
-from psycopg2.extras import RealDictCursor
 import base64
 import logging
 
 # Imports des modules personnalisés
 from config import get_app_settings, validate_environment
-from auth import get_current_user, get_current_user_optional, TokenData
+from auth import get_current_user, get_current_user_optional, require_role, TokenData
 from database import (
-    init_db_pool,
     close_db_pool,
-    create_tables,
     save_face_encoding,
     get_face_encodings,
-    get_all_face_encodings,
     delete_face_encodings,
     get_enrolled_users,
-    get_user_encoding_count
+    load_face_gallery,
+    set_user_site
+)
+from gallery import get_face_gallery
+from gallery_sync import stop_gallery_sync
+from site_gallery import best_matches_for_site, site_id_error
+from match_batcher import match_probe
+from bulk_import import spool_archive, run_bulk_import
+from metrics import (
+    CONTENT_TYPE_LATEST,
+    STAGE_DB_FETCH,
+    STAGE_MATCH,
+    stage_timer,
+    record_outcome,
+    observe_request,
+    render_metrics
+)
+from startup import (
+    start_background_startup,
+    stop_background_startup,
+    readiness_report,
+    is_ready,
+    record_timing
+)
+from analysis_cache import remember_user
+from face_pipeline import (
+    close_face_pipeline,
+    run_face_pipeline,
+    run_face_pipeline_batch,
+    FaceAnalysis,
+    PipelineBusyError,
+    ImageTooLargeError
 )
+from quality import QUALITY_MESSAGES
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# face_recognition/OpenCV ne sont pas importés ici (voir face_pipeline)
+record_timing("import", time.perf_counter() - _import_started)
+logger.info(f"Modules importés en {time.perf_counter() - _import_started:.2f}s")
+
 # Charger et valider la configuration
 try:
     settings = validate_environment()
@@ -74,14 +106,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def get_db_connection():
-    """Créer une connexion à PostgreSQL"""
-    try:
-        conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-        return conn
-    except Exception as e:
-        logger.error(f"Erreur de connexion DB: {e}")
-        raise HTTPException(status_code=500, detail="Erreur de connexion à la base de données")
+if settings.METRICS_ENABLED:
+    @app.middleware("http")
+    async def record_request_duration(request: Request, call_next):
+        """Mesurer la durée de chaque requête, par route (et non par URL)"""
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            endpoint = route.path if route is not None else "unmatched"
+            observe_request(request.method, endpoint, status, time.perf_counter() - start)
 
 # Modèles Pydantic
 class FaceEnrollmentRequest(BaseModel):
@@ -93,6 +131,8 @@ class FaceVerificationResponse(BaseModel):
     user_id: Optional[str] = None
     confidence: float
     message: str
+    # Code du refus de l'image (no_face, multiple_faces, blurry, too_dark...)
+    reason: Optional[str] = None
 
 class HealthResponse(BaseModel):
     status: str
@@ -102,23 +142,23 @@ class HealthResponse(BaseModel):
 # Événements de cycle de vie de l'application
 @app.on_event("startup")
 async def startup_event():
-    """Initialiser la base de données au démarrage"""
+    """
+    Lancer l'initialisation en arrière-plan (base, schéma, galerie, chauffe)
+    
+    Le serveur accepte les connexions immédiatement; /ml/ready indique quand
+    le trafic peut être routé vers ce worker.
+    """
     logger.info("🚀 Démarrage de l'application...")
-    try:
-        init_db_pool()
-        await create_tables()
-        logger.info("✅ Application prête")
-    except Exception as e:
-        logger.error(f"❌ Erreur au démarrage: {e}")
-        # Ne pas bloquer le démarrage en développement
-        if settings.ENVIRONMENT == "production":
-            raise
+    start_background_startup()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Fermer les connexions au shutdown"""
     logger.info("🛑 Arrêt de l'application...")
+    await stop_background_startup()
+    await stop_gallery_sync()
     close_db_pool()
+    close_face_pipeline()
     logger.info("✅ Connexions fermées")
 
 # Routes
@@ -132,6 +172,19 @@ async def root():
         "version": "1.0.0"
     }
 
+@app.get("/ml/ready")
+async def readiness_check():
+    """
+    Sonde de disponibilité: 200 quand la base, le schéma, la galerie et le
+    pipeline (modèles chargés) sont prêts, 503 sinon
+    
+    À utiliser pour le routage du trafic (/ reste la sonde de vie).
+    """
+    return JSONResponse(
+        status_code=200 if is_ready() else 503,
+        content=readiness_report()
+    )
+
 @app.get("/ml/health")
 async def health_check():
     """Vérifier l'état du service ML"""
@@ -148,67 +201,84 @@ async def health_check():
         "cors_origins": len(settings.get_allowed_origins_list())
     }
 
+@app.get("/ml/metrics")
+async def metrics_endpoint():
+    """Métriques au format Prometheus (latences, résultats, pool, galerie)"""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Métriques désactivées")
+    return Response(content=render_metrics(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+def checked_site_id(site_id: Optional[str]) -> Optional[str]:
+    """Valider le paramètre site_id (chaîne vide = aucun site)"""
+    site_id = site_id or None
+    error = site_id_error(site_id)
+    if error is not None:
+        raise HTTPException(status_code=400, detail=error)
+    return site_id
+
 @app.post("/ml/enroll-face")
 async def enroll_face(
     file: UploadFile = File(...),
+    site_id: Optional[str] = None,
     current_user: TokenData = Depends(get_current_user)
 ):
     """
     Enregistrer le visage d'un utilisateur pour la reconnaissance faciale
     
     - file: Image du visage (JPEG, PNG)
+    - site_id: Site de l'utilisateur (optionnel: sinon son site actuel est conservé)
     - current_user: Utilisateur authentifié (extrait du JWT)
     """
     user_id = current_user.user_id
+    site_id = checked_site_id(site_id)
     try:
         logger.info(f"Enregistrement facial pour user_id: {user_id}")
         
         # Lire l'image uploadée
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        
-        # Convertir en array numpy
-        image_array = np.array(image)
         
-        # Convertir RGB si nécessaire
-        if len(image_array.shape) == 2:  # Image en niveaux de gris
-            image_array = cv2.cvtColor(image_array, cv2.COLOR_GRAY2RGB)
-        elif image_array.shape[2] == 4:  # RGBA
-            image_array = cv2.cvtColor(image_array, cv2.COLOR_RGBA2RGB)
+        # Décoder, détecter et encoder hors de la boucle d'événements
+        analysis = await run_face_pipeline(contents, user_id)
         
-        # Détecter les visages dans l'image
-        face_locations = face_recognition.face_locations(image_array)
+        if analysis.quality_issue is not None:
+            record_outcome("enroll", analysis.quality_issue)
+            logger.warning(
+                f"Qualité insuffisante ({analysis.quality_issue}) pour user_id: {user_id}, "
+                f"scores: {analysis.quality}"
+            )
+            raise HTTPException(
+                status_code=400,
+                detail=QUALITY_MESSAGES[analysis.quality_issue]
+            )
         
-        if len(face_locations) == 0:
+        if analysis.face_count == 0:
+            record_outcome("enroll", "no_face")
             logger.warning(f"Aucun visage détecté pour user_id: {user_id}")
             raise HTTPException(
                 status_code=400,
                 detail="Aucun visage détecté dans l'image. Veuillez prendre une photo claire de votre visage."
             )
         
-        if len(face_locations) > 1:
+        if analysis.face_count > 1:
+            record_outcome("enroll", "multiple_faces")
             logger.warning(f"Plusieurs visages détectés pour user_id: {user_id}")
             raise HTTPException(
                 status_code=400,
                 detail="Plusieurs visages détectés. Assurez-vous d'être seul dans l'image."
             )
         
-        # Encoder le visage
-        face_encodings = face_recognition.face_encodings(image_array, face_locations)
-        
-        if len(face_encodings) == 0:
+        if analysis.encoding is None:
+            record_outcome("enroll", "no_encoding")
             raise HTTPException(
                 status_code=400,
                 detail="Impossible d'encoder le visage. Veuillez réessayer avec une meilleure photo."
             )
         
-        face_encoding = face_encodings[0]
-        
-        # Sauvegarder l'encodage dans PostgreSQL
-        await save_face_encoding(user_id, face_encoding.tolist())
+        face_encoding = analysis.encoding
         
-        # Obtenir le nombre total d'encodages pour cet utilisateur
-        face_count = await get_user_encoding_count(user_id)
+        # Sauvegarder l'encodage dans PostgreSQL (retourne le nombre total d'encodages)
+        face_count = await save_face_encoding(user_id, face_encoding.tolist(), site_id)
+        record_outcome("enroll", "enrolled")
         
         logger.info(f"Visage enregistré avec succès pour user_id: {user_id}")
         
@@ -220,114 +290,324 @@ async def enroll_face(
         
     except HTTPException:
         raise
+    except ImageTooLargeError as e:
+        logger.warning(f"Image refusée pour user_id {user_id}: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except PipelineBusyError as e:
+        logger.warning(f"Pipeline saturé: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Service surchargé. Veuillez réessayer dans quelques instants."
+        )
     except Exception as e:
         logger.error(f"Erreur lors de l'enregistrement facial: {e}")
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
+def analysis_rejection(analysis: FaceAnalysis) -> Optional[FaceVerificationResponse]:
+    """Réponse d'échec si l'image ne contient pas exactement un visage encodable"""
+    if analysis.quality_issue is not None:
+        record_outcome("verify", analysis.quality_issue)
+        logger.info(f"Qualité insuffisante ({analysis.quality_issue}), scores: {analysis.quality}")
+        return FaceVerificationResponse(
+            success=False,
+            confidence=0.0,
+            message=QUALITY_MESSAGES[analysis.quality_issue],
+            reason=analysis.quality_issue
+        )
+    
+    if analysis.face_count == 0:
+        record_outcome("verify", "no_face")
+        return FaceVerificationResponse(
+            success=False,
+            confidence=0.0,
+            message="Aucun visage détecté. Veuillez réessayer.",
+            reason="no_face"
+        )
+    
+    if analysis.face_count > 1:
+        record_outcome("verify", "multiple_faces")
+        return FaceVerificationResponse(
+            success=False,
+            confidence=0.0,
+            message="Plusieurs visages détectés. Assurez-vous d'être seul.",
+            reason="multiple_faces"
+        )
+    
+    if analysis.encoding is None:
+        record_outcome("verify", "no_encoding")
+        return FaceVerificationResponse(
+            success=False,
+            confidence=0.0,
+            message="Impossible d'encoder le visage. Veuillez réessayer.",
+            reason="no_encoding"
+        )
+    
+    return None
+
+def match_response(best_match_user_id: Optional[str], best_match_distance: float) -> FaceVerificationResponse:
+    """Appliquer le seuil de reconnaissance au meilleur candidat de la galerie"""
+    # Seuil de confiance depuis la configuration
+    CONFIDENCE_THRESHOLD = settings.FACE_RECOGNITION_THRESHOLD
+    
+    if best_match_distance < CONFIDENCE_THRESHOLD and best_match_user_id:
+        confidence = 1.0 - best_match_distance  # Convertir en score de confiance
+        record_outcome("verify", "match")
+        logger.info(f"Visage reconnu: {best_match_user_id}, confiance: {confidence:.2f}")
+        
+        return FaceVerificationResponse(
+            success=True,
+            user_id=best_match_user_id,
+            confidence=round(confidence, 2),
+            message=f"Identité vérifiée avec {round(confidence * 100)}% de confiance"
+        )
+    else:
+        record_outcome("verify", "no_match")
+        logger.warning(f"Visage non reconnu. Meilleure distance: {best_match_distance}")
+        return FaceVerificationResponse(
+            success=False,
+            confidence=0.0,
+            message="Visage non reconnu. Veuillez vous enregistrer d'abord."
+        )
+
+async def get_loaded_gallery():
+    """Obtenir la galerie en mémoire, en la chargeant si le démarrage n'a pas pu le faire"""
+    gallery = get_face_gallery()
+    if not gallery.is_loaded:
+        await load_face_gallery()
+    return gallery
+
 @app.post("/ml/verify-face", response_model=FaceVerificationResponse)
 async def verify_face(
     file: UploadFile = File(...),
+    search_all: bool = False,
+    site_id: Optional[str] = None,
     current_user: Optional[TokenData] = Depends(get_current_user_optional)
 ):
     """
     Vérifier l'identité d'un utilisateur via reconnaissance faciale
     
     - file: Image du visage à vérifier
+    - search_all: Forcer la recherche 1:N même si l'appelant est authentifié
+    - site_id: Site de la borne: la recherche 1:N commence par les utilisateurs
+      de ce site (FACE_SITE_PARTITIONS); refusé en vérification 1:1
     - current_user: Utilisateur authentifié (optionnel)
     
+    Si l'appelant est authentifié, le visage est comparé uniquement aux
+    encodages de cet utilisateur (vérification 1:1). Sans identité, il est
+    recherché parmi tous les visages enregistrés (identification 1:N).
+    
     Retourne l'user_id si reconnu avec un niveau de confiance
     """
+    site_id = checked_site_id(site_id)
+    if site_id is not None and current_user is not None and not search_all:
+        # La vérification 1:1 ne consulte pas la galerie: le site serait ignoré
+        raise HTTPException(
+            status_code=400,
+            detail="site_id ne s'applique qu'à l'identification 1:N (appel anonyme ou search_all=true)"
+        )
     try:
         logger.info("Demande de vérification faciale")
         
         # Lire l'image uploadée
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
         
-        # Convertir en array numpy
-        image_array = np.array(image)
+        # Décoder, détecter et encoder hors de la boucle d'événements
+        claimed_user_id = current_user.user_id if current_user is not None else None
+        analysis = await run_face_pipeline(contents, claimed_user_id)
         
-        # Convertir RGB si nécessaire
-        if len(image_array.shape) == 2:
-            image_array = cv2.cvtColor(image_array, cv2.COLOR_GRAY2RGB)
-        elif image_array.shape[2] == 4:
-            image_array = cv2.cvtColor(image_array, cv2.COLOR_RGBA2RGB)
+        rejection = analysis_rejection(analysis)
+        if rejection is not None:
+            return rejection
         
-        # Détecter les visages
-        face_locations = face_recognition.face_locations(image_array)
-        
-        if len(face_locations) == 0:
-            return FaceVerificationResponse(
-                success=False,
-                confidence=0.0,
-                message="Aucun visage détecté. Veuillez réessayer."
+        if current_user is not None and not search_all:
+            # Vérification 1:1: seulement les encodages de l'identité revendiquée,
+            # lus dans la galerie en mémoire. La table n'est interrogée que si la
+            # galerie ne les contient pas (non chargée, ou limitée à d'autres
+            # sites par FACE_GALLERY_SITES); une erreur de lecture donne une 500.
+            gallery = get_face_gallery()
+            claimed_encodings = (
+                list(gallery.user_encodings(current_user.user_id)) if gallery.is_loaded else []
             )
+            if not claimed_encodings:
+                with stage_timer(STAGE_DB_FETCH):
+                    claimed_encodings = await get_face_encodings(current_user.user_id)
+            if not claimed_encodings:
+                record_outcome("verify", "not_enrolled")
+                logger.warning(f"Aucun encodage pour user_id: {current_user.user_id}")
+                return FaceVerificationResponse(
+                    success=False,
+                    confidence=0.0,
+                    message="Aucun visage enregistré pour cet utilisateur. Veuillez vous enregistrer d'abord."
+                )
+            
+            with stage_timer(STAGE_MATCH):
+                distances = np.linalg.norm(
+                    np.stack(claimed_encodings) - analysis.encoding, axis=1
+                )
+            return match_response(current_user.user_id, float(distances.min()))
         
-        if len(face_locations) > 1:
-            return FaceVerificationResponse(
-                success=False,
-                confidence=0.0,
-                message="Plusieurs visages détectés. Assurez-vous d'être seul."
+        # Comparer avec tous les visages de la galerie en mémoire, en un seul
+        # calcul avec les vérifications simultanées (FACE_MATCH_BATCH_WINDOW_MS)
+        gallery = await get_loaded_gallery()
+        with stage_timer(STAGE_MATCH):
+            best_match_user_id, best_match_distance = await match_probe(
+                gallery, analysis.encoding, site_id
             )
         
-        # Encoder le visage à vérifier
-        unknown_encodings = face_recognition.face_encodings(image_array, face_locations)
-        
-        if len(unknown_encodings) == 0:
-            return FaceVerificationResponse(
-                success=False,
-                confidence=0.0,
-                message="Impossible d'encoder le visage. Veuillez réessayer."
-            )
+        response = match_response(best_match_user_id, best_match_distance)
+        if response.success:
+            # L'analyse en cache sera oubliée si cet utilisateur supprime son visage
+            remember_user(contents, response.user_id)
+        return response
         
-        unknown_encoding = unknown_encodings[0]
+    except ImageTooLargeError as e:
+        logger.warning(f"Image refusée: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except PipelineBusyError as e:
+        logger.warning(f"Pipeline saturé: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Service surchargé. Veuillez réessayer dans quelques instants."
+        )
+    except Exception as e:
+        logger.error(f"Erreur lors de la vérification faciale: {e}")
+        raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
+
+@app.post("/ml/verify-face/batch", response_model=List[FaceVerificationResponse])
+async def verify_face_batch(
+    files: List[UploadFile] = File(...),
+    site_id: Optional[str] = None,
+    current_user: Optional[TokenData] = Depends(get_current_user_optional)
+):
+    """
+    Vérifier plusieurs visages en une requête (bornes et passerelles de site)
+    
+    - files: Images des visages à vérifier (une partie multipart par image)
+    - site_id: Site de la passerelle (voir /ml/verify-face)
+    - current_user: Utilisateur authentifié (optionnel)
+    
+    Les images sont encodées en parallèle puis comparées à la galerie en un seul
+    calcul matrice-matrice. Retourne une réponse par image, dans l'ordre d'envoi.
+    """
+    if len(files) > settings.FACE_BATCH_MAX_IMAGES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Trop d'images: maximum {settings.FACE_BATCH_MAX_IMAGES} par requête"
+        )
+    site_id = checked_site_id(site_id)
+    
+    try:
+        logger.info(f"Demande de vérification faciale par lot: {len(files)} image(s)")
         
-        # Récupérer tous les encodages depuis PostgreSQL
-        all_encodings = await get_all_face_encodings()
+        contents_list = [await file.read() for file in files]
         
-        # Comparer avec tous les visages enregistrés
-        best_match_user_id = None
-        best_match_distance = 1.0  # Distance maximale (pire match)
+        # Décoder, détecter et encoder toutes les images en parallèle dans le pool
+        analyses = await run_face_pipeline_batch(contents_list)
         
-        for user_id, stored_encodings in all_encodings.items():
-            for stored_encoding in stored_encodings:
-                # Calculer la distance faciale
-                face_distances = face_recognition.face_distance(
-                    [np.array(stored_encoding)],
-                    unknown_encoding
+        responses: List[Optional[FaceVerificationResponse]] = [None] * len(analyses)
+        probe_indices = []
+        for index, analysis in enumerate(analyses):
+            if isinstance(analysis, ImageTooLargeError):
+                logger.warning(f"Image {index} du lot refusée: {analysis}")
+                record_outcome("verify", "too_large")
+                responses[index] = FaceVerificationResponse(
+                    success=False,
+                    confidence=0.0,
+                    message="Image trop grande. Veuillez envoyer une photo plus petite.",
+                    reason="too_large"
                 )
-                distance = face_distances[0]
-                
-                # Garder le meilleur match
-                if distance < best_match_distance:
-                    best_match_distance = distance
-                    best_match_user_id = user_id
-        
-        # Seuil de confiance depuis la configuration
-        CONFIDENCE_THRESHOLD = settings.FACE_RECOGNITION_THRESHOLD
+                continue
+            
+            if isinstance(analysis, Exception):
+                logger.warning(f"Image {index} du lot illisible: {analysis}")
+                record_outcome("verify", "unreadable")
+                responses[index] = FaceVerificationResponse(
+                    success=False,
+                    confidence=0.0,
+                    message="Image illisible. Veuillez réessayer.",
+                    reason="unreadable"
+                )
+                continue
+            
+            responses[index] = analysis_rejection(analysis)
+            if responses[index] is None:
+                probe_indices.append(index)
         
-        if best_match_distance < CONFIDENCE_THRESHOLD and best_match_user_id:
-            confidence = 1.0 - best_match_distance  # Convertir en score de confiance
-            logger.info(f"Visage reconnu: {best_match_user_id}, confiance: {confidence:.2f}")
+        if probe_indices:
+            gallery = await get_loaded_gallery()
+            probes = np.stack([analyses[index].encoding for index in probe_indices])
             
-            return FaceVerificationResponse(
-                success=True,
-                user_id=best_match_user_id,
-                confidence=round(confidence, 2),
-                message=f"Identité vérifiée avec {round(confidence * 100)}% de confiance"
-            )
-        else:
-            logger.warning(f"Visage non reconnu. Meilleure distance: {best_match_distance}")
-            return FaceVerificationResponse(
-                success=False,
-                confidence=0.0,
-                message="Visage non reconnu. Veuillez vous enregistrer d'abord."
-            )
+            # Un seul calcul de distances pour tous les visages du lot, dans un
+            # thread comme les lots de MatchBatcher (la boucle reste disponible)
+            with stage_timer(STAGE_MATCH):
+                loop = asyncio.get_running_loop()
+                matches = await loop.run_in_executor(
+                    None, best_matches_for_site, gallery, probes, site_id
+                )
+            for index, (user_id, distance) in zip(probe_indices, matches):
+                responses[index] = match_response(user_id, distance)
+                if responses[index].success:
+                    remember_user(contents_list[index], user_id)
         
+        return responses
+        
+    except PipelineBusyError as e:
+        logger.warning(f"Pipeline saturé: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Service surchargé. Veuillez réessayer dans quelques instants."
+        )
     except Exception as e:
-        logger.error(f"Erreur lors de la vérification faciale: {e}")
+        logger.error(f"Erreur lors de la vérification faciale par lot: {e}")
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
+@app.post("/ml/admin/bulk-enroll")
+async def bulk_enroll(
+    file: UploadFile = File(...),
+    site_id: Optional[str] = None,
+    current_user: TokenData = Depends(require_role("admin"))
+):
+    """
+    Importer en masse les visages d'un site (administrateurs uniquement)
+    
+    - file: Archive ZIP contenant soit manifest.csv (colonnes user_id,image et
+      site_id optionnelle), soit des images rangées par dossier <user_id>/<photo>.jpg
+    - site_id: Site des utilisateurs importés (sauf colonne site_id du manifeste)
+    
+    Retourne un flux NDJSON: événements start, error (par image rejetée),
+    progress (après chaque lot) et done.
+    """
+    logger.info(f"Import en masse demandé par {current_user.user_id}")
+    site_id = checked_site_id(site_id)
+    
+    try:
+        archive_file = await spool_archive(file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return StreamingResponse(
+        run_bulk_import(archive_file, site_id),
+        media_type="application/x-ndjson"
+    )
+
+@app.put("/ml/admin/face-site/{user_id}")
+async def set_face_site(
+    user_id: str,
+    site_id: Optional[str] = None,
+    current_user: TokenData = Depends(require_role("admin"))
+):
+    """
+    Affecter un utilisateur enregistré à un site (administrateurs uniquement)
+    
+    - user_id: Utilisateur dont les encodages changent de site
+    - site_id: Nouveau site (absent ou vide: aucun site)
+    """
+    site_id = checked_site_id(site_id)
+    face_count = await set_user_site(user_id, site_id)
+    if not face_count:
+        raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+    return {"success": True, "user_id": user_id, "site_id": site_id, "face_count": face_count}
+
 @app.get("/ml/users-enrolled")
 async def get_enrolled_users_endpoint(
     current_user: TokenData = Depends(get_current_user)
@@ -0,0 +1,186 @@
+"""
+Regroupement des recherches 1:N pour TwoInOne ML Backend
+Micro-lots de vérifications simultanées: un seul calcul matrice-matrice par lot
+"""
+
+import asyncio
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from config import get_app_settings
+from metrics import observe_match_batch
+from site_gallery import best_match_for_site, best_matches_for_site
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingMatch(NamedTuple):
+    """Recherche en attente du prochain lot"""
+    gallery: object
+    probe: np.ndarray
+    site_id: Optional[str]
+    future: asyncio.Future
+
+
+def _match_batch(batch: List[_PendingMatch]) -> List[Tuple[Optional[str], float]]:
+    """
+    Chercher tous les encodages d'un lot (exécuté hors de la boucle d'événements)
+
+    Un calcul best_matches par site demandé (None: recherche globale).
+
+    Returns:
+        Un tuple (user_id, distance) par recherche, dans l'ordre du lot
+    """
+    by_site: Dict[Optional[str], List[int]] = {}
+    for index, pending in enumerate(batch):
+        by_site.setdefault(pending.site_id, []).append(index)
+
+    gallery = batch[0].gallery
+    results: List[Tuple[Optional[str], float]] = [(None, float("inf"))] * len(batch)
+    for site_id, indices in by_site.items():
+        probes = np.stack([batch[index].probe for index in indices])
+        for index, match in zip(indices, best_matches_for_site(gallery, probes, site_id)):
+            results[index] = match
+    return results
+
+
+class MatchBatcher:
+    """
+    Regroupe les recherches 1:N qui arrivent dans une courte fenêtre
+
+    La première recherche d'un lot arme un minuteur de `window` secondes; le lot
+    part à son expiration ou dès `max_size` recherches. Un seul lot est calculé
+    à la fois (dans un thread): les recherches arrivées pendant le calcul forment
+    le lot suivant, d'autant plus grand que la charge est forte. L'attente d'une
+    recherche isolée reste bornée par la fenêtre.
+    """
+
+    def __init__(self, window: float, max_size: int):
+        """
+        Args:
+            window: Attente maximale avant l'envoi d'un lot incomplet (secondes)
+            max_size: Nombre de recherches déclenchant l'envoi immédiat du lot
+        """
+        self.window = window
+        self.max_size = max(1, max_size)
+        self._pending: List[_PendingMatch] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running = False
+        self._tasks: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def best_match(
+        self,
+        gallery,
+        probe: Iterable[float],
+        site_id: Optional[str] = None
+    ) -> Tuple[Optional[str], float]:
+        """
+        Chercher un encodage avec les autres recherches du même lot
+
+        Args:
+            gallery: Galerie en mémoire (chargée)
+            probe: Encodage facial à comparer
+            site_id: Site de la borne (voir site_gallery.best_match_for_site)
+
+        Returns:
+            Tuple (user_id, distance euclidienne)
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(
+            _PendingMatch(gallery, np.asarray(probe, dtype=np.float32), site_id, future)
+        )
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        """Envoyer le lot en attente, sauf si un lot est déjà en cours de calcul"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._running or not self._pending:
+            return
+
+        batch = self._pending[:self.max_size]
+        self._pending = self._pending[self.max_size:]
+        self._running = True
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[_PendingMatch]):
+        """Calculer un lot dans un thread et résoudre les recherches en attente"""
+        observe_match_batch(len(batch))
+        try:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(None, _match_batch, batch)
+        except Exception as e:
+            logger.error(f"Erreur de recherche par lot ({len(batch)} visage(s)): {e}")
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+        else:
+            for pending, match in zip(batch, results):
+                # Requête abandonnée par le client entre-temps: future annulée
+                if not pending.future.done():
+                    pending.future.set_result(match)
+        finally:
+            self._running = False
+            # Recherches arrivées pendant le calcul: leur fenêtre est déjà entamée
+            self._flush()
+
+
+# Instance globale (une par processus), None si le regroupement est désactivé
+_match_batcher: Optional[MatchBatcher] = None
+
+
+def get_match_batcher() -> Optional[MatchBatcher]:
+    """
+    Obtenir le regroupeur de recherches (FACE_MATCH_BATCH_WINDOW_MS > 0)
+
+    Returns:
+        Instance globale, ou None si FACE_MATCH_BATCH_WINDOW_MS vaut 0
+    """
+    global _match_batcher
+    settings = get_app_settings()
+    if settings.FACE_MATCH_BATCH_WINDOW_MS <= 0:
+        return None
+    if _match_batcher is None:
+        _match_batcher = MatchBatcher(
+            window=settings.FACE_MATCH_BATCH_WINDOW_MS / 1000.0,
+            max_size=settings.FACE_MATCH_BATCH_MAX_SIZE
+        )
+        logger.info(
+            f"Recherches 1:N regroupées: fenêtre {settings.FACE_MATCH_BATCH_WINDOW_MS} ms, "
+            f"lots de {settings.FACE_MATCH_BATCH_MAX_SIZE} au plus"
+        )
+    return _match_batcher
+
+
+async def match_probe(
+    gallery,
+    probe: Iterable[float],
+    site_id: Optional[str] = None
+) -> Tuple[Optional[str], float]:
+    """
+    Chercher un encodage dans la galerie, regroupé avec les recherches simultanées
+
+    Sans regroupement (FACE_MATCH_BATCH_WINDOW_MS=0), la recherche est faite
+    immédiatement, seule.
+
+    Returns:
+        Tuple (user_id, distance euclidienne)
+    """
+    batcher = get_match_batcher()
+    if batcher is None:
+        return best_match_for_site(gallery, probe, site_id)
+    return await batcher.best_match(gallery, probe, site_id)
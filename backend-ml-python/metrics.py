@@ -0,0 +1,239 @@
+"""
+Métriques Prometheus pour TwoInOne ML Backend
+Latences par étape du pipeline et par endpoint, résultats, pool et galerie
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest
+)
+
+# Bornes (secondes) adaptées aux étapes: de la recherche en mémoire (~ms)
+# à l'encodage dlib d'une grande image (~s)
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+# Étapes du pipeline et de la comparaison
+STAGE_DECODE = "decode"
+STAGE_QUALITY = "quality"
+STAGE_FACE_LOCATIONS = "face_locations"
+STAGE_FACE_ENCODINGS = "face_encodings"
+STAGE_DB_FETCH = "db_fetch"
+STAGE_MATCH = "match"
+
+STAGE_SECONDS = Histogram(
+    "face_stage_duration_seconds",
+    "Durée de chaque étape du traitement d'une image",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+
+DETECTOR_SECONDS = Histogram(
+    "face_detector_duration_seconds",
+    "Durée d'un passage de chaque détecteur de la cascade",
+    ["detector"],
+    buckets=LATENCY_BUCKETS
+)
+
+DETECTOR_RUNS = Counter(
+    "face_detector_runs_total",
+    "Passages des détecteurs par nombre de visages trouvés (one, none, multiple)",
+    ["detector", "result"]
+)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Durée des requêtes HTTP par endpoint",
+    ["method", "endpoint", "status"],
+    buckets=LATENCY_BUCKETS
+)
+
+OUTCOMES = Counter(
+    "face_outcomes_total",
+    "Résultats des enregistrements et vérifications faciales",
+    ["operation", "outcome"]
+)
+
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Connexions PostgreSQL du pool par état",
+    ["state"]
+)
+
+GALLERY_ENCODINGS = Gauge(
+    "face_gallery_encodings",
+    "Encodages chargés dans la galerie en mémoire"
+)
+
+GALLERY_USERS = Gauge(
+    "face_gallery_users",
+    "Utilisateurs présents dans la galerie en mémoire"
+)
+
+STARTUP_SECONDS = Gauge(
+    "startup_phase_duration_seconds",
+    "Durée des phases du démarrage (import, db_pool, schema, gallery, pipeline_warmup, startup)",
+    ["phase"]
+)
+
+ANALYSIS_CACHE_LOOKUPS = Counter(
+    "face_analysis_cache_total",
+    "Consultations du cache des analyses d'images (hit, miss, coalesced)",
+    ["result"]
+)
+
+ANALYSIS_CACHE_ENTRIES = Gauge(
+    "face_analysis_cache_entries",
+    "Analyses d'images en cache"
+)
+
+MATCH_BATCH_SIZE = Histogram(
+    "face_match_batch_size",
+    "Recherches 1:N regroupées dans un même calcul matrice-matrice",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+)
+
+SITE_SEARCHES = Counter(
+    "face_site_searches_total",
+    "Recherches 1:N avec site_id: conclues dans le site (site) ou étendues à tous les sites (fallback)",
+    ["result"]
+)
+
+GALLERY_SITES = Gauge(
+    "face_gallery_sites",
+    "Sites chargés dans la galerie partitionnée (FACE_SITE_PARTITIONS)"
+)
+
+PIPELINE_PENDING = Gauge(
+    "face_pipeline_pending_images",
+    "Images soumises au pipeline et pas encore traitées"
+)
+
+
+def observe_stage(stage: str, seconds: float):
+    """Enregistrer la durée d'une étape"""
+    STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+
+def observe_stages(timings: Optional[Dict[str, float]]):
+    """Enregistrer les durées mesurées dans un processus du pipeline"""
+    for stage, seconds in (timings or {}).items():
+        observe_stage(stage, seconds)
+
+
+def observe_detector_runs(runs: Optional[Iterable[Tuple[str, float, int]]]):
+    """
+    Enregistrer les passages des détecteurs mesurés dans un processus du pipeline
+
+    Args:
+        runs: Tuples (détecteur, durée en secondes, nombre de visages)
+    """
+    for detector, seconds, face_count in runs or ():
+        DETECTOR_SECONDS.labels(detector=detector).observe(seconds)
+        result = "none" if face_count == 0 else "one" if face_count == 1 else "multiple"
+        DETECTOR_RUNS.labels(detector=detector, result=result).inc()
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    Mesurer la durée d'un bloc
+
+    Usage:
+        with stage_timer(STAGE_MATCH):
+            gallery.best_match(encoding)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def record_outcome(operation: str, outcome: str):
+    """
+    Compter le résultat d'une opération
+
+    Args:
+        operation: "enroll" ou "verify"
+        outcome: no_face, multiple_faces, no_encoding, unreadable, too_large,
+            too_dark, too_bright, blurry, face_too_small, bad_pose,
+            not_enrolled, match, no_match, enrolled
+    """
+    OUTCOMES.labels(operation=operation, outcome=outcome).inc()
+
+
+def record_cache_lookup(result: str):
+    """
+    Compter une consultation du cache des analyses
+
+    Args:
+        result: "hit", "miss" ou "coalesced" (même image déjà en cours d'analyse)
+    """
+    ANALYSIS_CACHE_LOOKUPS.labels(result=result).inc()
+
+
+def observe_match_batch(size: int):
+    """Enregistrer la taille d'un lot de recherches 1:N"""
+    MATCH_BATCH_SIZE.observe(size)
+
+
+def record_site_search(result: str, count: int = 1):
+    """
+    Compter des recherches 1:N limitées à un site
+
+    Args:
+        result: "site" (décision prise dans le site) ou "fallback" (recherche globale)
+        count: Nombre de visages concernés (lots)
+    """
+    SITE_SEARCHES.labels(result=result).inc(count)
+
+
+def record_startup_phase(phase: str, seconds: float):
+    """Enregistrer la durée d'une phase du démarrage"""
+    STARTUP_SECONDS.labels(phase=phase).set(seconds)
+
+
+def observe_request(method: str, endpoint: str, status: int, seconds: float):
+    """Enregistrer la durée d'une requête HTTP"""
+    REQUEST_SECONDS.labels(method=method, endpoint=endpoint, status=str(status)).observe(seconds)
+
+
+def render_metrics() -> bytes:
+    """
+    Exposer les métriques au format texte Prometheus
+
+    Les jauges (pool, galerie, pipeline, cache) sont lues au moment de la collecte:
+    aucun coût sur le chemin des requêtes.
+    """
+    # Imports locaux: database et face_pipeline importent ce module
+    from analysis_cache import get_analysis_cache
+    from database import get_pool_stats
+    from face_pipeline import pending_count
+    from gallery import get_face_gallery
+
+    pool_stats = get_pool_stats()
+    for state in ("in_use", "waiting", "max"):
+        DB_POOL_CONNECTIONS.labels(state=state).set(pool_stats[state])
+
+    gallery = get_face_gallery()
+    GALLERY_ENCODINGS.set(len(gallery))
+    GALLERY_USERS.set(gallery.user_count())
+    if hasattr(gallery, "site_count"):
+        GALLERY_SITES.set(gallery.site_count())
+
+    PIPELINE_PENDING.set(pending_count())
+    ANALYSIS_CACHE_ENTRIES.set(len(get_analysis_cache()))
+
+    return generate_latest(REGISTRY)
+
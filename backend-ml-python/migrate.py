@@ -0,0 +1,299 @@
+"""
+Migrations versionnées du schéma pour TwoInOne ML Backend
+Applique une seule fois les fichiers de migrations/ sous verrou consultatif
+
+Usage:
+    python migrate.py            # appliquer les migrations en attente
+    python migrate.py --status   # afficher la version du schéma
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sys
+from typing import Dict, List, NamedTuple, Optional
+
+import psycopg2
+
+from config import get_app_settings
+from database import get_db_connection, run_in_db_thread
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Fichiers NNN_description.sql
+_MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# Ligne marquant une migration exécutée hors transaction (CREATE INDEX CONCURRENTLY)
+_NO_TRANSACTION_MARKER = re.compile(r"^--\s*migrate:\s*no-transaction\s*$", re.MULTILINE)
+
+# Fin d'instruction: point-virgule en fin de ligne
+_STATEMENT_END = re.compile(r";[ \t]*$", re.MULTILINE)
+
+# Clé du verrou consultatif partagée par tous les réplicas ("twoinone" en ASCII),
+# hors de la plage int4 des verrous par utilisateur (hashtext)
+MIGRATION_LOCK_KEY = 0x74776F696E6F6E65
+
+CREATE_VERSION_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    checksum CHAR(64) NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+
+
+
+class Migration(NamedTuple):
+    """Un fichier de migrations/"""
+    version: int
+    name: str
+    path: str
+    checksum: str
+    # False: instructions exécutées une à une en autocommit (marqueur
+    # "-- migrate: no-transaction"), pour CREATE INDEX CONCURRENTLY
+    transaction: bool = True
+
+    def read(self) -> str:
+        with open(self.path, encoding="utf-8") as sql_file:
+            return sql_file.read()
+
+    def statements(self) -> List[str]:
+        """Instructions de la migration, séparées par un ';' en fin de ligne"""
+        statements = []
+        for chunk in _STATEMENT_END.split(self.read()):
+            code = "\n".join(
+                line for line in chunk.splitlines() if not line.lstrip().startswith("--")
+            )
+            if code.strip():
+                statements.append(chunk.strip())
+        return statements
+
+
+class MigrationError(Exception):
+    """Levée quand le schéma ne peut pas être mis à jour"""
+
+
+def discover_migrations(directory: str = MIGRATIONS_DIR) -> List[Migration]:
+    """
+    Lister les migrations par version croissante
+
+    Args:
+        directory: Dossier des fichiers NNN_description.sql
+
+    Returns:
+        Liste des migrations
+
+    Raises:
+        MigrationError: Si deux fichiers ont le même numéro de version
+    """
+    migrations: Dict[int, Migration] = {}
+    for filename in sorted(os.listdir(directory)):
+        match = _MIGRATION_FILE.match(filename)
+        if not match:
+            continue
+
+        version = int(match.group(1))
+        if version in migrations:
+            raise MigrationError(
+                f"Version {version} en double: {migrations[version].name} et {filename}"
+            )
+
+        path = os.path.join(directory, filename)
+        with open(path, "rb") as sql_file:
+            content = sql_file.read()
+        checksum = hashlib.sha256(content).hexdigest()
+        transaction = not _NO_TRANSACTION_MARKER.search(content.decode("utf-8"))
+        migrations[version] = Migration(version, filename, path, checksum, transaction)
+
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def read_schema_version(cursor) -> int:
+    """
+    Lire la version du schéma (lecture seule, sans verrou)
+
+    Args:
+        cursor: Curseur PostgreSQL
+
+    Returns:
+        Plus grande version de schema_migrations (0 si la table n'existe pas)
+    """
+    cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute("SELECT COALESCE(max(version), 0) FROM schema_migrations")
+    return cursor.fetchone()[0]
+
+
+def latest_version(migrations: Optional[List[Migration]] = None) -> int:
+    """Version de la dernière migration connue (0 si aucune)"""
+    migrations = discover_migrations() if migrations is None else migrations
+    return migrations[-1].version if migrations else 0
+
+
+def migrate(dsn: str, migrations: Optional[List[Migration]] = None) -> List[Migration]:
+    """
+    Appliquer les migrations en attente (bloquant)
+
+    Utilise une connexion dédiée, sans le statement_timeout du pool (un
+    backfill peut être long). Le verrou consultatif sérialise les réplicas
+    qui démarrent ensemble: les suivants attendent puis ne trouvent plus
+    rien à appliquer. Chaque migration est appliquée et enregistrée dans
+    la même transaction, sauf celles marquées "-- migrate: no-transaction":
+    leurs instructions sont exécutées une à une en autocommit (CREATE INDEX
+    CONCURRENTLY ne bloque pas les écritures mais refuse les transactions),
+    puis la migration est enregistrée. Elles doivent donc pouvoir être
+    rejouées après un échec partiel (IF NOT EXISTS).
+
+    Args:
+        dsn: URL PostgreSQL
+        migrations: Migrations connues (défaut: dossier migrations/)
+
+    Returns:
+        Migrations appliquées par cet appel
+
+    Raises:
+        MigrationError: Si une migration échoue (elle est annulée)
+    """
+    migrations = discover_migrations() if migrations is None else migrations
+    applied_now = []
+
+    conn = psycopg2.connect(dsn)
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        cursor.execute(CREATE_VERSION_TABLE_SQL)
+        cursor.execute("SELECT version, checksum FROM schema_migrations")
+        applied = dict(cursor.fetchall())
+
+        conn.autocommit = False
+        for migration in migrations:
+            if migration.version in applied:
+                if applied[migration.version].strip() != migration.checksum:
+                    logger.warning(
+                        f"⚠️  Migration {migration.name} modifiée depuis son application"
+                    )
+                continue
+
+            logger.info(f"Application de la migration {migration.name}...")
+            try:
+                if migration.transaction:
+                    cursor.execute(migration.read())
+                else:
+                    conn.autocommit = True
+                    for statement in migration.statements():
+                        cursor.execute(statement)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+                    (migration.version, migration.name, migration.checksum)
+                )
+                conn.commit()
+            except psycopg2.Error as e:
+                conn.rollback()
+                raise MigrationError(f"Échec de la migration {migration.name}: {e}") from e
+            finally:
+                if not migration.transaction:
+                    conn.autocommit = False
+
+            applied_now.append(migration)
+            logger.info(f"✅ Migration {migration.name} appliquée")
+
+        conn.autocommit = True
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+    finally:
+        conn.close()
+
+    return applied_now
+
+
+async def get_schema_version() -> int:
+    """
+    Version actuelle du schéma (0 si aucune migration n'a été enregistrée)
+
+    Returns:
+        Plus grande version de schema_migrations
+    """
+    def _fetch() -> int:
+        with get_db_connection() as conn:
+            return read_schema_version(conn.cursor())
+
+    return await run_in_db_thread(_fetch)
+
+
+async def ensure_schema() -> int:
+    """
+    Vérifier la version du schéma au démarrage, migrer si DB_AUTO_MIGRATE
+
+    Le cas courant (schéma à jour) ne coûte que deux SELECT, sans verrou.
+
+    Returns:
+        Version du schéma
+
+    Raises:
+        MigrationError: Si le schéma est en retard et DB_AUTO_MIGRATE est désactivé,
+            ou si une migration échoue
+    """
+    settings = get_app_settings()
+    migrations = discover_migrations()
+    expected = latest_version(migrations)
+
+    version = await get_schema_version()
+    if version >= expected:
+        logger.info(f"✅ Schéma à jour (version {version})")
+        return version
+
+    if not settings.DB_AUTO_MIGRATE:
+        raise MigrationError(
+            f"Schéma en version {version}, version {expected} attendue: "
+            f"exécuter 'python migrate.py'"
+        )
+
+    logger.info(f"Schéma en version {version}, migration vers {expected}...")
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, migrate, settings.DATABASE_URL, migrations)
+    return expected
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Migrations du schéma du backend ML")
+    parser.add_argument("--status", action="store_true", help="Afficher la version sans migrer")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    settings = get_app_settings()
+    migrations = discover_migrations()
+
+    if args.status:
+        conn = psycopg2.connect(settings.DATABASE_URL)
+        try:
+            version = read_schema_version(conn.cursor())
+        finally:
+            conn.close()
+        pending = [migration.name for migration in migrations if migration.version > version]
+        print(f"Version du schéma: {version} (dernière: {latest_version(migrations)})")
+        for name in pending:
+            print(f"  en attente: {name}")
+        return 0
+
+    try:
+        applied = migrate(settings.DATABASE_URL, migrations)
+    except MigrationError as e:
+        logger.error(f"❌ {e}")
+        return 1
+
+    if applied:
+        print(f"{len(applied)} migration(s) appliquée(s)")
+    else:
+        print("Schéma déjà à jour")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
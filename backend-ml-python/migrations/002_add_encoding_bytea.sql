@@ -0,0 +1,36 @@
+-- Migration 002: Stockage binaire compact des encodages faciaux
+-- Date: 2026-10-18
+-- Description: Ajoute la colonne encoding_bin (128 float32 big-endian, 512 octets)
+--              et la remplit à partir des données JSONB existantes
+
+-- Ajouter la colonne binaire
+ALTER TABLE face_encodings
+ADD COLUMN IF NOT EXISTS encoding_bin BYTEA;
+
+-- Remplir encoding_bin depuis le JSONB (float4send produit du float32 big-endian)
+UPDATE face_encodings AS fe
+SET encoding_bin = packed.bin
+FROM (
+    SELECT f.id,
+           string_agg(float4send(e.value::float4), ''::bytea ORDER BY e.ord) AS bin
+    FROM face_encodings f
+    CROSS JOIN LATERAL jsonb_array_elements_text(f.encoding) WITH ORDINALITY AS e(value, ord)
+    WHERE f.encoding_bin IS NULL
+    GROUP BY f.id
+) AS packed
+WHERE fe.id = packed.id;
+
+-- Les nouvelles lignes n'écrivent plus que la colonne binaire
+ALTER TABLE face_encodings
+ALTER COLUMN encoding DROP NOT NULL;
+
+-- Chaque ligne doit avoir au moins un des deux formats
+ALTER TABLE face_encodings
+DROP CONSTRAINT IF EXISTS face_encodings_encoding_present;
+
+ALTER TABLE face_encodings
+ADD CONSTRAINT face_encodings_encoding_present
+CHECK (encoding_bin IS NOT NULL OR encoding IS NOT NULL);
+
+COMMENT ON COLUMN face_encodings.encoding IS 'Ancien format JSONB (array de floats), NULL pour les nouvelles lignes';
+COMMENT ON COLUMN face_encodings.encoding_bin IS 'Encodage facial binaire: 128 float32 big-endian (512 octets)';
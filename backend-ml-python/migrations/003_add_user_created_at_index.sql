@@ -0,0 +1,11 @@
+-- Migration 003: Index pour la limite d'encodages par utilisateur
+-- Date: 2026-10-18
+-- Description: L'enrôlement trie les encodages d'un utilisateur par date
+--              (limite MAX_ENCODINGS_PER_USER) dans la même requête que l'insertion
+-- Construit sans bloquer les écritures (CONCURRENTLY, hors transaction). Après
+-- un échec, supprimer l'index invalide avant de relancer:
+--   DROP INDEX CONCURRENTLY IF EXISTS idx_face_encodings_user_id_created_at;
+-- migrate: no-transaction
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_face_encodings_user_id_created_at
+ON face_encodings(user_id, created_at DESC, id DESC);
@@ -0,0 +1,17 @@
+-- Migration 004: Partition des encodages faciaux par site
+-- Date: 2026-10-18
+-- Description: Ajoute la colonne site_id (site ou locataire de l'utilisateur);
+--              la vérification 1:N peut alors ne chercher que dans un site
+--              et chaque réplique ne charger que les sites qu'elle sert
+-- Index construit sans bloquer les écritures (CONCURRENTLY, hors transaction)
+-- migrate: no-transaction
+
+-- NULL: utilisateur sans site (partition commune)
+ALTER TABLE face_encodings
+ADD COLUMN IF NOT EXISTS site_id VARCHAR(255);
+
+-- Chargement de la galerie limité à quelques sites (FACE_GALLERY_SITES)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_face_encodings_site_id
+ON face_encodings(site_id);
+
+COMMENT ON COLUMN face_encodings.site_id IS 'Site (locataire) de l''utilisateur, NULL si aucun; toutes les lignes d''un utilisateur portent le même site';
@@ -0,0 +1,334 @@
+"""
+Recherche en deux étapes par prototypes pour TwoInOne ML Backend
+Un encodage moyen par utilisateur pour le tri grossier, puis comparaison exacte
+"""
+
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from gallery import FaceGallery, ENCODING_DIM, _INITIAL_CAPACITY
+
+logger = logging.getLogger(__name__)
+
+# Lignes ajoutées depuis le dernier regroupement par utilisateur au-delà
+# desquelles le regroupement est refait (les autres sont balayées à part)
+_MIN_UNINDEXED_ROWS = 256
+
+
+class _SearchState(NamedTuple):
+    """Vues cohérentes utilisées par une recherche (prises sous verrou)"""
+    user_ids: np.ndarray
+    encodings: np.ndarray
+    sq_norms: np.ndarray
+    prototypes: np.ndarray
+    prototype_norms: np.ndarray
+    user_count: int
+    # Lignes triées par utilisateur: order[offsets[s]:offsets[s + 1]] pour l'emplacement s
+    order: np.ndarray
+    offsets: np.ndarray
+    # Lignes [indexed, size) ajoutées depuis le regroupement
+    indexed: int
+
+
+class PrototypeFaceGallery(FaceGallery):
+    """
+    Galerie exacte avec un prototype (encodage moyen) par utilisateur
+
+    Une recherche compare d'abord l'encodage aux prototypes (un vecteur par
+    utilisateur au lieu de MAX_ENCODINGS_PER_USER), puis calcule les
+    distances exactes aux encodages des `candidates` utilisateurs les plus
+    proches. Les distances retournées sont exactes: un visage nettement sous
+    FACE_RECOGNITION_THRESHOLD est proche du prototype de son utilisateur et
+    reste parmi les candidats.
+
+    Les prototypes sont mis à jour à chaque ajout ou suppression à partir des
+    sommes des encodages de chaque utilisateur, sans recalcul global.
+    """
+
+    def __init__(
+        self,
+        candidates: int = 8,
+        dim: int = ENCODING_DIM,
+        initial_capacity: int = _INITIAL_CAPACITY
+    ):
+        """
+        Args:
+            candidates: Utilisateurs dont les encodages sont comparés après le tri
+            dim: Dimension des encodages
+            initial_capacity: Capacité initiale des tableaux
+        """
+        super().__init__(dim, initial_capacity)
+        self.candidates = max(1, candidates)
+        # Emplacement du prototype de chaque ligne (tableau parallèle aux encodages)
+        self._slots = np.empty(0, dtype=np.int32)
+        self._slot_of: Dict[str, int] = {}
+        self._slot_users: List[Optional[str]] = []
+        self._free_slots: List[int] = []
+        self._slot_count = 0
+        # Somme (float64) et nombre des encodages de chaque emplacement
+        self._sums = np.empty((0, dim), dtype=np.float64)
+        self._counts = np.empty(0, dtype=np.int64)
+        self._prototypes = np.empty((0, dim), dtype=np.float32)
+        self._prototype_norms = np.empty(0, dtype=np.float32)
+        self._order = np.empty(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._indexed = 0
+
+    def user_count(self) -> int:
+        """Nombre d'utilisateurs distincts présents dans la galerie"""
+        return len(self._slot_of)
+
+    def load_arrays(self, row_ids: Iterable[int], user_ids: Iterable[str], encodings: np.ndarray):
+        """
+        Remplacer le contenu de la galerie et recalculer tous les prototypes
+
+        Args:
+            row_ids: IDs des lignes dans face_encodings
+            user_ids: user_id de chaque ligne
+            encodings: Matrice (N x 128) des encodages
+        """
+        with self._lock:
+            super().load_arrays(row_ids, user_ids, encodings)
+
+            size = self._size
+            names = self._user_ids[:size].tolist()
+            self._slot_of = {user_id: slot for slot, user_id in enumerate(dict.fromkeys(names))}
+            slots = np.fromiter(map(self._slot_of.__getitem__, names), dtype=np.int32, count=size)
+            self._slots = np.empty(len(self._encodings), dtype=np.int32)
+            self._slots[:size] = slots
+            self._slot_users = list(self._slot_of)
+            self._free_slots = []
+            self._slot_count = len(self._slot_of)
+            self._index_rows()
+
+            capacity = max(self._initial_capacity, self._slot_count)
+            self._counts = np.zeros(capacity, dtype=np.int64)
+            self._counts[:self._slot_count] = np.diff(self._offsets)
+            self._sums = np.zeros((capacity, self.dim), dtype=np.float64)
+            self._sum_rows()
+            self._prototypes = np.zeros((capacity, self.dim), dtype=np.float32)
+            self._prototype_norms = np.full(capacity, np.inf, dtype=np.float32)
+            self._update_prototypes(np.arange(self._slot_count))
+
+        logger.info(f"Prototypes calculés: {self._slot_count} utilisateur(s)")
+
+    def add(
+        self,
+        row_id: int,
+        user_id: str,
+        encoding: Iterable[float],
+        max_per_user: Optional[int] = None
+    ):
+        """
+        Ajouter un encodage et mettre à jour le prototype de l'utilisateur
+
+        Args:
+            row_id: ID de la ligne dans face_encodings
+            user_id: ID de l'utilisateur
+            encoding: Encodage facial (128 floats)
+            max_per_user: Nombre maximum d'encodages conservés pour cet utilisateur
+        """
+        with self._lock:
+            super().add(row_id, user_id, encoding, max_per_user)
+
+            index = self._size - 1
+            slot = self._slot_of.get(user_id)
+            if slot is None:
+                slot = self._new_slot(user_id)
+            self._slots[index] = slot
+            self._sums[slot] += self._encodings[index]
+            self._counts[slot] += 1
+            self._update_prototypes(np.array([slot]))
+
+            unindexed = self._size - self._indexed
+            if unindexed > max(_MIN_UNINDEXED_ROWS, self._indexed // 16):
+                self._index_rows()
+
+    def best_match(self, probe: Iterable[float]) -> Tuple[Optional[str], float]:
+        """
+        Trouver l'encodage le plus proche parmi ceux des utilisateurs candidats
+
+        Args:
+            probe: Encodage facial à comparer
+
+        Returns:
+            Tuple (user_id, distance euclidienne), (None, inf) si la galerie est vide
+        """
+        return self.best_matches(self._as_vector(probe)[None, :])[0]
+
+    def best_matches(self, probes: np.ndarray) -> List[Tuple[Optional[str], float]]:
+        """
+        Trouver le meilleur candidat pour plusieurs encodages
+
+        Le tri grossier est vectorisé (M x utilisateurs); la comparaison
+        exacte reste propre à chaque encodage.
+
+        Args:
+            probes: Matrice (M x 128) des encodages à comparer
+
+        Returns:
+            Liste de M tuples (user_id, distance euclidienne)
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        state = self._search_state()
+        if len(state.user_ids) == 0 or len(probes) == 0:
+            return [(None, float("inf"))] * len(probes)
+
+        # Peu d'utilisateurs: le balayage exact coûte moins que les deux étapes
+        if state.user_count <= self.candidates:
+            return super().best_matches(probes)
+
+        prototypes = state.prototypes
+        squared = (
+            state.prototype_norms[None, :]
+            - 2.0 * (probes @ prototypes.T)
+        )
+        nearest = np.argpartition(squared, self.candidates - 1, axis=1)[:, :self.candidates]
+
+        results = []
+        unindexed = np.arange(state.indexed, len(state.user_ids))
+        for probe, slots in zip(probes, nearest):
+            rows = [unindexed]
+            for slot in slots.tolist():
+                if slot + 1 < len(state.offsets):
+                    rows.append(state.order[state.offsets[slot]:state.offsets[slot + 1]])
+            rows = np.concatenate(rows)
+            if len(rows) == 0:
+                results.append((None, float("inf")))
+                continue
+
+            distances = self._distances(probe, state.encodings[rows], state.sq_norms[rows])
+            best = int(np.argmin(distances))
+            results.append((state.user_ids[rows[best]], float(distances[best])))
+        return self._rematch_dropped(probes, results)
+
+    def _search_state(self) -> _SearchState:
+        with self._lock:
+            size = self._size
+            return _SearchState(
+                user_ids=self._user_ids[:size],
+                encodings=self._encodings[:size],
+                sq_norms=self._sq_norms[:size],
+                prototypes=self._prototypes[:self._slot_count],
+                prototype_norms=self._prototype_norms[:self._slot_count],
+                user_count=len(self._slot_of),
+                order=self._order,
+                offsets=self._offsets,
+                indexed=self._indexed,
+            )
+
+    def _new_slot(self, user_id: str) -> int:
+        """Attribuer un emplacement de prototype à un nouvel utilisateur (sous verrou)"""
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._slot_users[slot] = user_id
+        else:
+            slot = self._slot_count
+            if slot == len(self._counts):
+                self._grow_slots()
+            self._slot_count += 1
+            self._slot_users.append(user_id)
+        self._slot_of[user_id] = slot
+        return slot
+
+    def _grow_slots(self):
+        """Doubler la capacité des prototypes (appelé sous verrou)"""
+        capacity = max(self._initial_capacity, 2 * len(self._counts))
+        used = self._slot_count
+
+        sums = np.zeros((capacity, self.dim), dtype=np.float64)
+        sums[:used] = self._sums[:used]
+        counts = np.zeros(capacity, dtype=np.int64)
+        counts[:used] = self._counts[:used]
+        prototypes = np.zeros((capacity, self.dim), dtype=np.float32)
+        prototypes[:used] = self._prototypes[:used]
+        norms = np.full(capacity, np.inf, dtype=np.float32)
+        norms[:used] = self._prototype_norms[:used]
+
+        self._sums = sums
+        self._counts = counts
+        self._prototypes = prototypes
+        self._prototype_norms = norms
+
+    def _update_prototypes(self, slots: np.ndarray):
+        """
+        Recalculer les prototypes de quelques emplacements (appelé sous verrou)
+
+        Un emplacement sans encodage reçoit une norme infinie: il n'est plus
+        jamais retenu par le tri grossier.
+        """
+        counts = self._counts[slots]
+        live = counts > 0
+        means = (self._sums[slots[live]] / counts[live, None]).astype(np.float32)
+        self._prototypes[slots[live]] = means
+        self._prototype_norms[slots[live]] = np.einsum("ij,ij->i", means, means)
+        self._prototypes[slots[~live]] = 0.0
+        self._prototype_norms[slots[~live]] = np.inf
+
+    def _sum_rows(self):
+        """
+        Sommer les encodages de chaque emplacement (appelé sous verrou, après _index_rows)
+
+        Passe k: k-ième ligne de chaque utilisateur qui en a plus de k. Le
+        nombre de passes est le maximum d'encodages d'un utilisateur
+        (MAX_ENCODINGS_PER_USER en pratique), chaque ligne n'est lue qu'une fois.
+        """
+        counts = self._counts[:self._slot_count]
+        by_count = np.argsort(-counts, kind="stable")
+        sorted_counts = counts[by_count]
+        # Emplacements triés par nombre décroissant: ceux de la passe k sont un préfixe
+        sums = np.zeros((len(counts), self.dim), dtype=np.float64)
+        starts = self._offsets[by_count]
+        for k in range(int(sorted_counts[0]) if len(counts) else 0):
+            active = np.searchsorted(-sorted_counts, -k, side="left")
+            sums[:active] += self._encodings[self._order[starts[:active] + k]]
+        self._sums[by_count] = sums
+
+    def _index_rows(self):
+        """Regrouper les lignes par utilisateur (appelé sous verrou)"""
+        size = self._size
+        slots = self._slots[:size]
+        self._order = np.argsort(slots, kind="stable")
+        offsets = np.zeros(self._slot_count + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(slots, minlength=self._slot_count))
+        self._offsets = offsets
+        self._indexed = size
+
+    def _grow(self):
+        """Doubler la capacité des tableaux, emplacements compris (appelé sous verrou)"""
+        super()._grow()
+        slots = np.empty(len(self._encodings), dtype=np.int32)
+        slots[:self._size] = self._slots[:self._size]
+        self._slots = slots
+
+    def _drop(self, indices: np.ndarray):
+        """Retirer des lignes et les soustraire des prototypes (appelé sous verrou)"""
+        removed = self._slots[indices]
+        np.subtract.at(self._sums, removed, self._encodings[indices])
+        np.subtract.at(self._counts, removed, 1)
+
+        touched = np.unique(removed)
+        for slot in touched[self._counts[touched] == 0].tolist():
+            # Somme remise à zéro: pas de résidu d'arrondi pour le prochain utilisateur
+            self._sums[slot] = 0.0
+            self._free_slots.append(slot)
+            del self._slot_of[self._slot_users[slot]]
+            self._slot_users[slot] = None
+        self._update_prototypes(touched)
+
+        # Lignes marquées: elles restent dans le regroupement (norme infinie)
+        # jusqu'au compactage, même si leur emplacement est réattribué
+        super()._drop(indices)
+
+    def _compact(self):
+        """Retirer les lignes marquées, emplacements compris, puis regrouper (appelé sous verrou)"""
+        size = self._size
+        keep_mask = self._row_ids[:size] >= 0
+        slots = np.empty(len(self._encodings), dtype=np.int32)
+        slots[:int(keep_mask.sum())] = self._slots[:size][keep_mask]
+
+        super()._compact()
+        self._slots = slots
+        self._index_rows()
@@ -0,0 +1,162 @@
+"""
+Contrôle de qualité des images pour TwoInOne ML Backend
+Exposition, netteté, taille et pose du visage avant l'encodage dlib
+
+Exécuté dans les processus du pool, entre le décodage et l'encodage: une
+photo inutilisable est refusée en quelques millisecondes avec un code précis.
+"""
+
+import math
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# Codes de refus (réponses de l'API et métriques face_outcomes_total)
+QUALITY_TOO_DARK = "too_dark"
+QUALITY_TOO_BRIGHT = "too_bright"
+QUALITY_BLURRY = "blurry"
+QUALITY_FACE_TOO_SMALL = "face_too_small"
+QUALITY_BAD_POSE = "bad_pose"
+
+QUALITY_MESSAGES = {
+    QUALITY_TOO_DARK: "Image trop sombre. Améliorez l'éclairage et réessayez.",
+    QUALITY_TOO_BRIGHT: "Image surexposée. Évitez le contre-jour et réessayez.",
+    QUALITY_BLURRY: "Image floue. Restez immobile et réessayez.",
+    QUALITY_FACE_TOO_SMALL: "Visage trop petit. Rapprochez-vous de la caméra.",
+    QUALITY_BAD_POSE: "Visage de biais. Regardez la caméra de face.",
+}
+
+# Côté du visage recadré pour mesurer la netteté (score indépendant de la résolution)
+SHARPNESS_SIDE = 128
+
+# Pas d'échantillonnage des pixels pour l'histogramme d'exposition
+EXPOSURE_STRIDE = 4
+
+
+class QualityOptions(NamedTuple):
+    """Seuils du contrôle de qualité (0 désactive un critère)"""
+    enabled: bool = True
+    min_brightness: float = 40.0
+    max_brightness: float = 220.0
+    min_sharpness: float = 20.0
+    min_face_size: int = 60
+    max_roll_degrees: float = 30.0
+    max_yaw_ratio: float = 0.6
+
+
+def exposure_issue(
+    image: np.ndarray,
+    options: QualityOptions,
+    scores: Dict[str, float]
+) -> Optional[str]:
+    """
+    Contrôler l'exposition de l'image entière (avant la détection)
+
+    La luminosité est la médiane de l'histogramme des niveaux de gris, sur un
+    pixel sur EXPOSURE_STRIDE dans chaque direction.
+
+    Args:
+        image: Image RGB uint8
+        options: Seuils
+        scores: Dict complété avec "brightness"
+
+    Returns:
+        Code de refus, ou None si l'exposition est acceptable
+    """
+    sample = image[::EXPOSURE_STRIDE, ::EXPOSURE_STRIDE]
+    # Luminance ITU-R BT.601 en entiers (poids sur 256)
+    gray = (
+        sample[..., 0].astype(np.uint16) * 77
+        + sample[..., 1].astype(np.uint16) * 150
+        + sample[..., 2].astype(np.uint16) * 29
+    ) >> 8
+    histogram = np.bincount(gray.ravel(), minlength=256)
+    brightness = float(np.searchsorted(np.cumsum(histogram), gray.size / 2))
+    scores["brightness"] = brightness
+
+    if options.min_brightness > 0 and brightness < options.min_brightness:
+        return QUALITY_TOO_DARK
+    if options.max_brightness > 0 and brightness > options.max_brightness:
+        return QUALITY_TOO_BRIGHT
+    return None
+
+
+def face_issue(
+    image: np.ndarray,
+    box: Tuple[int, int, int, int],
+    options: QualityOptions,
+    scores: Dict[str, float]
+) -> Optional[str]:
+    """
+    Contrôler le visage détecté (avant l'encodage)
+
+    Taille de la boîte, netteté (variance du laplacien sur le visage ramené à
+    SHARPNESS_SIDE pixels) puis pose: roulis d'après l'axe des yeux, lacet
+    d'après le décalage du nez par rapport au milieu des yeux (5 points dlib).
+
+    Args:
+        image: Image RGB uint8 (résolution d'encodage)
+        box: Boîte (top, right, bottom, left) du visage
+        options: Seuils
+        scores: Dict complété avec face_size, sharpness, roll, yaw
+
+    Returns:
+        Code de refus, ou None si le visage est exploitable
+    """
+    import cv2
+
+    top, right, bottom, left = box
+    face_size = min(bottom - top, right - left)
+    scores["face_size"] = float(face_size)
+    if options.min_face_size > 0 and face_size < options.min_face_size:
+        return QUALITY_FACE_TOO_SMALL
+
+    if options.min_sharpness > 0:
+        face = cv2.cvtColor(image[top:bottom, left:right], cv2.COLOR_RGB2GRAY)
+        face = cv2.resize(face, (SHARPNESS_SIDE, SHARPNESS_SIDE), interpolation=cv2.INTER_AREA)
+        sharpness = float(cv2.Laplacian(face, cv2.CV_64F).var())
+        scores["sharpness"] = round(sharpness, 2)
+        if sharpness < options.min_sharpness:
+            return QUALITY_BLURRY
+
+    if options.max_roll_degrees > 0 or options.max_yaw_ratio > 0:
+        roll, yaw = _pose(image, box)
+        if roll is not None:
+            scores["roll"] = round(roll, 1)
+            scores["yaw"] = round(yaw, 2)
+            if options.max_roll_degrees > 0 and roll > options.max_roll_degrees:
+                return QUALITY_BAD_POSE
+            if options.max_yaw_ratio > 0 and yaw > options.max_yaw_ratio:
+                return QUALITY_BAD_POSE
+
+    return None
+
+
+def _pose(image: np.ndarray, box: Tuple[int, int, int, int]) -> Tuple[Optional[float], float]:
+    """
+    Roulis (degrés) et lacet (décalage du nez / distance entre les yeux)
+
+    Returns:
+        Tuple (roulis, lacet); roulis None si les points n'ont pas été trouvés
+    """
+    import face_recognition
+
+    landmarks = face_recognition.face_landmarks(image, [box], model="small")
+    if not landmarks:
+        return None, 0.0
+
+    points = landmarks[0]
+    eye_a = np.mean(points["left_eye"], axis=0)
+    eye_b = np.mean(points["right_eye"], axis=0)
+    nose = np.asarray(points["nose_tip"][0], dtype=float)
+
+    dx, dy = eye_b - eye_a
+    eye_distance = math.hypot(dx, dy)
+    if eye_distance == 0:
+        return None, 0.0
+
+    roll = math.degrees(math.atan2(abs(dy), abs(dx)))
+    # Distance du nez à la médiatrice des yeux, relative à l'écart des yeux
+    middle = (eye_a + eye_b) / 2
+    yaw = abs(float(np.dot(nose - middle, (dx, dy)))) / eye_distance ** 2
+    return roll, yaw
@@ -0,0 +1,418 @@
+"""
+Galerie partagée entre workers pour TwoInOne ML Backend
+Encodages dans un fichier mappé en mémoire, alimenté par un seul worker
+"""
+
+import bisect
+import fcntl
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from gallery import ENCODING_DIM, FaceGallery
+from gallery_file import (
+    H_BLOB_CAPACITY,
+    H_BLOB_USED,
+    H_COUNT,
+    H_LIVE,
+    H_LIVE_USERS,
+    H_USER_CAPACITY,
+    H_USERS,
+    MIN_CAPACITY,
+    GalleryFile,
+    write_gallery_file
+)
+
+logger = logging.getLogger(__name__)
+
+# Fichiers du répertoire partagé
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "writer.lock"
+GENERATION_PREFIX = "gallery."
+
+
+class _UserLabels:
+    """user_ids des lignes d'une génération, décodés à la demande"""
+
+    def __init__(self, gallery_file: GalleryFile, count: int):
+        self._file = gallery_file
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, row: int) -> Optional[str]:
+        return self._file.user_name(int(self._file.user_index[row]))
+
+
+class SharedFaceGallery(FaceGallery):
+    """
+    Galerie commune à tous les workers uvicorn d'une machine
+
+    Un seul worker (l'écrivain, élu par un verrou flock) lit la table au
+    démarrage, applique les modifications (les siennes et, via LISTEN/NOTIFY,
+    celles des autres workers) et publie la galerie dans un fichier du
+    répertoire partagé. Les autres workers mappent ce fichier en lecture
+    seule: une seule copie des encodages en mémoire, une seule lecture de la
+    table au démarrage.
+
+    Dans une génération, un ajout écrit la ligne au-delà du compteur puis
+    incrémente le compteur; une suppression marque la ligne (norme infinie,
+    jamais retenue par la recherche). Quand la capacité est atteinte ou que
+    les lignes supprimées dépassent un quart, une nouvelle génération est
+    écrite dans un fichier temporaire puis publiée par renommage atomique de
+    CURRENT: un lecteur voit l'ancienne ou la nouvelle, jamais un mélange.
+    """
+
+    def __init__(self, directory: str, dim: int = ENCODING_DIM):
+        super().__init__(dim=dim)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self._file: Optional[GalleryFile] = None
+        self._current_key: Optional[Tuple[int, int]] = None
+        self._lock_fd: Optional[int] = None
+        self._generation = 0
+
+        # Index propres à l'écrivain (non partagés)
+        self._positions: Dict[int, int] = {}
+        self._user_rows: Dict[str, List[int]] = {}
+        self._user_slots: Dict[str, int] = {}
+
+    @property
+    def is_writer(self) -> bool:
+        """True si ce worker détient le verrou d'écriture"""
+        return self._lock_fd is not None
+
+    @property
+    def is_loaded(self) -> bool:
+        """True si une génération est publiée (ou chargée par l'écrivain)"""
+        return self._current() is not None
+
+    def try_become_writer(self) -> bool:
+        """
+        Tenter de devenir l'écrivain de la galerie (sans attendre)
+
+        L'écrivain doit ensuite charger la galerie depuis la base. Le verrou
+        est libéré par le système à la fin du processus, ce qui permet à un
+        autre worker de reprendre le rôle.
+
+        Returns:
+            True si ce worker est (désormais) l'écrivain
+        """
+        with self._lock:
+            if self._lock_fd is not None:
+                return True
+
+            fd = os.open(self._path(LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            self._lock_fd = fd
+
+            current = self._read_current()
+            if current is not None:
+                self._generation = int(current[len(GENERATION_PREFIX):])
+            if self._file is None:
+                # Génération d'un démarrage précédent: les lecteurs attendent le rechargement
+                self._unlink(self._path(CURRENT_FILE))
+                current = None
+            self._remove_stale_files(keep=current)
+
+            logger.info(f"✅ Worker {os.getpid()} écrivain de la galerie partagée ({self.directory})")
+            return True
+
+    def __len__(self) -> int:
+        gallery_file = self._current()
+        return 0 if gallery_file is None else int(gallery_file.header[H_LIVE])
+
+    def user_count(self) -> int:
+        """Nombre d'utilisateurs distincts présents dans la galerie"""
+        gallery_file = self._current()
+        return 0 if gallery_file is None else int(gallery_file.header[H_LIVE_USERS])
+
+    def load_arrays(self, row_ids: Iterable[int], user_ids: Iterable[str], encodings: np.ndarray):
+        """
+        Publier une nouvelle génération avec le contenu de la table (écrivain)
+
+        Raises:
+            RuntimeError: Si ce worker n'est pas l'écrivain
+        """
+        if not self.is_writer:
+            raise RuntimeError("Galerie partagée en lecture seule dans ce worker")
+
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            self._publish(np.asarray(row_ids, dtype=np.int64), list(user_ids), encodings)
+        logger.info(f"Galerie partagée publiée: {len(encodings)} encodage(s) (génération {self._generation})")
+
+    def add(
+        self,
+        row_id: int,
+        user_id: str,
+        encoding: Iterable[float],
+        max_per_user: Optional[int] = None
+    ):
+        """
+        Ajouter un encodage (écrivain; ignoré par les lecteurs, l'écrivain
+        appliquant la notification de la base)
+        """
+        vector = self._as_vector(encoding)
+
+        with self._lock:
+            if not self._writable:
+                return
+            if max_per_user is not None:
+                self._trim_user(user_id, max_per_user - 1)
+            self._append(row_id, user_id, vector)
+
+    def remove_rows(self, row_ids: Iterable[int]) -> int:
+        """Retirer des encodages par ID de ligne (écrivain)"""
+        with self._lock:
+            if not self._writable:
+                return 0
+
+            removed = [row_id for row_id in set(row_ids) if row_id in self._positions]
+            for row_id in removed:
+                slot = int(self._file.user_index[self._positions[row_id]])
+                user_id = self._file.user_name(slot)
+                rows = self._user_rows[user_id]
+                rows.remove(row_id)
+                if not rows:
+                    self._forget_user(user_id)
+            self._tombstone(removed)
+            return len(removed)
+
+    def export_arrays(self) -> Tuple[np.ndarray, List[str], np.ndarray]:
+        """Lignes vivantes de la génération courante, sous la forme acceptée par load_arrays"""
+        gallery_file = self._current()
+        if gallery_file is None:
+            return np.empty(0, dtype=np.int64), [], np.empty((0, self.dim), dtype=np.float32)
+        return gallery_file.live_rows()
+
+    def version(self) -> Tuple[int, int, int]:
+        """Signature du contenu: (nombre de lignes, id max, somme des ids)"""
+        _, _, _, row_ids = self.snapshot()
+        row_ids = row_ids[row_ids >= 0]
+        if len(row_ids) == 0:
+            return 0, 0, 0
+        return len(row_ids), int(row_ids.max()), int(row_ids.sum())
+
+    def user_encodings(self, user_id: str) -> np.ndarray:
+        """Encodages (copie) d'un utilisateur, du plus ancien au plus récent"""
+        labels, encodings, _, row_ids = self.snapshot()
+        mask = np.fromiter(
+            (labels[row] == user_id for row in range(len(labels))),
+            dtype=bool,
+            count=len(labels)
+        )
+        order = np.argsort(row_ids[mask], kind="stable")
+        return np.array(encodings[mask][order])
+
+    def snapshot(self) -> Tuple[_UserLabels, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Vues cohérentes (user_ids, encodages, normes², ids) de la génération courante
+
+        Les vues pointent directement dans le fichier mappé. Les lignes
+        supprimées y restent jusqu'à la génération suivante, avec une norme
+        infinie, un id -1 et un user_id None.
+        """
+        gallery_file = self._current()
+        if gallery_file is None:
+            return (
+                np.empty(0, dtype=object),
+                np.empty((0, self.dim), dtype=np.float32),
+                np.empty(0, dtype=np.float32),
+                np.empty(0, dtype=np.int64),
+            )
+
+        # Compteur lu une seule fois: les lignes en deçà sont entièrement écrites
+        count = int(gallery_file.header[H_COUNT])
+        return (
+            _UserLabels(gallery_file, count),
+            gallery_file.encodings[:count],
+            gallery_file.sq_norms[:count],
+            gallery_file.row_ids[:count],
+        )
+
+    @property
+    def _writable(self) -> bool:
+        """Écrivain ayant publié sa propre génération (appelé sous verrou)"""
+        return self.is_writer and self._file is not None and self._file.header.flags.writeable
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _current(self) -> Optional[GalleryFile]:
+        """Génération courante, remappée si l'écrivain en a publié une nouvelle"""
+        if self.is_writer:
+            return self._file
+
+        try:
+            stat = os.stat(self._path(CURRENT_FILE))
+        except FileNotFoundError:
+            return self._file
+
+        key = (stat.st_ino, stat.st_mtime_ns)
+        if key != self._current_key:
+            with self._lock:
+                if key != self._current_key:
+                    name = self._read_current()
+                    try:
+                        self._file = GalleryFile.open(self._path(name))
+                        self._current_key = key
+                    except (FileNotFoundError, TypeError, ValueError):
+                        # Génération remplacée entre les deux lectures: nouvel essai au prochain appel
+                        pass
+        return self._file
+
+    def _read_current(self) -> Optional[str]:
+        try:
+            with open(self._path(CURRENT_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _publish(self, row_ids: np.ndarray, user_ids: List[str], encodings: np.ndarray):
+        """
+        Écrire une nouvelle génération et la rendre courante (appelé sous verrou)
+
+        Les anciens fichiers sont supprimés aussitôt: les lecteurs qui les ont
+        mappés continuent de les lire jusqu'à leur prochain accès.
+        """
+        generation = self._generation + 1
+        name = f"{GENERATION_PREFIX}{generation:08d}"
+        path = self._path(name)
+        gallery_file = write_gallery_file(path + ".tmp", row_ids, user_ids, encodings)
+
+        # Le mapping reste valide après le renommage (même inode)
+        os.replace(path + ".tmp", path)
+        gallery_file.path = path
+        current = self._path(CURRENT_FILE)
+        with open(current + ".tmp", "w") as f:
+            f.write(name)
+        os.replace(current + ".tmp", current)
+
+        previous = self._file
+        self._file = gallery_file
+        self._generation = generation
+        self._loaded = True
+
+        self._positions = {int(row_id): i for i, row_id in enumerate(row_ids.tolist())}
+        self._user_slots = {}
+        for user_id in user_ids:
+            self._user_slots.setdefault(user_id, len(self._user_slots))
+        self._user_rows = {}
+        for row_id, user_id in zip(row_ids.tolist(), user_ids):
+            self._user_rows.setdefault(user_id, []).append(int(row_id))
+        for rows in self._user_rows.values():
+            rows.sort()
+
+        if previous is not None and previous.path != path:
+            self._unlink(previous.path)
+
+    def _republish(self):
+        """Recopier les lignes vivantes dans une génération plus grande (appelé sous verrou)"""
+        self._publish(*self._file.live_rows())
+        logger.info(f"Galerie partagée compactée: génération {self._generation}")
+
+    def _append(self, row_id: int, user_id: str, vector: np.ndarray):
+        """Ajouter une ligne à la génération courante (appelé sous verrou)"""
+        name = None if user_id in self._user_slots else user_id.encode("utf-8")
+        header = self._file.header
+        if int(header[H_COUNT]) >= self._file.capacity or (
+            name is not None and (
+                int(header[H_USERS]) >= int(header[H_USER_CAPACITY])
+                or int(header[H_BLOB_USED]) + len(name) > int(header[H_BLOB_CAPACITY])
+            )
+        ):
+            self._republish()
+            name = None if user_id in self._user_slots else user_id.encode("utf-8")
+
+        gallery_file = self._file
+        header = gallery_file.header
+
+        if name is not None:
+            slot = int(header[H_USERS])
+            used = int(header[H_BLOB_USED])
+            gallery_file.user_blob[used:used + len(name)] = np.frombuffer(name, dtype=np.uint8)
+            gallery_file.user_offsets[slot + 1] = used + len(name)
+            header[H_BLOB_USED] = used + len(name)
+            header[H_USERS] = slot + 1
+            self._user_slots[user_id] = slot
+
+        index = int(header[H_COUNT])
+        gallery_file.encodings[index] = vector
+        gallery_file.sq_norms[index] = float(np.dot(vector, vector))
+        gallery_file.row_ids[index] = row_id
+        gallery_file.user_index[index] = self._user_slots[user_id]
+        self._positions[int(row_id)] = index
+
+        rows = self._user_rows.setdefault(user_id, [])
+        if not rows:
+            header[H_LIVE_USERS] += 1
+        bisect.insort(rows, int(row_id))
+
+        header[H_LIVE] += 1
+        # Publier la ligne en dernier: les lecteurs ne lisent que [0, COUNT)
+        header[H_COUNT] = index + 1
+
+    def _trim_user(self, user_id: str, keep: int) -> int:
+        """
+        Ne garder que les `keep` encodages les plus récents d'un utilisateur
+        (appelé sous verrou)
+        """
+        if not self._writable:
+            return 0
+
+        rows = self._user_rows.get(user_id, [])
+        excess = len(rows) - max(keep, 0)
+        if excess <= 0:
+            return 0
+
+        # Les ids SERIAL croissent avec created_at: les plus petits sont les plus anciens
+        oldest = rows[:excess]
+        del rows[:excess]
+        if not rows:
+            self._forget_user(user_id)
+        self._tombstone(oldest)
+        return excess
+
+    def _forget_user(self, user_id: str):
+        del self._user_rows[user_id]
+        self._file.header[H_LIVE_USERS] -= 1
+
+    def _tombstone(self, row_ids: List[int]):
+        """Marquer des lignes comme supprimées, compacter si nécessaire (appelé sous verrou)"""
+        if not row_ids:
+            return
+
+        gallery_file = self._file
+        for row_id in row_ids:
+            index = self._positions.pop(int(row_id))
+            # Norme infinie d'abord: la ligne n'est plus jamais retenue
+            gallery_file.sq_norms[index] = np.inf
+            gallery_file.user_index[index] = -1
+            gallery_file.row_ids[index] = -1
+        gallery_file.header[H_LIVE] -= len(row_ids)
+
+        count = int(gallery_file.header[H_COUNT])
+        if count - int(gallery_file.header[H_LIVE]) > max(MIN_CAPACITY, count // 4):
+            self._republish()
+
+    def _remove_stale_files(self, keep: Optional[str]):
+        """Supprimer les générations et fichiers temporaires d'un écrivain précédent"""
+        for name in os.listdir(self.directory):
+            if name.startswith(GENERATION_PREFIX) and name != keep or name.endswith(".tmp"):
+                self._unlink(self._path(name))
+
+    @staticmethod
+    def _unlink(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
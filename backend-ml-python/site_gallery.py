@@ -0,0 +1,393 @@
+"""
+Galerie partitionnée par site pour TwoInOne ML Backend
+Une galerie par site (locataire), recherche dans le site de la borne avec repli global
+"""
+
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import get_app_settings
+from gallery import ENCODING_DIM
+from metrics import record_site_search
+
+logger = logging.getLogger(__name__)
+
+# Capacité initiale de la galerie d'un site (agrandie par doublement)
+SITE_INITIAL_CAPACITY = 64
+
+
+class SiteFaceGallery:
+    """
+    Galerie composée d'une galerie par site
+
+    Chaque site (colonne site_id de face_encodings, None pour les utilisateurs
+    sans site) a sa propre galerie, créée par `factory` avec le moteur de
+    FACE_INDEX_ENGINE. best_match_in_site ne balaie que les encodages d'un
+    site; best_match et best_matches cherchent dans tous les sites chargés.
+
+    Toutes les lignes d'un utilisateur sont dans le même site: un ajout dans un
+    autre site y déplace l'utilisateur (ses lignes précédentes sont retirées,
+    l'appelant les relit avec replace_user).
+    """
+
+    def __init__(self, factory: Callable[[], object], dim: int = ENCODING_DIM):
+        """
+        Args:
+            factory: Crée la galerie vide d'un site (FaceGallery, PrototypeFaceGallery, IVFFaceIndex)
+            dim: Dimension des encodages
+        """
+        self.dim = dim
+        self._factory = factory
+        self._lock = threading.RLock()
+        self._sites: Dict[Optional[str], object] = {}
+        self._user_sites: Dict[str, Optional[str]] = {}
+        self._loaded = False
+
+    @property
+    def is_loaded(self) -> bool:
+        """True si la galerie a été chargée depuis la base"""
+        return self._loaded
+
+    @property
+    def is_writer(self) -> bool:
+        """True: les galeries des sites sont propres à ce processus"""
+        return True
+
+    def __len__(self) -> int:
+        return sum(len(gallery) for gallery in self._galleries())
+
+    def user_count(self) -> int:
+        """Nombre d'utilisateurs distincts présents dans la galerie"""
+        return sum(gallery.user_count() for gallery in self._galleries())
+
+    def site_count(self) -> int:
+        """Nombre de sites chargés"""
+        return len(self._sites)
+
+    def has_site(self, site_id: Optional[str]) -> bool:
+        """True si des encodages du site sont chargés"""
+        return site_id in self._sites
+
+    def load_arrays(
+        self,
+        row_ids: Iterable[int],
+        user_ids: Iterable[str],
+        encodings: np.ndarray,
+        site_ids: Optional[Iterable[Optional[str]]] = None
+    ):
+        """
+        Remplacer le contenu de la galerie, réparti par site
+
+        Un utilisateur dont les lignes portent des sites différents est rangé
+        dans le site de sa ligne la plus récente.
+
+        Args:
+            row_ids: IDs des lignes dans face_encodings (croissants)
+            user_ids: user_id de chaque ligne
+            encodings: Matrice (N x 128) des encodages
+            site_ids: Site de chaque ligne (None: tout dans la partition sans site)
+        """
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        user_ids = list(user_ids)
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        count = len(user_ids)
+
+        site_ids = [None] * count if site_ids is None else list(site_ids)
+        # Dernière ligne de chaque utilisateur (ids croissants): son site fait foi
+        user_sites = dict(zip(user_ids, site_ids))
+        row_sites = list(map(user_sites.__getitem__, user_ids))
+
+        codes = {site_id: code for code, site_id in enumerate(dict.fromkeys(row_sites))}
+        row_codes = np.fromiter(map(codes.__getitem__, row_sites), dtype=np.int32, count=count)
+        order = np.argsort(row_codes, kind="stable")
+        bounds = np.searchsorted(row_codes[order], np.arange(len(codes) + 1))
+        names = np.asarray(user_ids, dtype=object)
+
+        sites = {}
+        for site_id, code in codes.items():
+            rows = order[bounds[code]:bounds[code + 1]]
+            gallery = self._factory()
+            gallery.load_arrays(row_ids[rows], names[rows].tolist(), encodings[rows])
+            sites[site_id] = gallery
+
+        with self._lock:
+            self._sites = sites
+            self._user_sites = user_sites
+            self._loaded = True
+
+        logger.info(f"Galerie par site chargée: {count} encodage(s), {len(sites)} site(s)")
+
+    def add(
+        self,
+        row_id: int,
+        user_id: str,
+        encoding: Iterable[float],
+        max_per_user: Optional[int] = None,
+        site_id: Optional[str] = None
+    ):
+        """
+        Ajouter un encodage dans la galerie d'un site
+
+        Args:
+            row_id: ID de la ligne dans face_encodings
+            user_id: ID de l'utilisateur
+            encoding: Encodage facial (128 floats)
+            max_per_user: Nombre maximum d'encodages conservés pour cet utilisateur
+            site_id: Site de l'utilisateur
+        """
+        with self._lock:
+            previous = self._user_sites.get(user_id, site_id)
+            if previous != site_id:
+                self._remove_from_site(previous, user_id)
+
+            gallery = self._sites.get(site_id)
+            if gallery is None:
+                gallery = self._sites[site_id] = self._factory()
+            gallery.add(row_id, user_id, encoding, max_per_user)
+            self._user_sites[user_id] = site_id
+
+    def remove_user(self, user_id: str) -> int:
+        """
+        Retirer tous les encodages d'un utilisateur
+
+        Returns:
+            Nombre d'encodages retirés
+        """
+        with self._lock:
+            site_id = self._user_sites.pop(user_id, None)
+            if site_id not in self._sites:
+                return 0
+            return self._remove_from_site(site_id, user_id)
+
+    def replace_user(
+        self,
+        user_id: str,
+        row_ids: Iterable[int],
+        encodings: Iterable[Iterable[float]],
+        site_id: Optional[str] = None
+    ):
+        """
+        Remplacer tous les encodages d'un utilisateur (resynchronisation depuis la base)
+
+        Args:
+            user_id: ID de l'utilisateur
+            row_ids: IDs des lignes de l'utilisateur dans face_encodings
+            encodings: Encodages correspondants
+            site_id: Site de l'utilisateur
+        """
+        with self._lock:
+            self.remove_user(user_id)
+            for row_id, encoding in zip(row_ids, encodings):
+                self.add(row_id, user_id, encoding, site_id=site_id)
+
+    def export_arrays(self) -> Tuple[np.ndarray, List[str], np.ndarray]:
+        """
+        Contenu de la galerie sous la forme acceptée par load_arrays (sans les sites)
+
+        Returns:
+            Tuple (ids, user_ids, encodages), copiés et triés par id
+        """
+        row_ids, user_ids, encodings, _ = self.export_site_arrays()
+        return row_ids, user_ids, encodings
+
+    def export_site_arrays(self) -> Tuple[np.ndarray, List[str], np.ndarray, List[Optional[str]]]:
+        """
+        Contenu de la galerie avec le site de chaque ligne (instantané de démarrage)
+
+        Returns:
+            Tuple (ids, user_ids, encodages, sites), copiés et triés par id
+        """
+        with self._lock:
+            exports = [
+                (site_id, gallery.export_arrays())
+                for site_id, gallery in self._sites.items()
+            ]
+
+        if not exports:
+            return np.empty(0, dtype=np.int64), [], np.empty((0, self.dim), dtype=np.float32), []
+
+        row_ids = np.concatenate([export[0] for _, export in exports])
+        order = np.argsort(row_ids, kind="stable")
+        user_ids = [user_id for _, export in exports for user_id in export[1]]
+        site_ids = [site_id for site_id, export in exports for _ in range(len(export[0]))]
+        encodings = np.concatenate([export[2] for _, export in exports])
+        return (
+            row_ids[order],
+            [user_ids[i] for i in order.tolist()],
+            encodings[order],
+            [site_ids[i] for i in order.tolist()],
+        )
+
+    def version(self) -> Tuple[int, int, int]:
+        """Signature du contenu: (nombre de lignes, id max, somme des ids), tous sites confondus"""
+        versions = [gallery.version() for gallery in self._galleries()]
+        return (
+            sum(version[0] for version in versions),
+            max((version[1] for version in versions), default=0),
+            sum(version[2] for version in versions),
+        )
+
+    def best_match(self, probe: Iterable[float]) -> Tuple[Optional[str], float]:
+        """
+        Trouver l'encodage le plus proche dans tous les sites chargés
+
+        Returns:
+            Tuple (user_id, distance euclidienne), (None, inf) si la galerie est vide
+        """
+        best: Tuple[Optional[str], float] = (None, float("inf"))
+        for gallery in self._galleries():
+            match = gallery.best_match(probe)
+            if match[1] < best[1]:
+                best = match
+        return best
+
+    def best_matches(self, probes: np.ndarray) -> List[Tuple[Optional[str], float]]:
+        """
+        Trouver le meilleur candidat de chaque encodage dans tous les sites chargés
+
+        Returns:
+            Liste de M tuples (user_id, distance euclidienne)
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        best: List[Tuple[Optional[str], float]] = [(None, float("inf"))] * len(probes)
+        for gallery in self._galleries():
+            best = [
+                match if match[1] < current[1] else current
+                for current, match in zip(best, gallery.best_matches(probes))
+            ]
+        return best
+
+    def best_match_in_site(
+        self,
+        probe: Iterable[float],
+        site_id: Optional[str]
+    ) -> Tuple[Optional[str], float]:
+        """
+        Trouver l'encodage le plus proche parmi les utilisateurs d'un site
+
+        Returns:
+            Tuple (user_id, distance euclidienne), (None, inf) si le site n'est pas chargé
+        """
+        gallery = self._sites.get(site_id)
+        if gallery is None:
+            return None, float("inf")
+        return gallery.best_match(probe)
+
+    def best_matches_in_site(
+        self,
+        probes: np.ndarray,
+        site_id: Optional[str]
+    ) -> List[Tuple[Optional[str], float]]:
+        """Meilleur candidat de chaque encodage parmi les utilisateurs d'un site"""
+        gallery = self._sites.get(site_id)
+        if gallery is None:
+            return [(None, float("inf"))] * len(probes)
+        return gallery.best_matches(probes)
+
+    def user_encodings(self, user_id: str) -> np.ndarray:
+        """Encodages (copie) d'un utilisateur, du plus ancien au plus récent"""
+        gallery = self._sites.get(self._user_sites.get(user_id))
+        if gallery is None:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return gallery.user_encodings(user_id)
+
+    def _galleries(self) -> List[object]:
+        """Galeries des sites (liste copiée: parcours sans verrou)"""
+        with self._lock:
+            return list(self._sites.values())
+
+    def _remove_from_site(self, site_id: Optional[str], user_id: str) -> int:
+        """Retirer un utilisateur de la galerie d'un site, supprimée si vide (appelé sous verrou)"""
+        gallery = self._sites.get(site_id)
+        if gallery is None:
+            return 0
+        removed = gallery.remove_user(user_id)
+        if len(gallery) == 0:
+            del self._sites[site_id]
+        return removed
+
+
+def site_id_error(site_id: Optional[str]) -> Optional[str]:
+    """Raison du rejet d'un site_id (colonne VARCHAR(255), format texte de COPY), ou None"""
+    if site_id is None:
+        return None
+    if not site_id or len(site_id) > 255:
+        return "site_id vide ou trop long (255 caractères max)"
+    if any(char in site_id for char in "\t\n\r\\"):
+        return "site_id contient un caractère interdit"
+    return None
+
+
+def _use_site(gallery, site_id: Optional[str]) -> bool:
+    """True si la recherche doit commencer par le site demandé"""
+    return site_id is not None and isinstance(gallery, SiteFaceGallery)
+
+
+def best_match_for_site(
+    gallery,
+    probe: Iterable[float],
+    site_id: Optional[str]
+) -> Tuple[Optional[str], float]:
+    """
+    Chercher un visage dans le site de la borne, puis dans tous les sites chargés
+
+    La recherche globale n'a lieu que si le site ne reconnaît pas le visage
+    (distance au-dessus de FACE_RECOGNITION_THRESHOLD) et que
+    FACE_SITE_FALLBACK_GLOBAL est activé. Sans partition par site (ou sans
+    site_id), toute la galerie est balayée.
+
+    Args:
+        gallery: Galerie en mémoire
+        probe: Encodage facial à comparer
+        site_id: Site de la borne (None: recherche globale)
+
+    Returns:
+        Tuple (user_id, distance euclidienne)
+    """
+    if not _use_site(gallery, site_id):
+        return gallery.best_match(probe)
+
+    settings = get_app_settings()
+    match = gallery.best_match_in_site(probe, site_id)
+    if match[1] < settings.FACE_RECOGNITION_THRESHOLD or not settings.FACE_SITE_FALLBACK_GLOBAL:
+        record_site_search("site")
+        return match
+
+    record_site_search("fallback")
+    return gallery.best_match(probe)
+
+
+def best_matches_for_site(
+    gallery,
+    probes: np.ndarray,
+    site_id: Optional[str]
+) -> List[Tuple[Optional[str], float]]:
+    """
+    Version par lot de best_match_for_site: seuls les visages non reconnus dans
+    le site sont recherchés dans tous les sites chargés
+
+    Returns:
+        Liste de M tuples (user_id, distance euclidienne)
+    """
+    if not _use_site(gallery, site_id):
+        return gallery.best_matches(probes)
+
+    settings = get_app_settings()
+    matches = gallery.best_matches_in_site(probes, site_id)
+    missed = [
+        index for index, (_, distance) in enumerate(matches)
+        if distance >= settings.FACE_RECOGNITION_THRESHOLD
+    ]
+    if not settings.FACE_SITE_FALLBACK_GLOBAL:
+        missed = []
+
+    record_site_search("site", len(matches) - len(missed))
+    if missed:
+        record_site_search("fallback", len(missed))
+        fallback = gallery.best_matches(np.asarray(probes)[missed])
+        for index, match in zip(missed, fallback):
+            matches[index] = match
+    return matches
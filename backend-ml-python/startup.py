@@ -0,0 +1,182 @@
+"""
+Démarrage et disponibilité pour TwoInOne ML Backend
+Initialisation en arrière-plan, chauffe du pipeline et sonde de disponibilité
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import get_app_settings
+from database import init_db_pool, load_face_gallery
+from face_pipeline import init_face_pipeline, warm_up_face_pipeline
+from gallery_sync import start_gallery_sync
+from metrics import record_startup_phase
+from migrate import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+# Composants attendus avant d'accepter du trafic
+COMPONENTS = ("database", "schema", "gallery", "pipeline")
+
+# Attente maximale entre deux tentatives d'une étape du démarrage (secondes)
+_MAX_RETRY_DELAY = 60.0
+
+# État global du démarrage (un par worker)
+_timings: Dict[str, float] = {}
+_ready: Dict[str, bool] = {component: False for component in COMPONENTS}
+_errors: Dict[str, str] = {}
+_startup_task: Optional[asyncio.Task] = None
+
+
+def record_timing(phase: str, seconds: float):
+    """Enregistrer la durée d'une phase du démarrage (logs, /ml/ready, métriques)"""
+    _timings[phase] = round(seconds, 4)
+    record_startup_phase(phase, seconds)
+
+
+async def _timed(phase: str, func: Callable[[], Awaitable[Any]]) -> Any:
+    start = time.perf_counter()
+    try:
+        return await func()
+    finally:
+        record_timing(phase, time.perf_counter() - start)
+
+
+async def _prepare_database():
+    """Pool, schéma puis galerie en mémoire (chacun dépend du précédent)"""
+    loop = asyncio.get_running_loop()
+
+    # La connexion initiale au pool est bloquante
+    await _timed("db_pool", lambda: loop.run_in_executor(None, init_db_pool))
+    _ready["database"] = True
+
+    await _timed("schema", ensure_schema)
+    _ready["schema"] = True
+
+    gallery_size = await _timed("gallery", load_face_gallery)
+    logger.info(f"✅ Galerie faciale chargée: {gallery_size} encodage(s)")
+    await start_gallery_sync()
+    _ready["gallery"] = True
+
+
+async def _prepare_pipeline():
+    """Démarrer le pool et charger les modèles dlib sur l'image de chauffe"""
+    init_face_pipeline()
+    await _timed("pipeline_warmup", warm_up_face_pipeline)
+    _ready["pipeline"] = True
+
+
+async def _with_retries(name: str, func: Callable[[], Awaitable[Any]]):
+    """
+    Exécuter une étape du démarrage, retentée avec une attente croissante
+
+    Une base indisponible quelques secondes au boot (redémarrage conjoint des
+    conteneurs) ne laisse donc pas le worker définitivement en échec. Chaque
+    étape est idempotente: une nouvelle tentative reprend ce qui a échoué.
+
+    Raises:
+        Exception: La dernière erreur, après STARTUP_RETRY_ATTEMPTS tentatives
+    """
+    settings = get_app_settings()
+    delay = settings.STARTUP_RETRY_DELAY
+
+    for attempt in range(1, settings.STARTUP_RETRY_ATTEMPTS + 1):
+        try:
+            await func()
+            _errors.pop(name, None)
+            return
+        except Exception as e:
+            _errors[name] = str(e)
+            if attempt == settings.STARTUP_RETRY_ATTEMPTS:
+                raise
+            logger.warning(
+                f"⚠️ Erreur au démarrage ({name}, tentative {attempt}/"
+                f"{settings.STARTUP_RETRY_ATTEMPTS}): {e}; nouvelle tentative dans {delay:g}s"
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _MAX_RETRY_DELAY)
+
+
+async def _run_startup():
+    start = time.perf_counter()
+
+    # Base de données et chauffe du pipeline en parallèle (E/S contre CPU du pool)
+    results = await asyncio.gather(
+        _with_retries("database", _prepare_database),
+        _with_retries("pipeline", _prepare_pipeline),
+        return_exceptions=True
+    )
+    record_timing("startup", time.perf_counter() - start)
+
+    for name, result in zip(("database", "pipeline"), results):
+        if isinstance(result, Exception):
+            logger.error(f"❌ Erreur au démarrage ({name}): {result}")
+
+    if is_ready():
+        logger.info(f"✅ Application prête en {_timings['startup']:.2f}s ({_timings})")
+    elif get_app_settings().ENVIRONMENT == "production":
+        # Échec franc en production: le processus s'arrête et l'orchestrateur
+        # le redémarre (restart: unless-stopped), au lieu d'un worker vivant
+        # mais jamais prêt
+        logger.critical("❌ Démarrage impossible: arrêt du worker")
+        os.kill(os.getpid(), signal.SIGTERM)
+    else:
+        logger.error("❌ Application non prête: /ml/ready restera en échec")
+
+
+def start_background_startup():
+    """
+    Lancer l'initialisation en tâche de fond
+
+    Le serveur répond immédiatement à la sonde de vie (/); /ml/ready passe
+    au vert quand la base, le schéma, la galerie et le pipeline sont prêts.
+    """
+    global _startup_task
+
+    if _startup_task is None:
+        _startup_task = asyncio.create_task(_run_startup())
+
+
+async def stop_background_startup():
+    """Annuler l'initialisation si elle est encore en cours (arrêt du serveur)"""
+    global _startup_task
+
+    if _startup_task is not None and not _startup_task.done():
+        _startup_task.cancel()
+        try:
+            await _startup_task
+        except asyncio.CancelledError:
+            pass
+    _startup_task = None
+
+
+def is_ready() -> bool:
+    """Tous les composants sont-ils prêts?"""
+    return all(_ready.values())
+
+
+def readiness_report() -> Dict[str, Any]:
+    """
+    État détaillé pour /ml/ready
+
+    Returns:
+        Dict avec status (ready/starting/failed), components, timings et errors
+    """
+    if is_ready():
+        status = "ready"
+    elif _errors and (_startup_task is None or _startup_task.done()):
+        status = "failed"
+    else:
+        status = "starting"
+
+    return {
+        "status": status,
+        "environment": get_app_settings().ENVIRONMENT,
+        "components": dict(_ready),
+        "timings": dict(_timings),
+        "errors": dict(_errors),
+    }
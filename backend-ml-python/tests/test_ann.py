@@ -0,0 +1,173 @@
+"""
+Tests de l'index IVF: k-means, repartitionnement et journal des modifications
+"""
+
+import threading
+
+import numpy as np
+import pytest
+
+import ann
+from ann import IVFFaceIndex, assign_to_centroids, train_kmeans
+from conftest import brute_force, random_encodings
+from gallery import ENCODING_DIM
+
+
+def _contents(index: IVFFaceIndex):
+    row_ids, user_ids, encodings = index.export_arrays()
+    return row_ids.tolist(), user_ids, encodings
+
+
+def test_assign_to_centroids_picks_nearest(rng):
+    data = random_encodings(rng, 300)
+    centroids = random_encodings(rng, 7)
+
+    expected = np.argmin(
+        np.linalg.norm(data[:, None, :] - centroids[None, :, :], axis=2), axis=1
+    )
+    np.testing.assert_array_equal(assign_to_centroids(data, centroids), expected)
+
+
+def test_train_kmeans_shapes_and_mean(rng):
+    data = random_encodings(rng, 200)
+
+    centroids = train_kmeans(data, 4)
+    assert centroids.shape == (4, ENCODING_DIM) and centroids.dtype == np.float32
+    np.testing.assert_array_equal(centroids, train_kmeans(data, 4))
+    # Une seule partition (échantillon = toutes les lignes): la moyenne;
+    # jamais plus de partitions que de points
+    np.testing.assert_allclose(train_kmeans(data[:50], 1)[0], data[:50].mean(axis=0), atol=1e-6)
+    assert train_kmeans(data[:3], 8).shape == (3, ENCODING_DIM)
+
+
+def test_small_index_uses_single_partition(rng):
+    index = IVFFaceIndex(nlist=8, nprobe=1, min_train_size=1000)
+    encodings = random_encodings(rng, 50)
+    index.load_arrays(np.arange(1, 51), [f"u{i}" for i in range(50)], encodings)
+
+    assert len(index._lists) == 1
+    probe = random_encodings(rng, 1)[0]
+    expected = brute_force(np.arange(1, 51), [f"u{i}" for i in range(50)], encodings, probe)
+    match = index.best_match(probe)
+    assert match[0] == expected[0]
+    assert match[1] == pytest.approx(expected[1], rel=1e-4)
+
+
+def test_load_replays_changes_made_during_training(rng, monkeypatch):
+    index = IVFFaceIndex(nlist=4, nprobe=4, min_train_size=16)
+    encodings = random_encodings(rng, 40)
+    index.load_arrays(np.arange(1, 41), [f"u{i % 10}" for i in range(40)], encodings)
+
+    # Rechargement: la table lue contient déjà la ligne 41 (ajoutée pendant la
+    # lecture); pendant l'entraînement, u1 est supprimé puis réenrôlé (ligne 42)
+    added = random_encodings(rng, 2)
+    train = index._train
+
+    def train_with_concurrent_changes(row_ids, user_ids, encodings):
+        index.add(41, "u0", added[0], max_per_user=5)
+        index.remove_user("u1")
+        index.add(42, "u1", added[1], max_per_user=5)
+        # Les recherches pendant l'entraînement voient déjà ces modifications
+        assert index.user_encodings("u1").shape == (1, ENCODING_DIM)
+        return train(row_ids, user_ids, encodings)
+
+    monkeypatch.setattr(index, "_train", train_with_concurrent_changes)
+    table_ids = np.arange(1, 42)
+    table_users = [f"u{i % 10}" for i in range(40)] + ["u0"]
+    index.load_arrays(table_ids, table_users, np.concatenate([encodings, added[:1]]))
+
+    row_ids, user_ids, _ = _contents(index)
+    expected = {
+        row_id: user_id for row_id, user_id in zip(table_ids.tolist(), table_users)
+        if user_id != "u1"
+    }
+    expected[42] = "u1"
+    assert dict(zip(row_ids, user_ids)) == expected
+    assert len(index) == len(expected)
+    assert index._journal is None
+    np.testing.assert_allclose(index.user_encodings("u1"), added[1:])
+
+
+def test_stale_load_is_discarded(rng, monkeypatch):
+    index = IVFFaceIndex(nlist=2, nprobe=2, min_train_size=4)
+    first = random_encodings(rng, 8)
+    second = random_encodings(rng, 8)
+    train = index._train
+
+    def train_then_reload(row_ids, user_ids, encodings):
+        # Un second rechargement démarre et se termine pendant l'entraînement du premier
+        monkeypatch.setattr(index, "_train", train)
+        index.load_arrays(np.arange(101, 109), ["b"] * 8, second)
+        return train(row_ids, user_ids, encodings)
+
+    monkeypatch.setattr(index, "_train", train_then_reload)
+    index.load_arrays(np.arange(1, 9), ["a"] * 8, first)
+
+    row_ids, user_ids, _ = _contents(index)
+    assert row_ids == list(range(101, 109))
+    assert set(user_ids) == {"b"}
+
+
+def test_background_retrain_keeps_every_change(rng, monkeypatch):
+    index = IVFFaceIndex(nlist=0, nprobe=64, min_train_size=32)
+    index.load_arrays([], [], np.empty((0, ENCODING_DIM), dtype=np.float32))
+
+    started = threading.Event()
+    release = threading.Event()
+    train = index._train
+
+    def slow_train(row_ids, user_ids, encodings):
+        started.set()
+        assert release.wait(timeout=30)
+        return train(row_ids, user_ids, encodings)
+
+    monkeypatch.setattr(index, "_train", slow_train)
+    encodings = random_encodings(rng, 80)
+    # La 32e ligne déclenche le repartitionnement en arrière-plan
+    for row_id in range(1, 33):
+        index.add(row_id, f"u{row_id % 16}", encodings[row_id - 1], max_per_user=3)
+    assert started.wait(timeout=30)
+
+    # Modifications pendant l'entraînement: journalisées puis rejouées
+    for row_id in range(33, 81):
+        index.add(row_id, f"u{row_id % 12}", encodings[row_id - 1], max_per_user=3)
+    index.remove_user("u5")
+    release.set()
+    for thread in threading.enumerate():
+        if thread.name == "ivf-retrain":
+            thread.join(timeout=30)
+
+    assert index._journal is None
+    assert len(index._lists) > 1
+    expected = {}
+    for row_id in range(1, 81):
+        user_id = f"u{row_id % 16}" if row_id <= 32 else f"u{row_id % 12}"
+        expected.setdefault(user_id, []).append(row_id)
+    expected = {user_id: rows[-3:] for user_id, rows in expected.items() if user_id != "u5"}
+
+    row_ids, user_ids, stored = _contents(index)
+    found = {}
+    for row_id, user_id in zip(row_ids, user_ids):
+        found.setdefault(user_id, []).append(row_id)
+    assert found == expected
+    np.testing.assert_allclose(stored, encodings[np.array(row_ids) - 1])
+
+
+def test_failed_retrain_closes_journal(rng, monkeypatch):
+    index = IVFFaceIndex(nlist=2, nprobe=2, min_train_size=8)
+    index.load_arrays([], [], np.empty((0, ENCODING_DIM), dtype=np.float32))
+
+    def failing_train(row_ids, user_ids, encodings):
+        raise MemoryError("k-means")
+
+    monkeypatch.setattr(index, "_train", failing_train)
+    monkeypatch.setattr(ann.logger, "error", lambda message: None)
+    for row_id, encoding in enumerate(random_encodings(rng, 8), start=1):
+        index.add(row_id, "u", encoding)
+    for thread in threading.enumerate():
+        if thread.name == "ivf-retrain":
+            thread.join(timeout=30)
+
+    # L'ancien index reste en service, sans journal qui grossirait indéfiniment
+    assert index._journal is None
+    assert len(index) == 8
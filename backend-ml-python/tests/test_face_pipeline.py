@@ -0,0 +1,148 @@
+"""
+Tests de l'admission dans la file du pipeline (sans modèles: analyse simulée)
+"""
+
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+import face_pipeline
+from face_pipeline import FaceAnalysis, PipelineBusyError
+
+
+@pytest.fixture
+def pipeline(app_settings, monkeypatch):
+    """Pipeline en mode thread, file de 8 images, analyse simulée"""
+    app_settings(
+        FACE_PIPELINE_WORKERS=0,
+        FACE_PIPELINE_MAX_QUEUE=8,
+        FACE_BATCH_MAX_IMAGES=8,
+        FACE_BULK_BATCH_SIZE=8,
+        FACE_PIPELINE_QUEUE_TIMEOUT=0.5,
+        FACE_ANALYSIS_CACHE_SIZE=0,
+    )
+    monkeypatch.setattr(face_pipeline, "_pending", 0)
+    monkeypatch.setattr(face_pipeline, "_waiters", face_pipeline.deque())
+
+    def analyze_image(contents, options):
+        if contents == b"bad":
+            raise ValueError("image illisible")
+        return FaceAnalysis([(0, 10, 10, 0)], np.full(128, len(contents), dtype=np.float32))
+
+    monkeypatch.setattr(face_pipeline, "analyze_image", analyze_image)
+    yield face_pipeline
+    face_pipeline.close_face_pipeline()
+
+
+def test_batch_results_follow_input_order(pipeline):
+    contents = [b"a", b"bad", b"ccc", b"dd"]
+    analyses = asyncio.run(pipeline.run_face_pipeline_batch(contents))
+
+    assert isinstance(analyses[1], ValueError)
+    assert [analyses[i].encoding[0] for i in (0, 2, 3)] == [1, 3, 2]
+    assert pipeline.pending_count() == 0
+
+
+def test_full_queue_waits_in_arrival_order(pipeline):
+    order = []
+
+    async def hold(name, count, seconds):
+        await pipeline._acquire(count)
+        order.append(name)
+        await asyncio.sleep(seconds)
+        pipeline._release(count)
+
+    async def run():
+        tasks = [asyncio.ensure_future(hold(f"s{i}", 1, 0.05)) for i in range(6)]
+        await asyncio.sleep(0.01)
+        # Le lot ne tient pas: il attend, et les images isolées arrivées
+        # ensuite passent après lui même s'il reste de la place pour elles
+        tasks.append(asyncio.ensure_future(hold("batch", 6, 0.01)))
+        await asyncio.sleep(0.01)
+        tasks += [asyncio.ensure_future(hold(f"late{i}", 1, 0.01)) for i in range(2)]
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order.index("batch") == 6
+    assert order[7:] == ["late0", "late1"]
+    assert pipeline.pending_count() == 0
+    assert not pipeline._waiters
+
+
+def test_admission_times_out(pipeline, app_settings):
+    async def run():
+        await pipeline._acquire(8)
+        try:
+            with pytest.raises(PipelineBusyError):
+                await pipeline._acquire(1)
+        finally:
+            pipeline._release(8)
+
+    asyncio.run(run())
+    assert pipeline.pending_count() == 0
+    assert not pipeline._waiters
+
+
+def test_zero_timeout_refuses_immediately(pipeline, app_settings):
+    app_settings(
+        FACE_PIPELINE_MAX_QUEUE=8,
+        FACE_BATCH_MAX_IMAGES=8,
+        FACE_BULK_BATCH_SIZE=8,
+        FACE_PIPELINE_QUEUE_TIMEOUT=0,
+    )
+
+    async def run():
+        await pipeline._acquire(8)
+        with pytest.raises(PipelineBusyError):
+            await pipeline._acquire(1)
+        pipeline._release(8)
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_gives_way(pipeline):
+    async def run():
+        await pipeline._acquire(6)
+        blocked = asyncio.ensure_future(pipeline._acquire(4))
+        behind = asyncio.ensure_future(pipeline._acquire(2))
+        await asyncio.sleep(0.01)
+        assert not behind.done()
+
+        # Le lot abandonné ne bloque plus la demande suivante
+        blocked.cancel()
+        await asyncio.wait_for(behind, timeout=1)
+        pipeline._release(8)
+
+    asyncio.run(run())
+    assert pipeline.pending_count() == 0
+    assert not pipeline._waiters
+
+
+def test_batch_waits_for_running_images(pipeline, monkeypatch):
+    release = threading.Event()
+    analyze_image = pipeline.analyze_image
+
+    def slow_analyze(contents, options):
+        if contents == b"slow":
+            release.wait(timeout=5)
+        return analyze_image(contents, options)
+
+    monkeypatch.setattr(pipeline, "analyze_image", slow_analyze)
+    monkeypatch.setattr(pipeline, "_executor", face_pipeline.ThreadPoolExecutor(max_workers=8))
+
+    async def run():
+        running = asyncio.ensure_future(pipeline.run_face_pipeline_batch([b"slow"] * 4))
+        await asyncio.sleep(0.01)
+        batch = asyncio.ensure_future(pipeline.run_face_pipeline_batch([b"x"] * 6))
+        await asyncio.sleep(0.05)
+        # 4 + 6 > 8: le lot attend une place au lieu d'être refusé
+        assert not batch.done()
+        release.set()
+        return await running, await batch
+
+    running, batch = asyncio.run(run())
+    assert len(running) == 4 and len(batch) == 6
+    assert all(isinstance(analysis, FaceAnalysis) for analysis in running + batch)
+    assert pipeline.pending_count() == 0
@@ -0,0 +1,337 @@
+"""
+Tests des moteurs de recherche 1:N de la galerie
+Chaque moteur est comparé à une recherche exhaustive par np.linalg.norm
+"""
+
+import threading
+
+import numpy as np
+import pytest
+
+from ann import IVFFaceIndex
+from conftest import brute_force, random_encodings
+from gallery import ENCODING_DIM, FaceGallery, _MIN_DROPPED_ROWS
+from prototype import PrototypeFaceGallery
+from shared_gallery import SharedFaceGallery
+
+USERS = 40
+ROWS_PER_USER = 5
+
+
+def _shared_gallery(directory: str) -> SharedFaceGallery:
+    gallery = SharedFaceGallery(directory)
+    assert gallery.try_become_writer()
+    return gallery
+
+
+# Moteurs dont le résultat doit être celui de la recherche exhaustive
+EXACT_ENGINES = {
+    "exact": lambda tmp_path: FaceGallery(initial_capacity=16),
+    "shared": lambda tmp_path: _shared_gallery(str(tmp_path / "shared")),
+    # nprobe = nlist: toutes les partitions sont examinées
+    "ivf": lambda tmp_path: IVFFaceIndex(nlist=8, nprobe=8, min_train_size=64),
+}
+
+# Moteurs qui peuvent manquer un candidat lointain, mais retournent des distances exactes
+APPROXIMATE_ENGINES = {
+    "prototype": lambda tmp_path: PrototypeFaceGallery(candidates=4, initial_capacity=16),
+    "ivf_nprobe": lambda tmp_path: IVFFaceIndex(nlist=8, nprobe=2, min_train_size=64),
+}
+
+ALL_ENGINES = {**EXACT_ENGINES, **APPROXIMATE_ENGINES}
+
+
+class ReferenceGallery:
+    """Contenu attendu d'une galerie: id -> (user_id, encodage)"""
+
+    def __init__(self):
+        self.rows = {}
+
+    def load(self, row_ids, user_ids, encodings):
+        self.rows = {
+            int(row_id): (user_id, encoding)
+            for row_id, user_id, encoding in zip(row_ids, user_ids, encodings)
+        }
+
+    def add(self, row_id, user_id, encoding, max_per_user=None):
+        if max_per_user is not None:
+            self.trim(user_id, max_per_user - 1)
+        self.rows[row_id] = (user_id, np.asarray(encoding, dtype=np.float32))
+
+    def trim(self, user_id, keep):
+        user_rows = sorted(row_id for row_id, (user, _) in self.rows.items() if user == user_id)
+        removed = user_rows[:max(0, len(user_rows) - keep)]
+        for row_id in removed:
+            del self.rows[row_id]
+        return len(removed)
+
+    def arrays(self):
+        row_ids = np.array(sorted(self.rows), dtype=np.int64)
+        user_ids = [self.rows[row_id][0] for row_id in row_ids.tolist()]
+        encodings = np.array(
+            [self.rows[row_id][1] for row_id in row_ids.tolist()], dtype=np.float32
+        ).reshape(-1, ENCODING_DIM)
+        return row_ids, user_ids, encodings
+
+    def best_match(self, probe):
+        return brute_force(*self.arrays(), probe)
+
+
+def _clustered_rows(rng, users=USERS, rows_per_user=ROWS_PER_USER, first_id=1):
+    """Encodages regroupés par utilisateur (plusieurs photos d'un même visage)"""
+    centers = random_encodings(rng, users)
+    row_ids, user_ids, encodings = [], [], []
+    row_id = first_id
+    for rank in range(rows_per_user):
+        for user in range(users):
+            row_ids.append(row_id)
+            user_ids.append(f"user-{user}")
+            encodings.append(centers[user] + rng.standard_normal(ENCODING_DIM) * 0.005)
+            row_id += 1
+    return (
+        np.array(row_ids, dtype=np.int64),
+        user_ids,
+        np.array(encodings, dtype=np.float32),
+        centers,
+    )
+
+
+def _near_probes(rng, centers, count=30):
+    """Encodages proches du visage d'un utilisateur enregistré"""
+    users = rng.integers(0, len(centers), count)
+    return (centers[users] + rng.standard_normal((count, ENCODING_DIM)) * 0.005).astype(np.float32)
+
+
+def _assert_same_match(match, expected):
+    assert match[0] == expected[0]
+    assert match[1] == pytest.approx(expected[1], rel=1e-4, abs=1e-5)
+
+
+def _assert_exact_distance(reference, match, probe):
+    """La distance retournée est celle d'un encodage de l'utilisateur retourné"""
+    expected = reference.best_match(probe)
+    assert match[1] >= expected[1] - 1e-5
+    distances = [
+        float(np.linalg.norm(encoding - probe))
+        for user_id, encoding in reference.rows.values() if user_id == match[0]
+    ]
+    assert min(distances) == pytest.approx(match[1], rel=1e-4, abs=1e-5)
+
+
+def _assert_same_content(gallery, reference):
+    row_ids, user_ids, encodings = gallery.export_arrays()
+    order = np.argsort(row_ids, kind="stable")
+    expected_ids, expected_users, expected_encodings = reference.arrays()
+    np.testing.assert_array_equal(np.asarray(row_ids)[order], expected_ids)
+    assert [user_ids[i] for i in order.tolist()] == expected_users
+    np.testing.assert_allclose(np.asarray(encodings)[order], expected_encodings, rtol=1e-6)
+    assert len(gallery) == len(reference.rows)
+    assert gallery.user_count() == len({user for user, _ in reference.rows.values()})
+
+
+def _wait_for_retrain(gallery):
+    """Attendre la fin d'un repartitionnement IVF lancé en arrière-plan"""
+    for thread in threading.enumerate():
+        if thread.name == "ivf-retrain":
+            thread.join(timeout=30)
+
+
+@pytest.mark.parametrize("engine", sorted(ALL_ENGINES))
+def test_empty_gallery(engine, tmp_path):
+    gallery = ALL_ENGINES[engine](tmp_path)
+    gallery.load_arrays([], [], np.empty((0, ENCODING_DIM), dtype=np.float32))
+
+    assert len(gallery) == 0
+    assert gallery.best_match(np.zeros(ENCODING_DIM)) == (None, float("inf"))
+    assert gallery.best_matches(np.zeros((2, ENCODING_DIM))) == [(None, float("inf"))] * 2
+
+
+@pytest.mark.parametrize("engine", sorted(EXACT_ENGINES))
+def test_exact_engines_match_brute_force(engine, tmp_path, rng):
+    gallery = EXACT_ENGINES[engine](tmp_path)
+    row_ids, user_ids, encodings, centers = _clustered_rows(rng)
+    gallery.load_arrays(row_ids, user_ids, encodings)
+
+    probes = np.concatenate([_near_probes(rng, centers), random_encodings(rng, 30)])
+    expected = [brute_force(row_ids, user_ids, encodings, probe) for probe in probes]
+
+    for probe, match in zip(probes, expected):
+        _assert_same_match(gallery.best_match(probe), match)
+    for found, match in zip(gallery.best_matches(probes), expected):
+        _assert_same_match(found, match)
+
+
+@pytest.mark.parametrize("engine", sorted(APPROXIMATE_ENGINES))
+def test_approximate_engines_find_enrolled_faces(engine, tmp_path, rng):
+    gallery = APPROXIMATE_ENGINES[engine](tmp_path)
+    row_ids, user_ids, encodings, centers = _clustered_rows(rng)
+    gallery.load_arrays(row_ids, user_ids, encodings)
+    reference = ReferenceGallery()
+    reference.load(row_ids, user_ids, encodings)
+
+    # Visage enregistré: même résultat que la recherche exhaustive
+    probes = _near_probes(rng, centers)
+    for probe, match in zip(probes, gallery.best_matches(probes)):
+        _assert_same_match(match, reference.best_match(probe))
+        _assert_same_match(gallery.best_match(probe), match)
+
+    # Visage inconnu: candidat éventuellement moins bon, distance toujours exacte
+    probes = random_encodings(rng, 30)
+    for probe, match in zip(probes, gallery.best_matches(probes)):
+        _assert_exact_distance(reference, match, probe)
+
+
+@pytest.mark.parametrize("engine", sorted(ALL_ENGINES))
+def test_add_trim_remove_follow_reference(engine, tmp_path, rng):
+    gallery = ALL_ENGINES[engine](tmp_path)
+    reference = ReferenceGallery()
+    row_ids, user_ids, encodings, centers = _clustered_rows(rng, users=20, rows_per_user=4)
+    gallery.load_arrays(row_ids, user_ids, encodings)
+    reference.load(row_ids, user_ids, encodings)
+
+    next_id = int(row_ids.max()) + 1
+    for step in range(400):
+        user = int(rng.integers(0, 30))
+        user_id = f"user-{user}"
+        action = rng.random()
+        if action < 0.7:
+            center = centers[user % len(centers)]
+            encoding = center + rng.standard_normal(ENCODING_DIM).astype(np.float32) * 0.005
+            max_per_user = 3 if action < 0.35 else None
+            gallery.add(next_id, user_id, encoding, max_per_user)
+            reference.add(next_id, user_id, encoding, max_per_user)
+            next_id += 1
+        elif action < 0.9:
+            assert gallery.remove_user(user_id) == reference.trim(user_id, 0)
+        else:
+            replacement = [next_id, next_id + 1]
+            new_encodings = random_encodings(rng, 2)
+            gallery.replace_user(user_id, replacement, new_encodings)
+            reference.trim(user_id, 0)
+            for row_id, encoding in zip(replacement, new_encodings):
+                reference.add(row_id, user_id, encoding)
+            next_id += 2
+
+    _wait_for_retrain(gallery)
+    _assert_same_content(gallery, reference)
+
+    probes = _near_probes(rng, centers)
+    for probe, match in zip(probes, gallery.best_matches(probes)):
+        if engine in EXACT_ENGINES:
+            _assert_same_match(match, reference.best_match(probe))
+        else:
+            _assert_exact_distance(reference, match, probe)
+
+
+@pytest.mark.parametrize("engine", sorted(ALL_ENGINES))
+def test_max_per_user_keeps_most_recent(engine, tmp_path, rng):
+    gallery = ALL_ENGINES[engine](tmp_path)
+    gallery.load_arrays([], [], np.empty((0, ENCODING_DIM), dtype=np.float32))
+    encodings = random_encodings(rng, 6)
+
+    for row_id, encoding in enumerate(encodings, start=1):
+        gallery.add(row_id, "alice", encoding, max_per_user=3)
+
+    assert len(gallery) == 3
+    np.testing.assert_allclose(gallery.user_encodings("alice"), encodings[3:])
+    assert gallery.version() == (3, 6, 4 + 5 + 6)
+
+
+@pytest.mark.parametrize("engine", sorted(ALL_ENGINES))
+def test_user_encodings_oldest_first(engine, tmp_path, rng):
+    gallery = ALL_ENGINES[engine](tmp_path)
+    encodings = random_encodings(rng, 4)
+    gallery.load_arrays([7, 2, 9, 4], ["bob", "alice", "bob", "alice"], encodings)
+
+    np.testing.assert_allclose(gallery.user_encodings("alice"), encodings[[1, 3]])
+    np.testing.assert_allclose(gallery.user_encodings("bob"), encodings[[0, 2]])
+    assert gallery.user_encodings("carol").shape == (0, ENCODING_DIM)
+
+
+def test_remove_marks_rows_until_compaction(rng):
+    gallery = FaceGallery(initial_capacity=16)
+    count = 200
+    encodings = random_encodings(rng, count)
+    gallery.load_arrays(np.arange(1, count + 1), [f"u{i}" for i in range(count)], encodings)
+    threshold = max(_MIN_DROPPED_ROWS, count // 4)
+
+    # Jusqu'au seuil: lignes marquées en place (norme infinie, id -1, user_id None)
+    for user in range(threshold):
+        gallery.remove_user(f"u{user}")
+    user_ids, _, sq_norms, row_ids = gallery.snapshot()
+    assert len(row_ids) == count
+    assert np.isinf(sq_norms[:threshold]).all()
+    assert (row_ids[:threshold] == -1).all()
+    assert all(user_id is None for user_id in user_ids[:threshold])
+    assert len(gallery) == count - threshold
+    assert gallery.user_count() == count - threshold
+
+    # Une ligne marquée n'est jamais retenue, même identique à l'encodage cherché
+    assert gallery.best_match(encodings[0])[0] != "u0"
+    assert gallery.best_matches(encodings[:2])[0][0] != "u0"
+
+    # Au-delà: les tableaux sont reconstruits sans les lignes marquées
+    gallery.remove_user(f"u{threshold}")
+    _, _, sq_norms, row_ids = gallery.snapshot()
+    assert len(row_ids) == count - threshold - 1
+    assert (row_ids >= 0).all() and np.isfinite(sq_norms).all()
+    match = gallery.best_match(encodings[-1])
+    assert match[0] == f"u{count - 1}"
+    assert match[1] == pytest.approx(0.0, abs=1e-3)
+
+
+def test_match_rerun_when_winning_row_is_dropped(rng, monkeypatch):
+    gallery = FaceGallery(initial_capacity=16)
+    encodings = random_encodings(rng, 3)
+    gallery.load_arrays([1, 2, 3], ["alice", "bob", "carol"], encodings)
+
+    # Suppression entre le calcul des distances et la lecture du user_id
+    snapshot = gallery.snapshot
+    calls = []
+
+    def racing_snapshot():
+        views = snapshot()
+        if not calls:
+            calls.append(True)
+            user_ids = views[0].copy()
+            user_ids[0] = None
+            return (user_ids,) + views[1:]
+        return views
+
+    monkeypatch.setattr(gallery, "snapshot", racing_snapshot)
+    gallery.remove_user("alice")
+    match = gallery.best_match(encodings[0])
+    assert match[0] in ("bob", "carol")
+    assert match[1] == pytest.approx(
+        min(np.linalg.norm(encodings[1:] - encodings[0], axis=1)), rel=1e-4
+    )
+
+    calls.clear()
+    matches = gallery.best_matches(encodings[:1])
+    assert matches[0][0] in ("bob", "carol")
+
+
+@pytest.mark.parametrize("engine", sorted(ALL_ENGINES))
+def test_export_arrays_round_trip(engine, tmp_path, rng):
+    gallery = ALL_ENGINES[engine](tmp_path)
+    row_ids, user_ids, encodings, _ = _clustered_rows(rng, users=10, rows_per_user=3)
+    gallery.load_arrays(row_ids, user_ids, encodings)
+    gallery.remove_user("user-3")
+
+    copy = FaceGallery()
+    copy.load_arrays(*gallery.export_arrays())
+    assert copy.version() == gallery.version()
+    _assert_same_content(copy, _reference_without(row_ids, user_ids, encodings, "user-3"))
+
+
+def _reference_without(row_ids, user_ids, encodings, removed_user):
+    reference = ReferenceGallery()
+    reference.load(row_ids, user_ids, encodings)
+    reference.trim(removed_user, 0)
+    return reference
+
+
+def test_encoding_dimension_is_checked():
+    gallery = FaceGallery()
+    with pytest.raises(ValueError):
+        gallery.add(1, "alice", np.zeros(64))
@@ -0,0 +1,133 @@
+"""
+Tests de l'instantané de la galerie: format de fichier et fusion avec la table
+"""
+
+import numpy as np
+import pytest
+
+from conftest import random_encodings
+from database import _merge_snapshot_rows
+from gallery import ENCODING_DIM
+from gallery_file import load_snapshot, save_snapshot, write_gallery_file
+
+
+def test_snapshot_round_trip(tmp_path, rng):
+    path = str(tmp_path / "gallery.snapshot")
+    encodings = random_encodings(rng, 5)
+    row_ids = [3, 5, 8, 13, 21]
+    user_ids = ["alice", "bob", "alice", "émile", "bob"]
+
+    save_snapshot(path, row_ids, user_ids, encodings, high_water=(21, 1_700_000_000_000_000))
+    snapshot = load_snapshot(path, ENCODING_DIM)
+
+    assert snapshot.high_water == (21, 1_700_000_000_000_000)
+    assert not snapshot.has_sites
+    loaded_ids, loaded_users, loaded_encodings = snapshot.live_rows()
+    assert loaded_ids.tolist() == row_ids
+    assert loaded_users == user_ids
+    np.testing.assert_array_equal(loaded_encodings, encodings)
+    np.testing.assert_allclose(
+        snapshot.sq_norms[:5], np.einsum("ij,ij->i", encodings, encodings), rtol=1e-6
+    )
+
+
+def test_snapshot_round_trip_with_sites(tmp_path, rng):
+    path = str(tmp_path / "gallery.snapshot")
+    site_ids = ["A", None, "B", "A"]
+
+    save_snapshot(path, [1, 2, 3, 4], ["u1", "u2", "u3", "u1"], random_encodings(rng, 4), (4, 0), site_ids)
+    snapshot = load_snapshot(path, ENCODING_DIM)
+
+    assert snapshot.has_sites
+    assert snapshot.live_sites() == site_ids
+    assert snapshot.live_rows()[1] == ["u1", "u2", "u3", "u1"]
+
+
+def test_dropped_rows_are_not_live(tmp_path, rng):
+    gallery_file = write_gallery_file(
+        str(tmp_path / "generation"), np.array([1, 2, 3]), ["a", "b", "c"], random_encodings(rng, 3)
+    )
+    gallery_file.row_ids[1] = -1
+
+    row_ids, user_ids, _ = gallery_file.live_rows()
+    assert row_ids.tolist() == [1, 3]
+    assert user_ids == ["a", "c"]
+    assert gallery_file.capacity >= 3
+
+
+def test_unusable_snapshot_is_ignored(tmp_path, rng):
+    assert load_snapshot(str(tmp_path / "missing"), ENCODING_DIM) is None
+
+    garbage = tmp_path / "garbage"
+    garbage.write_bytes(b"\0" * 8192)
+    assert load_snapshot(str(garbage), ENCODING_DIM) is None
+
+    path = str(tmp_path / "gallery.snapshot")
+    save_snapshot(path, [1], ["a"], random_encodings(rng, 1), (1, 0))
+    assert load_snapshot(path, 64) is None
+
+    # Fichier tronqué (écriture interrompue)
+    truncated = tmp_path / "truncated"
+    truncated.write_bytes(open(path, "rb").read()[:-64])
+    assert load_snapshot(str(truncated), ENCODING_DIM) is None
+
+
+def _rows(row_ids, user_ids, encodings, site_ids=None):
+    return (
+        np.asarray(row_ids, dtype=np.int64),
+        list(user_ids),
+        encodings,
+        None if site_ids is None else list(site_ids),
+    )
+
+
+@pytest.mark.parametrize("with_sites", [False, True])
+def test_merge_snapshot_with_table_changes(rng, with_sites):
+    snapshot_encodings = random_encodings(rng, 5)
+    snapshot = _rows(
+        [1, 2, 3, 4, 5], ["a", "b", "c", "d", "e"], snapshot_encodings,
+        ["S1", "S1", None, "S2", "S2"] if with_sites else None
+    )
+    # Table: 2 supprimée, 4 modifiée (relue), 6 ajoutée, 0 validée après
+    # l'écriture de l'instantané avec un id plus petit
+    table_ids = np.array([0, 1, 3, 4, 5, 6], dtype=np.int64)
+    read_encodings = random_encodings(rng, 3)
+    read = _rows([0, 4, 6], ["z", "d", "f"], read_encodings, [None, "S3", "S1"])
+
+    (row_ids, user_ids, encodings, site_ids), kept, deleted = _merge_snapshot_rows(
+        snapshot, table_ids, read
+    )
+
+    assert row_ids.tolist() == [0, 1, 3, 4, 5, 6]
+    assert user_ids == ["z", "a", "c", "d", "e", "f"]
+    np.testing.assert_array_equal(encodings, np.stack([
+        read_encodings[0], snapshot_encodings[0], snapshot_encodings[2],
+        read_encodings[1], snapshot_encodings[4], read_encodings[2],
+    ]))
+    assert kept == 3
+    assert deleted == 1
+    if with_sites:
+        assert site_ids == [None, "S1", None, "S3", "S2", "S1"]
+    else:
+        assert site_ids is None
+
+
+def test_merge_snapshot_without_changes(rng):
+    encodings = random_encodings(rng, 3)
+    snapshot = _rows([1, 2, 3], ["a", "b", "c"], encodings, ["A", "A", None])
+    nothing = _rows([], [], np.empty((0, ENCODING_DIM), dtype=np.float32), [])
+
+    (row_ids, user_ids, merged, site_ids), kept, deleted = _merge_snapshot_rows(
+        snapshot, np.array([1, 2, 3]), nothing
+    )
+    assert row_ids.tolist() == [1, 2, 3] and user_ids == ["a", "b", "c"]
+    np.testing.assert_array_equal(merged, encodings)
+    assert site_ids == ["A", "A", None]
+    assert (kept, deleted) == (3, 0)
+
+    # Toutes les lignes supprimées
+    (row_ids, user_ids, merged, _), kept, deleted = _merge_snapshot_rows(
+        snapshot, np.array([], dtype=np.int64), nothing
+    )
+    assert len(row_ids) == 0 and user_ids == [] and merged.shape == (0, ENCODING_DIM)
+    assert (kept, deleted) == (0, 3)
@@ -0,0 +1,148 @@
+"""
+Tests du regroupement des recherches 1:N (MatchBatcher)
+"""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+import match_batcher
+from conftest import random_encodings
+from gallery import FaceGallery
+from match_batcher import MatchBatcher, match_probe
+from site_gallery import SiteFaceGallery
+
+
+@pytest.fixture
+def gallery(rng) -> FaceGallery:
+    gallery = FaceGallery()
+    gallery.load_arrays(np.arange(1, 21), [f"u{i}" for i in range(20)], random_encodings(rng, 20))
+    return gallery
+
+
+class CountingGallery:
+    """Galerie qui enregistre la taille de chaque calcul par lot"""
+
+    def __init__(self, gallery: FaceGallery):
+        self.gallery = gallery
+        self.batches = []
+
+    def best_match(self, probe):
+        self.batches.append(1)
+        return self.gallery.best_match(probe)
+
+    def best_matches(self, probes):
+        self.batches.append(len(probes))
+        return self.gallery.best_matches(probes)
+
+
+def test_each_request_gets_its_own_result(gallery):
+    encodings = gallery.export_arrays()[2]
+    counting = CountingGallery(gallery)
+
+    async def run():
+        batcher = MatchBatcher(window=0.01, max_size=64)
+        # Ordre d'arrivée différent de l'ordre des lignes
+        order = [7, 3, 19, 0, 11, 3]
+        return order, await asyncio.gather(*(
+            batcher.best_match(counting, encodings[index]) for index in order
+        ))
+
+    order, results = asyncio.run(run())
+    assert [user_id for user_id, _ in results] == [f"u{index}" for index in order]
+    assert counting.batches == [len(order)]
+
+
+def test_max_size_flushes_immediately_and_overflow_forms_next_batch(gallery):
+    encodings = gallery.export_arrays()[2]
+    counting = CountingGallery(gallery)
+
+    async def run():
+        # Fenêtre longue: seul max_size peut déclencher le premier lot
+        batcher = MatchBatcher(window=10.0, max_size=4)
+        return await asyncio.wait_for(asyncio.gather(*(
+            batcher.best_match(counting, encodings[index]) for index in range(8)
+        )), timeout=5)
+
+    results = asyncio.run(run())
+    assert [user_id for user_id, _ in results] == [f"u{index}" for index in range(8)]
+    assert counting.batches == [4, 4]
+
+
+def test_window_bounds_wait_of_single_request(gallery):
+    encodings = gallery.export_arrays()[2]
+
+    async def run():
+        batcher = MatchBatcher(window=0.005, max_size=64)
+        result = await asyncio.wait_for(batcher.best_match(gallery, encodings[5]), timeout=5)
+        return result, len(batcher)
+
+    (user_id, distance), pending = asyncio.run(run())
+    assert user_id == "u5" and distance == pytest.approx(0.0, abs=1e-3)
+    assert pending == 0
+
+
+def test_error_is_raised_to_every_request_of_batch(gallery, monkeypatch):
+    class BrokenGallery:
+        def best_matches(self, probes):
+            raise RuntimeError("galerie indisponible")
+
+    monkeypatch.setattr(match_batcher.logger, "error", lambda message: None)
+
+    async def run():
+        batcher = MatchBatcher(window=0.005, max_size=64)
+        results = await asyncio.gather(
+            *(batcher.best_match(BrokenGallery(), np.zeros(128)) for _ in range(3)),
+            return_exceptions=True
+        )
+        # Le regroupeur reste utilisable après une erreur
+        after = await batcher.best_match(gallery, gallery.export_arrays()[2][2])
+        return results, after
+
+    results, after = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert after[0] == "u2"
+
+
+def test_cancelled_request_does_not_break_batch(gallery):
+    encodings = gallery.export_arrays()[2]
+
+    async def run():
+        batcher = MatchBatcher(window=0.01, max_size=64)
+        abandoned = asyncio.ensure_future(batcher.best_match(gallery, encodings[1]))
+        kept = asyncio.ensure_future(batcher.best_match(gallery, encodings[2]))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        return await kept
+
+    assert asyncio.run(run())[0] == "u2"
+
+
+def test_batch_groups_searches_by_site(rng, app_settings):
+    app_settings(FACE_RECOGNITION_THRESHOLD=0.01, FACE_SITE_FALLBACK_GLOBAL=False)
+    encodings = random_encodings(rng, 4)
+    gallery = SiteFaceGallery(lambda: FaceGallery(initial_capacity=8))
+    gallery.load_arrays([1, 2, 3, 4], ["a1", "a2", "b1", "b2"], encodings, ["A", "A", "B", "B"])
+
+    async def run():
+        batcher = MatchBatcher(window=0.01, max_size=64)
+        return await asyncio.gather(
+            batcher.best_match(gallery, encodings[2], "A"),
+            batcher.best_match(gallery, encodings[2], "B"),
+            batcher.best_match(gallery, encodings[0], None),
+            batcher.best_match(gallery, encodings[3], "B"),
+        )
+
+    results = [user_id for user_id, _ in asyncio.run(run())]
+    assert results[0] in ("a1", "a2")
+    assert results[1:] == ["b1", "a1", "b2"]
+
+
+def test_match_probe_without_batching(gallery, app_settings, monkeypatch):
+    app_settings(FACE_MATCH_BATCH_WINDOW_MS=0)
+    monkeypatch.setattr(match_batcher, "_match_batcher", None)
+    encodings = gallery.export_arrays()[2]
+
+    assert match_batcher.get_match_batcher() is None
+    assert asyncio.run(match_probe(gallery, encodings[4]))[0] == "u4"
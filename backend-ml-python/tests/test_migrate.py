@@ -0,0 +1,170 @@
+"""
+Tests du runner de migrations (connexion PostgreSQL simulée)
+"""
+
+import hashlib
+
+import psycopg2
+import pytest
+
+import migrate
+from migrate import MigrationError, discover_migrations, latest_version
+
+
+class FakeCursor:
+    """Curseur qui enregistre chaque instruction et le mode autocommit en cours"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._result = []
+
+    def execute(self, sql, params=None):
+        connection = self.connection
+        connection.executed.append((sql.strip(), connection.autocommit))
+        if "FAIL" in sql:
+            raise psycopg2.ProgrammingError("syntax error")
+        if sql.startswith("SELECT version, checksum FROM schema_migrations"):
+            self._result = list(connection.applied.items())
+        elif sql.startswith("INSERT INTO schema_migrations"):
+            connection.pending[params[0]] = params[2]
+        else:
+            self._result = []
+        if connection.autocommit:
+            connection.commit()
+
+    def fetchall(self):
+        return self._result
+
+
+class FakeConnection:
+    """Transactions simulées: un INSERT n'est visible qu'après commit (ou en autocommit)"""
+
+    def __init__(self, applied=None):
+        self.applied = dict(applied or {})
+        self.pending = {}
+        self.executed = []
+        self.autocommit = False
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.applied.update(self.pending)
+        self.pending = {}
+
+    def rollback(self):
+        self.pending = {}
+
+    def close(self):
+        self.closed = True
+
+
+def _write(directory, name, sql):
+    (directory / name).write_text(sql, encoding="utf-8")
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    holder = {}
+
+    def connect(dsn):
+        holder["connection"] = holder.get("connection") or FakeConnection()
+        return holder["connection"]
+
+    monkeypatch.setattr(migrate.psycopg2, "connect", connect)
+    return holder
+
+
+def test_discover_orders_versions_and_checksums(tmp_path):
+    checksum = _write(tmp_path, "010_later.sql", "SELECT 10;")
+    _write(tmp_path, "002_second.sql", "SELECT 2;")
+    _write(tmp_path, "notes.txt", "pas une migration")
+    _write(tmp_path, "003_concurrent.sql", "-- migrate: no-transaction\nCREATE INDEX CONCURRENTLY x ON t(a);\n")
+
+    migrations = discover_migrations(str(tmp_path))
+    assert [migration.version for migration in migrations] == [2, 3, 10]
+    assert migrations[2].checksum == checksum
+    assert [migration.transaction for migration in migrations] == [True, False, True]
+    assert latest_version(migrations) == 10
+    assert latest_version([]) == 0
+
+
+def test_duplicate_version_is_rejected(tmp_path):
+    _write(tmp_path, "001_a.sql", "SELECT 1;")
+    _write(tmp_path, "01_b.sql", "SELECT 1;")
+    with pytest.raises(MigrationError):
+        discover_migrations(str(tmp_path))
+
+
+def test_statements_split_on_line_ending_semicolons(tmp_path):
+    _write(tmp_path, "001_index.sql", (
+        "-- migrate: no-transaction\n"
+        "-- Après un échec: DROP INDEX CONCURRENTLY IF EXISTS x;\n"
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS x\n"
+        "ON t(a);\n"
+        "\n"
+        "COMMENT ON COLUMN t.a IS 'un; deux';\n"
+    ))
+    statements = discover_migrations(str(tmp_path))[0].statements()
+
+    assert len(statements) == 2
+    assert statements[0].endswith("CREATE INDEX CONCURRENTLY IF NOT EXISTS x\nON t(a)")
+    assert statements[1] == "COMMENT ON COLUMN t.a IS 'un; deux'"
+
+
+def test_repository_migrations_are_consistent():
+    migrations = discover_migrations()
+    assert [migration.version for migration in migrations] == list(
+        range(1, len(migrations) + 1)
+    )
+    for migration in migrations:
+        if "CONCURRENTLY" in migration.read():
+            assert not migration.transaction, migration.name
+
+
+def test_migrate_applies_pending_in_order(tmp_path, connection):
+    _write(tmp_path, "001_table.sql", "CREATE TABLE t (a int);")
+    _write(tmp_path, "002_index.sql", "-- migrate: no-transaction\nCREATE INDEX CONCURRENTLY i ON t(a);\nCOMMENT ON TABLE t IS 't';\n")
+    migrations = discover_migrations(str(tmp_path))
+
+    applied = migrate.migrate("postgresql://fake", migrations)
+    conn = connection["connection"]
+
+    assert [migration.version for migration in applied] == [1, 2]
+    assert conn.applied == {1: migrations[0].checksum, 2: migrations[1].checksum}
+    assert conn.closed
+    executed = dict(conn.executed)
+    # Migration transactionnelle: fichier entier hors autocommit
+    assert executed["CREATE TABLE t (a int);"] is False
+    # Migration hors transaction: une instruction à la fois, en autocommit
+    assert executed["-- migrate: no-transaction\nCREATE INDEX CONCURRENTLY i ON t(a)"] is True
+    assert executed["COMMENT ON TABLE t IS 't'"] is True
+    assert conn.executed[-1][0].startswith("SELECT pg_advisory_unlock")
+
+    # Deuxième passage: plus rien à appliquer
+    assert migrate.migrate("postgresql://fake", migrations) == []
+
+
+def test_modified_migration_is_reported_not_reapplied(tmp_path, connection, caplog):
+    _write(tmp_path, "001_table.sql", "CREATE TABLE t (a int);")
+    connection["connection"] = FakeConnection(applied={1: "0" * 64})
+
+    assert migrate.migrate("postgresql://fake", discover_migrations(str(tmp_path))) == []
+    assert "modifiée depuis son application" in caplog.text
+    assert not any("CREATE TABLE t " in sql for sql, _ in connection["connection"].executed)
+
+
+@pytest.mark.parametrize("header", ["", "-- migrate: no-transaction\n"])
+def test_failed_migration_is_not_recorded(tmp_path, connection, header):
+    _write(tmp_path, "001_table.sql", "CREATE TABLE t (a int);")
+    _write(tmp_path, "002_broken.sql", header + "SELECT 1;\nSELECT FAIL;\n")
+    migrations = discover_migrations(str(tmp_path))
+
+    with pytest.raises(MigrationError, match="002_broken.sql"):
+        migrate.migrate("postgresql://fake", migrations)
+
+    conn = connection["connection"]
+    assert conn.applied == {1: migrations[0].checksum}
+    assert conn.closed
@@ -0,0 +1,140 @@
+"""
+Tests de la galerie partitionnée par site et de la recherche avec repli global
+"""
+
+import numpy as np
+import pytest
+
+from ann import IVFFaceIndex
+from conftest import brute_force, random_encodings
+from gallery import ENCODING_DIM, FaceGallery
+from prototype import PrototypeFaceGallery
+from site_gallery import SiteFaceGallery, best_match_for_site, best_matches_for_site, site_id_error
+
+FACTORIES = {
+    "exact": lambda: FaceGallery(initial_capacity=8),
+    "prototype": lambda: PrototypeFaceGallery(candidates=64, initial_capacity=8),
+    "ivf": lambda: IVFFaceIndex(nlist=2, nprobe=2, min_train_size=8),
+}
+
+
+@pytest.fixture(params=sorted(FACTORIES))
+def gallery(request) -> SiteFaceGallery:
+    return SiteFaceGallery(FACTORIES[request.param])
+
+
+def _load(gallery, rng):
+    """Deux sites et des utilisateurs sans site; u3 a changé de site (dernière ligne: B)"""
+    encodings = random_encodings(rng, 8)
+    row_ids = np.arange(1, 9)
+    user_ids = ["u1", "u2", "u3", "u4", "u1", "u3", "u5", "u3"]
+    site_ids = ["A", "A", "A", "B", "A", "A", None, "B"]
+    gallery.load_arrays(row_ids, user_ids, encodings, site_ids)
+    return row_ids, user_ids, encodings
+
+
+def test_rows_follow_latest_site_of_each_user(gallery, rng):
+    _, _, encodings = _load(gallery, rng)
+
+    assert gallery.site_count() == 3
+    assert gallery.has_site("A") and gallery.has_site(None) and not gallery.has_site("C")
+    assert len(gallery) == 8
+    assert gallery.user_count() == 5
+    np.testing.assert_allclose(gallery.user_encodings("u3"), encodings[[2, 5, 7]])
+
+    row_ids, user_ids, _, site_ids = gallery.export_site_arrays()
+    assert row_ids.tolist() == list(range(1, 9))
+    assert dict(zip(user_ids, site_ids)) == {
+        "u1": "A", "u2": "A", "u3": "B", "u4": "B", "u5": None
+    }
+
+
+def test_global_search_matches_brute_force(gallery, rng):
+    row_ids, user_ids, encodings = _load(gallery, rng)
+    probes = np.concatenate([encodings, random_encodings(rng, 10)])
+
+    for probe, match in zip(probes, gallery.best_matches(probes)):
+        expected = brute_force(row_ids, user_ids, encodings, probe)
+        assert match[0] == expected[0]
+        # Distance nulle: erreur d'arrondi float32 du calcul par normes
+        assert match[1] == pytest.approx(expected[1], rel=1e-4, abs=1e-3)
+        single = gallery.best_match(probe)
+        assert single[0] == match[0]
+        assert single[1] == pytest.approx(match[1], rel=1e-4, abs=1e-3)
+
+
+def test_site_search_only_sees_site_rows(gallery, rng):
+    _, _, encodings = _load(gallery, rng)
+
+    # u4 est dans le site B: introuvable depuis A, exact depuis B
+    match = gallery.best_match_in_site(encodings[3], "A")
+    assert match[0] in ("u1", "u2")
+    assert gallery.best_match_in_site(encodings[3], "B") == ("u4", pytest.approx(0.0, abs=1e-3))
+    assert gallery.best_match_in_site(encodings[3], "C") == (None, float("inf"))
+    assert gallery.best_matches_in_site(encodings[:2], "C") == [(None, float("inf"))] * 2
+
+
+def test_add_moves_user_to_new_site(gallery, rng):
+    _load(gallery, rng)
+    encoding = random_encodings(rng, 1)[0]
+
+    gallery.add(9, "u2", encoding, site_id="B")
+    assert gallery.best_match_in_site(encoding, "B")[0] == "u2"
+    _, user_ids, _, site_ids = gallery.export_site_arrays()
+    assert [site_id for user_id, site_id in zip(user_ids, site_ids) if user_id == "u2"] == ["B"]
+    np.testing.assert_allclose(gallery.user_encodings("u2"), encoding[None, :])
+    assert len(gallery) == 8
+
+    # Dernier utilisateur d'un site retiré: le site disparaît
+    assert gallery.remove_user("u5") == 1
+    assert not gallery.has_site(None)
+    assert gallery.remove_user("u5") == 0
+
+
+def test_site_fallback_to_global_search(gallery, rng, app_settings):
+    _, _, encodings = _load(gallery, rng)
+    app_settings(FACE_RECOGNITION_THRESHOLD=0.5, FACE_SITE_FALLBACK_GLOBAL=True)
+
+    # Reconnu dans le site: pas de repli
+    assert best_match_for_site(gallery, encodings[0], "A")[0] == "u1"
+    # Non reconnu dans A: repli sur tous les sites
+    assert best_match_for_site(gallery, encodings[3], "A")[0] == "u4"
+    matches = best_matches_for_site(gallery, encodings[[0, 3, 6]], "A")
+    assert [user_id for user_id, _ in matches] == ["u1", "u4", "u5"]
+
+    app_settings(FACE_RECOGNITION_THRESHOLD=0.5, FACE_SITE_FALLBACK_GLOBAL=False)
+    assert best_match_for_site(gallery, encodings[3], "A")[0] != "u4"
+    matches = best_matches_for_site(gallery, encodings[[0, 3]], "A")
+    assert matches[0][0] == "u1" and matches[1][0] != "u4"
+
+
+def test_without_site_id_search_is_global(gallery, rng, app_settings):
+    _, _, encodings = _load(gallery, rng)
+    assert best_match_for_site(gallery, encodings[3], None)[0] == "u4"
+
+    plain = FaceGallery()
+    plain.load_arrays([1], ["u1"], encodings[:1])
+    assert best_match_for_site(plain, encodings[0], "A")[0] == "u1"
+    assert best_matches_for_site(plain, encodings[:1], "A")[0][0] == "u1"
+
+
+def test_empty_site_gallery():
+    gallery = SiteFaceGallery(FACTORIES["exact"])
+    gallery.load_arrays([], [], np.empty((0, ENCODING_DIM), dtype=np.float32))
+
+    assert len(gallery) == 0 and gallery.site_count() == 0
+    assert gallery.best_match(np.zeros(ENCODING_DIM)) == (None, float("inf"))
+    assert gallery.version() == (0, 0, 0)
+    assert gallery.export_site_arrays()[0].shape == (0,)
+
+
+@pytest.mark.parametrize("site_id, valid", [
+    (None, True),
+    ("site-paris", True),
+    ("", False),
+    ("x" * 256, False),
+    ("a\tb", False),
+    ("a\\b", False),
+])
+def test_site_id_error(site_id, valid):
+    assert (site_id_error(site_id) is None) == valid